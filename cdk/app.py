@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import aws_cdk as cdk
+import json
 import os
 
 from templates.shared_infra_stack import SharedInfraStack
@@ -8,6 +9,7 @@ from templates.ec2_stack import Ec2Stack
 from templates.ecs_stack import EcsStack
 from templates.lambda_stack import LambdaStack
 from templates.ec2_k6_stack import Ec2K6Stack
+from templates.shapes import ScalingPolicy, load_matrix
 
 
 app = cdk.App()
@@ -17,12 +19,17 @@ env = cdk.Environment(
 )
 shared_infra_stack = SharedInfraStack(app, "cost-comparison-shared-infra", env=env)
 
+# `-c scaling='{"concurrency_target": 70}'` changes the EC2 and ECS policy.
+scaling = app.node.try_get_context("scaling") or {}
+policy = ScalingPolicy(**(json.loads(scaling) if isinstance(scaling, str) else scaling))
+
 ec2_stack = Ec2Stack(
     app,
     "cost-comparison-ec2",
     env=env,
     vpc=shared_infra_stack.vpc,
     vpc_link=shared_infra_stack.vpc_link,
+    policy=policy,
 )
 ecs_stack = EcsStack(
     app,
@@ -30,6 +37,7 @@ ecs_stack = EcsStack(
     env=env,
     vpc=shared_infra_stack.vpc,
     vpc_link=shared_infra_stack.vpc_link,
+    policy=policy,
 )
 lambda_stack = LambdaStack(
     app, "cost-comparison-lambda", env=env, vpc=shared_infra_stack.vpc
@@ -42,4 +50,26 @@ ec2_k6_stack.add_dependency(ec2_stack)
 ec2_k6_stack.add_dependency(ecs_stack)
 ec2_k6_stack.add_dependency(lambda_stack)
 
+# `cdk synth -c matrix=sweeps/lambda-memory.json` adds one stack per variant.
+matrix = app.node.try_get_context("matrix")
+for variant in load_matrix(matrix) if matrix else []:
+    if variant.platform == "lambda":
+        LambdaStack(
+            app,
+            variant.stack_name,
+            env=env,
+            vpc=shared_infra_stack.vpc,
+            shape=variant.shape,
+        )
+    else:
+        (Ec2Stack if variant.platform == "ec2" else EcsStack)(
+            app,
+            variant.stack_name,
+            env=env,
+            vpc=shared_infra_stack.vpc,
+            vpc_link=shared_infra_stack.vpc_link,
+            shape=variant.shape,
+            policy=policy,
+        )
+
 app.synth()
@@ -1,22 +1,30 @@
 #!/bin/bash
 sudo yum update -y
-sudo dnf install --assumeyes python3-pip
+sudo dnf install --assumeyes python3-pip amazon-cloudwatch-agent
+sudo amazon-cloudwatch-agent-ctl -a fetch-config -m ec2 -s -c file:/tmp/imported/statsd.json
 
-echo $1
-echo $2
 export AWS_DEFAULT_REGION=ap-southeast-2
-export S3_BUCKET_NAME=$1
-export DYNAMODB_TABLE=$2
+. /tmp/imported/app.env
+echo $S3_BUCKET_NAME
+echo $DYNAMODB_TABLE
 
 cd /
 mkdir api
 cd api
 cp /tmp/imported/requirements.txt requirements.txt
-cp /tmp/imported/main.py main.py
+cp /tmp/imported/requirements-server.txt requirements-server.txt
+cp -r /tmp/imported/app app
 
 python3 -m venv .venv
 . .venv/bin/activate
-pip install -r requirements.txt
-pip install gunicorn
+pip install -r requirements-server.txt
+python -m app.models build --out /api/botocore-models.pickle
 
-gunicorn --worker-class uvicorn.workers.UvicornWorker --bind '0.0.0.0:80' --daemon main:app
\ No newline at end of file
+python -m app.server --daemon
+
+# cfn-init signals CloudFormation when this script exits; make deployments
+# wait until the API passes the readiness check the target group uses.
+for attempt in $(seq 1 120); do
+    curl -sf -o /dev/null http://127.0.0.1/ready && break
+    sleep 1
+done
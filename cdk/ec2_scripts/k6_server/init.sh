@@ -33,6 +33,8 @@ xk6 build --with github.com/LeonAdato/xk6-output-statsd
 sudo cp /tmp/imported/script-template.js script-template.js
 sudo cp /tmp/imported/dashboard-template.json dashboard-template.json
 sudo cp /tmp/imported/run_k6.sh run_k6.sh
+sudo cp /tmp/imported/hdr.py hdr.py
+sudo yum -y install python3
 sudo sysctl -w net.ipv4.ip_local_port_range="1024 65535"
 sudo sysctl -w net.ipv4.tcp_tw_reuse=1
 sudo sysctl -w net.ipv4.tcp_timestamps=1
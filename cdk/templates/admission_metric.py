@@ -0,0 +1,17 @@
+from aws_cdk import Duration, aws_cloudwatch
+
+from templates.statsd_agent import AGENT_CONFIG
+
+# Published by every API worker with PutMetricData (app/admission.py).
+NAMESPACE = AGENT_CONFIG["metrics"]["namespace"]
+
+
+def concurrency_utilization(stack_name: str) -> aws_cloudwatch.Metric:
+    """In-flight plus queued requests as a percentage of the limit, per worker."""
+    return aws_cloudwatch.Metric(
+        namespace=NAMESPACE,
+        metric_name="ConcurrencyUtilization",
+        dimensions_map={"Service": stack_name},
+        period=Duration.minutes(1),
+        statistic=aws_cloudwatch.Stats.AVERAGE,
+    )
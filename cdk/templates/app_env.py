@@ -0,0 +1,25 @@
+import json
+from constructs import Construct
+
+
+def app_environment(
+    scope: Construct, bucket_name: str, table_name: str, **defaults: str
+) -> dict:
+    """Environment for the API process, extended by the `app_env` context.
+
+    e.g. `cdk deploy cost-comparison-ecs -c app_env='{"IO_MODE": "async"}'`
+    """
+    environment = {
+        "S3_BUCKET_NAME": bucket_name,
+        "DYNAMODB_TABLE": table_name,
+        **defaults,
+    }
+    overrides = scope.node.try_get_context("app_env") or {}
+    if isinstance(overrides, str):
+        overrides = json.loads(overrides)
+    environment.update({key: str(value) for key, value in overrides.items()})
+    return environment
+
+
+def shell_exports(environment: dict) -> str:
+    return "".join(f"export {key}='{value}'\n" for key, value in environment.items())
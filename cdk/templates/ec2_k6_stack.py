@@ -73,6 +73,9 @@ class Ec2K6Stack(Stack):
                     "/tmp/imported/dashboard-template.json",
                     "../load-testing/dashboard-template.json",
                 ),
+                aws_ec2.InitFile.from_asset(
+                    "/tmp/imported/hdr.py", "../load-testing/perf/hdr.py"
+                ),
                 aws_ec2.InitCommand.shell_command("chmod 755 /tmp/imported/init.sh"),
                 aws_ec2.InitCommand.shell_command(
                     "chmod 777 /tmp/imported/statsd.json"
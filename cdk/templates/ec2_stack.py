@@ -1,3 +1,5 @@
+import dataclasses
+import json
 from os import path
 from constructs import Construct
 from aws_cdk import (
@@ -12,10 +14,16 @@ from aws_cdk import (
     aws_s3,
     aws_dynamodb,
     aws_cloudwatch,
+    aws_iam,
     RemovalPolicy,
     CfnOutput,
 )
 
+from templates.admission_metric import concurrency_utilization
+from templates.app_env import app_environment, shell_exports
+from templates.shapes import Ec2Shape, ScalingPolicy
+from templates.statsd_agent import agent_config_json
+
 
 class Ec2Stack(Stack):
     def __init__(
@@ -24,6 +32,8 @@ class Ec2Stack(Stack):
         construct_id: str,
         vpc: aws_ec2.Vpc,
         vpc_link=apigwv2.VpcLink,
+        shape: Ec2Shape = Ec2Shape(),
+        policy: ScalingPolicy = ScalingPolicy(),
         **kwargs,
     ) -> None:
         super().__init__(scope, construct_id, **kwargs)
@@ -61,18 +71,20 @@ class Ec2Stack(Stack):
             self,
             f"{construct_id}-ASG",
             vpc=vpc,
-            instance_type=aws_ec2.InstanceType.of(
-                aws_ec2.InstanceClass.M6G, aws_ec2.InstanceSize.MEDIUM
-            ),
+            instance_type=aws_ec2.InstanceType(shape.instance_type),
             machine_image=aws_ec2.MachineImage.latest_amazon_linux2023(
-                cpu_type=aws_ec2.AmazonLinuxCpuType.ARM_64
+                cpu_type=(
+                    aws_ec2.AmazonLinuxCpuType.ARM_64
+                    if shape.architecture == "arm64"
+                    else aws_ec2.AmazonLinuxCpuType.X86_64
+                )
             ),
             allow_all_outbound=True,
             health_check=aws_autoscaling.HealthCheck.ec2(),
             security_group=ec2_sg,
-            desired_capacity=2,
-            min_capacity=2,
-            max_capacity=50,
+            desired_capacity=shape.desired_capacity,
+            min_capacity=shape.min_capacity,
+            max_capacity=shape.max_capacity,
             group_metrics=[aws_autoscaling.GroupMetrics.all()],
             instance_monitoring=aws_autoscaling.Monitoring.DETAILED,
             init=aws_ec2.CloudFormationInit.from_elements(
@@ -80,15 +92,36 @@ class Ec2Stack(Stack):
                     "/tmp/imported/requirements.txt", "../src/requirements.txt"
                 ),
                 aws_ec2.InitFile.from_asset(
-                    "/tmp/imported/main.py", "../src/app/main.py"
+                    "/tmp/imported/requirements-server.txt",
+                    "../src/requirements-server.txt",
+                ),
+                aws_ec2.InitSource.from_asset("/tmp/imported/app", "../src/app"),
+                aws_ec2.InitFile.from_string(
+                    "/tmp/imported/app.env",
+                    shell_exports(
+                        app_environment(
+                            self,
+                            bucket.bucket_name,
+                            ddb_table.table_name,
+                            PLATFORM="ec2",
+                            STATSD_HOST="127.0.0.1",
+                            ADMISSION_METRICS_SERVICE=construct_id,
+                            # Shed load only where the fleet scales on the shedding
+                            # metrics; otherwise requests queue, as in the baseline.
+                            ADMISSION_CONTROL=str(
+                                policy.concurrency_target is not None
+                            ).lower(),
+                        )
+                    ),
+                ),
+                aws_ec2.InitFile.from_string(
+                    "/tmp/imported/statsd.json", agent_config_json()
                 ),
                 aws_ec2.InitFile.from_asset(
                     "/tmp/imported/init.sh", "ec2_scripts/ec2_scenario/init.sh"
                 ),
                 aws_ec2.InitCommand.shell_command("chmod 755 tmp/imported/init.sh"),
-                aws_ec2.InitCommand.shell_command(
-                    f"tmp/imported/init.sh {bucket.bucket_name} {ddb_table.table_name}"
-                ),
+                aws_ec2.InitCommand.shell_command("tmp/imported/init.sh"),
             ),
             signals=aws_autoscaling.Signals.wait_for_all(timeout=Duration.minutes(5)),
         )
@@ -104,18 +137,27 @@ class Ec2Stack(Stack):
             "KeepSpareCPU",
             metric=max_cpu_metric,
             scaling_steps=[
-                aws_autoscaling.ScalingInterval(upper=15, change=-3),
-                aws_autoscaling.ScalingInterval(upper=25, change=-1),
-                aws_autoscaling.ScalingInterval(lower=40, change=+1),
-                aws_autoscaling.ScalingInterval(lower=60, change=+3),
-                aws_autoscaling.ScalingInterval(lower=80, change=+5),
+                aws_autoscaling.ScalingInterval(lower=lower, upper=upper, change=change)
+                for lower, upper, change in policy.steps
             ],
-            cooldown=Duration.seconds(60),
-            estimated_instance_warmup=Duration.seconds(60),
+            cooldown=Duration.seconds(policy.cooldown),
+            estimated_instance_warmup=Duration.seconds(policy.warmup),
             adjustment_type=aws_autoscaling.AdjustmentType.CHANGE_IN_CAPACITY,
         )
+        if policy.concurrency_target is not None:
+            asg.scale_to_track_metric(
+                "KeepSpareConcurrency",
+                metric=concurrency_utilization(construct_id),
+                target_value=policy.concurrency_target,
+                estimated_instance_warmup=Duration.seconds(policy.warmup),
+            )
 
-        ddb_table.grant_write_data(asg.role)
+        asg.role.add_managed_policy(
+            aws_iam.ManagedPolicy.from_aws_managed_policy_name(
+                "CloudWatchAgentServerPolicy"
+            )
+        )
+        ddb_table.grant_read_write_data(asg.role)
         bucket.grant_read_write(asg.role)
 
         lb = elb2.ApplicationLoadBalancer(
@@ -129,11 +171,14 @@ class Ec2Stack(Stack):
             "ApplicationFleet",
             port=80,
             targets=[asg],
+            # /ready passes once the instance's AWS connections are warm; two
+            # quick checks put it in service instead of five a minute apart.
             health_check=elb2.HealthCheck(
-                path="/health",
+                path="/ready",
+                healthy_threshold_count=2,
                 unhealthy_threshold_count=10,
-                timeout=Duration.seconds(30),
-                interval=Duration.seconds(60),
+                timeout=Duration.seconds(5),
+                interval=Duration.seconds(10),
             ),
         )
 
@@ -160,3 +205,4 @@ class Ec2Stack(Stack):
 
         CfnOutput(self, "HttpApiUrl", value=http_api.url)
         CfnOutput(self, "ASGName", value=asg.auto_scaling_group_name)
+        CfnOutput(self, "Shape", value=json.dumps(dataclasses.asdict(shape)))
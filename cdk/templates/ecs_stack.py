@@ -1,3 +1,5 @@
+import dataclasses
+import json
 from os import path
 from constructs import Construct
 from aws_cdk import (
@@ -12,11 +14,17 @@ from aws_cdk import (
     aws_dynamodb,
     aws_cloudwatch,
     aws_applicationautoscaling,
+    aws_iam,
     RemovalPolicy,
     CfnOutput,
     Duration,
 )
 
+from templates.admission_metric import concurrency_utilization
+from templates.app_env import app_environment
+from templates.shapes import EcsShape, ScalingPolicy
+from templates.statsd_agent import agent_config_json
+
 
 class EcsStack(Stack):
     def __init__(
@@ -25,6 +33,8 @@ class EcsStack(Stack):
         construct_id: str,
         vpc: aws_ec2.Vpc,
         vpc_link=apigwv2.VpcLink,
+        shape: EcsShape = EcsShape(),
+        policy: ScalingPolicy = ScalingPolicy(),
         **kwargs,
     ) -> None:
         super().__init__(scope, construct_id, **kwargs)
@@ -62,10 +72,17 @@ class EcsStack(Stack):
             image=aws_ecs.ContainerImage.from_asset(
                 directory="../src",
             ),
-            environment={
-                "S3_BUCKET_NAME": bucket.bucket_name,
-                "DYNAMODB_TABLE": ddb_table.table_name,
-            },
+            environment=app_environment(
+                self,
+                bucket.bucket_name,
+                ddb_table.table_name,
+                PLATFORM="ecs",
+                STATSD_HOST="127.0.0.1",
+                ADMISSION_METRICS_SERVICE=construct_id,
+                # Shed load only where the fleet scales on the shedding
+                # metrics; otherwise requests queue, as in the baseline.
+                ADMISSION_CONTROL=str(policy.concurrency_target is not None).lower(),
+            ),
         )
 
         load_balanced_fargate_service = (
@@ -73,20 +90,45 @@ class EcsStack(Stack):
                 self,
                 f"{construct_id}-service",
                 cluster=cluster,
-                desired_count=2,
-                cpu=1024,
-                memory_limit_mib=2048,
+                desired_count=shape.desired_count,
+                cpu=shape.cpu,
+                memory_limit_mib=shape.memory_limit_mib,
                 task_image_options=image,
-                load_balancer_name=f"{construct_id}-alb",
+                # ALB names are limited to 32 characters; longer variant stack
+                # names leave naming to CloudFormation.
+                load_balancer_name=(
+                    f"{construct_id}-alb" if len(construct_id) <= 28 else None
+                ),
                 public_load_balancer=False,
                 runtime_platform=aws_ecs.RuntimePlatform(
                     operating_system_family=aws_ecs.OperatingSystemFamily.LINUX,
-                    cpu_architecture=aws_ecs.CpuArchitecture.ARM64,
+                    cpu_architecture=(
+                        aws_ecs.CpuArchitecture.ARM64
+                        if shape.architecture == "arm64"
+                        else aws_ecs.CpuArchitecture.X86_64
+                    ),
                 ),
             )
         )
+        task_definition = load_balanced_fargate_service.task_definition
+        task_definition.add_container(
+            "cloudwatch-agent",
+            image=aws_ecs.ContainerImage.from_registry(
+                "public.ecr.aws/cloudwatch-agent/cloudwatch-agent:latest"
+            ),
+            environment={"CW_CONFIG_CONTENT": agent_config_json()},
+            essential=False,
+            memory_reservation_mib=64,
+            logging=aws_ecs.LogDrivers.aws_logs(stream_prefix="cloudwatch-agent"),
+        )
+        task_definition.task_role.add_managed_policy(
+            aws_iam.ManagedPolicy.from_aws_managed_policy_name(
+                "CloudWatchAgentServerPolicy"
+            )
+        )
+
         scaling = load_balanced_fargate_service.service.auto_scale_task_count(
-            min_capacity=2, max_capacity=50
+            min_capacity=shape.min_capacity, max_capacity=shape.max_capacity
         )
         max_cpu_metric = aws_cloudwatch.Metric(
             metric_name="CPUUtilization",
@@ -102,23 +144,33 @@ class EcsStack(Stack):
             "KeepSpareCPU",
             metric=max_cpu_metric,
             scaling_steps=[
-                aws_applicationautoscaling.ScalingInterval(upper=15, change=-3),
-                aws_applicationautoscaling.ScalingInterval(upper=25, change=-1),
-                aws_applicationautoscaling.ScalingInterval(lower=40, change=+1),
-                aws_applicationautoscaling.ScalingInterval(lower=60, change=+3),
-                aws_applicationautoscaling.ScalingInterval(lower=80, change=+5),
+                aws_applicationautoscaling.ScalingInterval(
+                    lower=lower, upper=upper, change=change
+                )
+                for lower, upper, change in policy.steps
             ],
-            cooldown=Duration.seconds(60),
+            cooldown=Duration.seconds(policy.cooldown),
             adjustment_type=aws_applicationautoscaling.AdjustmentType.CHANGE_IN_CAPACITY,
             datapoints_to_alarm=1,
         )
+        if policy.concurrency_target is not None:
+            scaling.scale_to_track_custom_metric(
+                "KeepSpareConcurrency",
+                metric=concurrency_utilization(construct_id),
+                target_value=policy.concurrency_target,
+                scale_in_cooldown=Duration.seconds(policy.cooldown),
+                scale_out_cooldown=Duration.seconds(policy.cooldown),
+            )
+        # /ready passes once the task's AWS connections are warm; two quick
+        # checks put it in service instead of five a minute apart.
         load_balanced_fargate_service.target_group.configure_health_check(
-            path="/health",
+            path="/ready",
+            healthy_threshold_count=2,
             unhealthy_threshold_count=10,
-            timeout=Duration.seconds(30),
-            interval=Duration.seconds(60),
+            timeout=Duration.seconds(5),
+            interval=Duration.seconds(10),
         )
-        ddb_table.grant_write_data(
+        ddb_table.grant_read_write_data(
             load_balanced_fargate_service.task_definition.task_role
         )
         bucket.grant_read_write(load_balanced_fargate_service.task_definition.task_role)
@@ -155,3 +207,4 @@ class EcsStack(Stack):
             "EcsClusterName",
             value=load_balanced_fargate_service.cluster.cluster_name,
         )
+        CfnOutput(self, "Shape", value=json.dumps(dataclasses.asdict(shape)))
@@ -1,3 +1,5 @@
+import dataclasses
+import json
 from os import path
 from constructs import Construct
 from aws_cdk import (
@@ -15,10 +17,19 @@ from aws_cdk import (
     CfnOutput,
 )
 
+from templates.app_env import app_environment
+from templates.shapes import LambdaShape
+from templates.statsd_agent import AGENT_CONFIG
+
 
 class LambdaStack(Stack):
     def __init__(
-        self, scope: Construct, construct_id: str, vpc: aws_ec2.Vpc, **kwargs
+        self,
+        scope: Construct,
+        construct_id: str,
+        vpc: aws_ec2.Vpc,
+        shape: LambdaShape = LambdaShape(),
+        **kwargs,
     ) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
@@ -54,18 +65,28 @@ class LambdaStack(Stack):
             entry="../src/",
             index="app/main.py",
             handler="handler",
-            memory_size=512,
+            memory_size=shape.memory_size,
+            architecture=(
+                aws_lambda.Architecture.ARM_64
+                if shape.architecture == "arm64"
+                else aws_lambda.Architecture.X86_64
+            ),
             timeout=Duration.seconds(30),
-            environment={
-                "S3_BUCKET_NAME": bucket.bucket_name,
-                "DYNAMODB_TABLE": ddb_table.table_name,
-            },
+            environment=app_environment(
+                self,
+                bucket.bucket_name,
+                ddb_table.table_name,
+                PLATFORM="lambda",
+                # No StatsD agent runs beside a function; CloudWatch Logs
+                # extracts the same timings from EMF log lines.
+                EMF_NAMESPACE=AGENT_CONFIG["metrics"]["namespace"],
+            ),
             bundling=aws_lambda_python_alpha.BundlingOptions(
-                asset_excludes=["Dockerfile"]
+                asset_excludes=["Dockerfile", "tests"]
             ),
             vpc=vpc,
         )
-        ddb_table.grant_write_data(api_lambda)
+        ddb_table.grant_read_write_data(api_lambda)
         bucket.grant_read_write(api_lambda)
 
         http_api = apigwv2.HttpApi(
@@ -88,3 +109,4 @@ class LambdaStack(Stack):
 
         CfnOutput(self, "HttpApiUrl", value=http_api.url)
         CfnOutput(self, "LambdaFunctionName", value=api_lambda.function_name)
+        CfnOutput(self, "Shape", value=json.dumps(dataclasses.asdict(shape)))
@@ -0,0 +1,202 @@
+"""Compute shapes of the API stacks, and sweeps over them.
+
+Each stack takes a shape; the defaults are the shapes the comparison was
+designed around. A sweep file synthesizes one extra, uniquely named stack
+per shape, e.g. `cdk synth -c matrix=sweeps/lambda-memory.json`:
+
+    {"lambda": {"memory_size": [256, 512, 1024, 1769]},
+     "ecs": [{"cpu": 512, "memory_limit_mib": 1024},
+             {"cpu": 2048, "memory_limit_mib": 4096}]}
+
+A platform maps to either a dict of lists, whose product is swept, or a list
+of overrides. Only the fields given differ from the default shape, and they
+name the stack: `cost-comparison-lambda-mem1024`.
+
+This module only uses the standard library, so `perf.cost` can read the
+same shapes without the CDK installed.
+"""
+
+import dataclasses
+import itertools
+import json
+from typing import List, Optional, Tuple, Union
+
+ARCHITECTURES = ("arm64", "x86_64")
+STACK_PREFIX = "cost-comparison"
+
+# vCPU units to the memory sizes Fargate accepts with them, in MiB.
+FARGATE_MEMORY = {
+    256: (512, 1024, 2048),
+    512: tuple(range(1024, 4097, 1024)),
+    1024: tuple(range(2048, 8193, 1024)),
+    2048: tuple(range(4096, 16385, 1024)),
+    4096: tuple(range(8192, 30721, 1024)),
+    8192: tuple(range(16384, 61441, 4096)),
+    16384: tuple(range(32768, 122881, 8192)),
+}
+
+
+def _check_architecture(architecture: str) -> None:
+    if architecture not in ARCHITECTURES:
+        raise ValueError(f"architecture must be one of {', '.join(ARCHITECTURES)}")
+
+
+def _check_bounds(minimum: int, desired: int, maximum: int) -> None:
+    if not 0 <= minimum <= desired <= maximum:
+        raise ValueError("scaling bounds must satisfy 0 <= min <= desired <= max")
+
+
+@dataclasses.dataclass(frozen=True)
+class Ec2Shape:
+    instance_type: str = "m6g.medium"
+    min_capacity: int = 2
+    desired_capacity: int = 2
+    max_capacity: int = 50
+
+    def __post_init__(self) -> None:
+        if "." not in self.instance_type:
+            raise ValueError("instance_type must look like m6g.medium")
+        _check_bounds(self.min_capacity, self.desired_capacity, self.max_capacity)
+
+    @property
+    def architecture(self) -> str:
+        # Graviton families carry a "g" after the generation: m6g, c7gn, t4g.
+        family = self.instance_type.split(".")[0]
+        attributes = family.lstrip("abcdefghijklmnopqrstuvwxyz").lstrip("0123456789")
+        return "arm64" if attributes.startswith("g") else "x86_64"
+
+
+@dataclasses.dataclass(frozen=True)
+class EcsShape:
+    cpu: int = 1024
+    memory_limit_mib: int = 2048
+    architecture: str = "arm64"
+    min_capacity: int = 2
+    desired_count: int = 2
+    max_capacity: int = 50
+
+    def __post_init__(self) -> None:
+        if self.memory_limit_mib not in FARGATE_MEMORY.get(self.cpu, ()):
+            raise ValueError(
+                f"Fargate does not run {self.cpu} CPU units "
+                f"with {self.memory_limit_mib} MiB"
+            )
+        _check_architecture(self.architecture)
+        _check_bounds(self.min_capacity, self.desired_count, self.max_capacity)
+
+
+@dataclasses.dataclass(frozen=True)
+class LambdaShape:
+    memory_size: int = 512
+    architecture: str = "x86_64"
+
+    def __post_init__(self) -> None:
+        if not 128 <= self.memory_size <= 10240:
+            raise ValueError("memory_size must be between 128 and 10240 MB")
+        _check_architecture(self.architecture)
+
+
+@dataclasses.dataclass(frozen=True)
+class ScalingPolicy:
+    """The KeepSpareCPU step scaling on maximum CPU of the EC2 and ECS stacks.
+
+    Each step is `(lower, upper, change)` in CPU percent; None is unbounded.
+    With `concurrency_target`, the fleet also tracks that average
+    `ConcurrencyUtilization` (app/admission.py), which rises with queueing
+    before CPU does.
+    """
+
+    steps: Tuple[Tuple[Optional[float], Optional[float], int], ...] = (
+        (None, 15, -3),
+        (None, 25, -1),
+        (40, None, +1),
+        (60, None, +3),
+        (80, None, +5),
+    )
+    cooldown: int = 60
+    warmup: int = 60
+    concurrency_target: Optional[float] = None
+
+    def __post_init__(self) -> None:
+        # Sweep files give the steps as lists.
+        object.__setattr__(self, "steps", tuple(tuple(step) for step in self.steps))
+        for lower, upper, change in self.steps:
+            if (lower is None) == (upper is None):
+                raise ValueError("a step has either a lower or an upper bound")
+        if self.concurrency_target is not None and self.concurrency_target <= 0:
+            raise ValueError("concurrency_target must be a positive percentage")
+
+
+SHAPES = {"ec2": Ec2Shape, "ecs": EcsShape, "lambda": LambdaShape}
+Shape = Union[Ec2Shape, EcsShape, LambdaShape]
+
+
+@dataclasses.dataclass(frozen=True)
+class Variant:
+    platform: str
+    stack_name: str
+    shape: Shape
+
+
+# How an overridden field appears in a stack name; values are appended.
+NAME_LABELS = {
+    "instance_type": "",
+    "cpu": "cpu",
+    "memory_limit_mib": "mem",
+    "memory_size": "mem",
+    "architecture": "",
+    "min_capacity": "min",
+    "desired_capacity": "desired",
+    "desired_count": "desired",
+    "max_capacity": "max",
+}
+
+
+def stack_name(platform: str, overrides: dict) -> str:
+    """`cost-comparison-<platform>`, suffixed with the overridden fields."""
+    parts = [STACK_PREFIX, platform]
+    for field in dataclasses.fields(SHAPES[platform]):
+        if field.name in overrides:
+            value = str(overrides[field.name]).replace("x86_64", "x86")
+            parts.append(f"{NAME_LABELS[field.name]}{value}".replace(".", "-"))
+    return "-".join(parts)
+
+
+def expand(sweep: Union[dict, list]) -> List[dict]:
+    """Overrides from a dict of lists (their product) or a list of overrides."""
+    if isinstance(sweep, list):
+        return [dict(overrides) for overrides in sweep]
+    fields = sorted(sweep)
+    values = [
+        sweep[field] if isinstance(sweep[field], list) else [sweep[field]]
+        for field in fields
+    ]
+    return [
+        dict(zip(fields, combination)) for combination in itertools.product(*values)
+    ]
+
+
+def variants(matrix: dict) -> List[Variant]:
+    """The stacks a sweep definition describes, validated and uniquely named."""
+    result = []
+    names = set()
+    for platform, sweep in matrix.items():
+        if platform not in SHAPES:
+            raise ValueError(
+                f"unknown platform {platform!r}; expected one of {', '.join(SHAPES)}"
+            )
+        for overrides in expand(sweep):
+            if not overrides:
+                raise ValueError(f"a {platform} variant must override a field")
+            shape = SHAPES[platform](**overrides)
+            name = stack_name(platform, overrides)
+            if name in names:
+                raise ValueError(f"{name} is defined twice")
+            names.add(name)
+            result.append(Variant(platform, name, shape))
+    return result
+
+
+def load_matrix(path: str) -> List[Variant]:
+    with open(path) as sweep:
+        return variants(json.load(sweep))
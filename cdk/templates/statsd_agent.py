@@ -0,0 +1,19 @@
+import json
+
+# CloudWatch agent configuration for the API's StatsD timings (app/telemetry.py).
+AGENT_CONFIG = {
+    "metrics": {
+        "namespace": "cost-comparison-app",
+        "metrics_collected": {
+            "statsd": {
+                "service_address": ":8125",
+                "metrics_collection_interval": 10,
+                "metrics_aggregation_interval": 60,
+            }
+        },
+    }
+}
+
+
+def agent_config_json() -> str:
+    return json.dumps(AGENT_CONFIG, indent=4)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""Checks that synthesized API stacks have the compute shapes they were given.
+
+    cdk synth -c matrix=sweeps/lambda-memory.json
+    python verify_synth.py cdk.out sweeps/lambda-memory.json
+
+The default stacks are checked against the default shapes and every variant
+of the sweep against its own: instance type, AMI architecture and ASG
+bounds on EC2; task CPU, memory, architecture and scaling bounds on ECS;
+memory size and architecture on Lambda. The EC2 and ECS target groups must
+check `/ready`, and every stack must output `HttpApiUrl` and its shape,
+which `run_k6.sh` and `perf.cost` read.
+"""
+
+import dataclasses
+import json
+import os
+import sys
+from typing import List
+
+from templates.shapes import (
+    STACK_PREFIX,
+    Ec2Shape,
+    EcsShape,
+    LambdaShape,
+    Variant,
+    load_matrix,
+)
+
+DEFAULTS = [
+    Variant("ec2", f"{STACK_PREFIX}-ec2", Ec2Shape()),
+    Variant("ecs", f"{STACK_PREFIX}-ecs", EcsShape()),
+    Variant("lambda", f"{STACK_PREFIX}-lambda", LambdaShape()),
+]
+
+
+def _resources(template: dict, resource_type: str) -> List[dict]:
+    return [
+        resource["Properties"]
+        for resource in template["Resources"].values()
+        if resource["Type"] == resource_type
+    ]
+
+
+def _one(template: dict, resource_type: str, **match) -> dict:
+    found = [
+        properties
+        for properties in _resources(template, resource_type)
+        if all(properties.get(key) == value for key, value in match.items())
+    ]
+    if len(found) != 1:
+        raise AssertionError(f"expected one {resource_type}, found {len(found)}")
+    return found[0]
+
+
+def _expect(problems: List[str], what: str, actual, expected) -> None:
+    if actual != expected:
+        problems.append(f"{what} is {actual!r}, expected {expected!r}")
+
+
+def _check_target_group(problems: List[str], template: dict) -> None:
+    group = _one(template, "AWS::ElasticLoadBalancingV2::TargetGroup")
+    _expect(problems, "health check path", group.get("HealthCheckPath"), "/ready")
+
+
+def check_ec2(template: dict, shape: Ec2Shape) -> List[str]:
+    problems = []
+    launch = _one(template, "AWS::AutoScaling::LaunchConfiguration")
+    _expect(problems, "instance type", launch["InstanceType"], shape.instance_type)
+    image = template["Parameters"][launch["ImageId"]["Ref"]]["Default"]
+    _expect(problems, "AMI architecture", image.rsplit("-", 1)[-1], shape.architecture)
+    group = _one(template, "AWS::AutoScaling::AutoScalingGroup")
+    _expect(problems, "ASG MinSize", group["MinSize"], str(shape.min_capacity))
+    _expect(problems, "ASG MaxSize", group["MaxSize"], str(shape.max_capacity))
+    _expect(
+        problems,
+        "ASG DesiredCapacity",
+        group["DesiredCapacity"],
+        str(shape.desired_capacity),
+    )
+    _check_target_group(problems, template)
+    return problems
+
+
+def check_ecs(template: dict, shape: EcsShape) -> List[str]:
+    problems = []
+    task = _one(template, "AWS::ECS::TaskDefinition")
+    _expect(problems, "task Cpu", task["Cpu"], str(shape.cpu))
+    _expect(problems, "task Memory", task["Memory"], str(shape.memory_limit_mib))
+    _expect(
+        problems,
+        "task CpuArchitecture",
+        task["RuntimePlatform"]["CpuArchitecture"],
+        shape.architecture.upper(),
+    )
+    service = _one(template, "AWS::ECS::Service")
+    _expect(
+        problems, "service DesiredCount", service["DesiredCount"], shape.desired_count
+    )
+    target = _one(template, "AWS::ApplicationAutoScaling::ScalableTarget")
+    _expect(problems, "MinCapacity", target["MinCapacity"], shape.min_capacity)
+    _expect(problems, "MaxCapacity", target["MaxCapacity"], shape.max_capacity)
+    _check_target_group(problems, template)
+    return problems
+
+
+def check_lambda(template: dict, shape: LambdaShape) -> List[str]:
+    problems = []
+    function = _one(template, "AWS::Lambda::Function", Handler="app.main.handler")
+    _expect(problems, "MemorySize", function["MemorySize"], shape.memory_size)
+    _expect(
+        problems,
+        "Architectures",
+        function.get("Architectures", ["x86_64"]),
+        [shape.architecture],
+    )
+    return problems
+
+
+CHECKS = {"ec2": check_ec2, "ecs": check_ecs, "lambda": check_lambda}
+
+
+def check(out_dir: str, variant: Variant) -> List[str]:
+    path = os.path.join(out_dir, f"{variant.stack_name}.template.json")
+    if not os.path.exists(path):
+        return [f"{path} was not synthesized"]
+    with open(path) as template_file:
+        template = json.load(template_file)
+    try:
+        problems = CHECKS[variant.platform](template, variant.shape)
+    except (AssertionError, KeyError) as exc:
+        return [f"unexpected template: {exc}"]
+    outputs = template.get("Outputs", {})
+    if "HttpApiUrl" not in outputs:
+        problems.append("no HttpApiUrl output")
+    shape = json.loads(outputs.get("Shape", {}).get("Value", "null"))
+    _expect(problems, "Shape output", shape, dataclasses.asdict(variant.shape))
+    return problems
+
+
+def main() -> None:
+    if len(sys.argv) not in (2, 3):
+        sys.exit(f"usage: {sys.argv[0]} CDK_OUT [SWEEP_JSON]")
+    out_dir = sys.argv[1]
+    variants = DEFAULTS + (load_matrix(sys.argv[2]) if len(sys.argv) == 3 else [])
+    failed = False
+    for variant in variants:
+        problems = check(out_dir, variant)
+        print(f"{'FAIL' if problems else 'ok':<5}{variant.stack_name}")
+        for problem in problems:
+            print(f"     {problem}")
+        failed = failed or bool(problems)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""CPU cost per request of the ASGI fast paths, measured in-process.
+
+    cd load-testing
+    python -m perf.asgi_bench --requests 20000
+
+Requests are fed straight into the ASGI app, without sockets, and CPU time
+(`time.process_time`) is divided by the request count, so the numbers are
+the app's own per-request CPU, the quantity the CPU step scaling reacts to.
+Every case runs in a fresh interpreter because the app reads its settings at
+import.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from .local_stack import SRC_DIR
+
+CASES = {
+    "health-route": ({"HEALTH_FAST_PATH": "false"}, "app.main:app", "/health"),
+    "health-fast-path": ({"HEALTH_FAST_PATH": "true"}, "app.main:app", "/health"),
+    # The two ways of returning {"id": ...} from process_request, isolated from
+    # the storage writes.
+    "id-dict": ({}, "perf.asgi_bench:dict_app", "/"),
+    "id-fast-response": ({}, "perf.asgi_bench:fast_response_app", "/"),
+}
+
+
+def _response_apps():
+    import uuid
+
+    from fastapi import FastAPI
+
+    from app.fast_path import FastJSONResponse
+
+    dict_app = FastAPI()
+    fast_response_app = FastAPI()
+
+    @dict_app.get("/")
+    def dict_route():
+        return {"id": str(uuid.uuid4())}
+
+    @fast_response_app.get("/", response_class=FastJSONResponse)
+    def fast_response_route():
+        return FastJSONResponse({"id": str(uuid.uuid4())})
+
+    return dict_app, fast_response_app
+
+
+def __getattr__(name):
+    if name in ("dict_app", "fast_response_app"):
+        dict_app, fast_response_app = _response_apps()
+        return dict_app if name == "dict_app" else fast_response_app
+    raise AttributeError(name)
+
+
+async def _drive(app, path: str, requests: int) -> dict:
+    import time
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"localhost")],
+        "client": ("127.0.0.1", 50000),
+        "server": ("127.0.0.1", 80),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    statuses = []
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            statuses.append(message["status"])
+
+    for _ in range(min(1000, requests)):  # warm up
+        await app(dict(scope), receive, send)
+    statuses.clear()
+    cpu_started = time.process_time()
+    wall_started = time.perf_counter()
+    for _ in range(requests):
+        await app(dict(scope), receive, send)
+    cpu = time.process_time() - cpu_started
+    wall = time.perf_counter() - wall_started
+    assert set(statuses) == {200}, set(statuses)
+    return {"cpu_us": cpu / requests * 1e6, "wall_us": wall / requests * 1e6}
+
+
+def run_case(target: str, path: str, requests: int) -> dict:
+    import asyncio
+    import importlib
+
+    module_name, attribute = target.split(":")
+    app = getattr(importlib.import_module(module_name), attribute)
+    return asyncio.run(_drive(app, path, requests))
+
+
+def measure(case: str, requests: int) -> dict:
+    env_overrides, target, path = CASES[case]
+    load_testing_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.pathsep.join([SRC_DIR, load_testing_dir]),
+        **env_overrides,
+    )
+    env.pop("STATSD_HOST", None)
+    completed = subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "perf.asgi_bench",
+            "--case",
+            case,
+            "--requests",
+            str(requests),
+        ],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(completed.stdout)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--case", choices=CASES, help=argparse.SUPPRESS)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    if args.case:
+        _, target, path = CASES[args.case]
+        print(json.dumps(run_case(target, path, args.requests)))
+        return
+
+    results = {case: measure(case, args.requests) for case in CASES}
+    print(f"{'case':<20}{'cpu us/req':>12}{'wall us/req':>13}")
+    for case, result in results.items():
+        print(f"{case:<20}{result['cpu_us']:>12.1f}{result['wall_us']:>13.1f}")
+    for slow, fast in (
+        ("health-route", "health-fast-path"),
+        ("id-dict", "id-fast-response"),
+    ):
+        saved = results[slow]["cpu_us"] - results[fast]["cpu_us"]
+        share = saved / results[slow]["cpu_us"] * 100
+        print(f"{fast}: {saved:.1f} us CPU saved per request ({share:.0f}%)")
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,425 @@
+"""Simulates the KeepSpareCPU step scaling of the EC2 and ECS stacks offline.
+
+    cd load-testing
+    python -m perf.asgi_bench                # CPU ms per request, measured locally
+    python -m perf.autoscale --platform ecs --cpu-ms 1.8
+    python -m perf.autoscale --platform ec2 --cpu-samples cpu.txt \\
+        --sweep sweep.json --top 10 --timeline ec2.csv
+
+The arrival rate follows `testing_stages` (optionally `--compress`ed and
+`--rate-scale`d) second by second. Requests cost CPU time drawn from the
+measured distribution: its mean sets the CPU utilisation of the fleet, and
+its variability the queueing delay, with the Allen-Cunneen approximation
+for an M/G/c queue per unit and a fluid backlog once the fleet saturates.
+
+Every minute the alarm sees the MAXIMUM of the per-unit CPUUtilization
+averages: round-robin spreads requests evenly only on average, so the
+busiest of N units runs above the mean by about sqrt(2 ln N) standard
+deviations of its Poisson share. The step adjustments then apply as AWS
+does: EC2 counts instances still warming up towards a scale-out and keeps
+them out of the metric, Application Auto Scaling (ECS) ignores alarms
+during the cooldown after a scaling activity. New units serve requests
+once their warmup has passed.
+
+A sweep file varies the policy and the scaling bounds, as a dict of lists
+(their product) or a list of overrides, e.g.
+
+    {"cooldown": [60, 120], "warmup": [30, 60],
+     "steps": [[[null, 15, -3], [null, 25, -1], [40, null, 1], [60, null, 3]],
+               [[null, 20, -1], [50, null, 2], [70, null, 4]]]}
+
+All variants advance together as arrays, one numpy step per simulated
+second, so hundreds of them take little longer than one.
+"""
+
+import argparse
+import csv
+import dataclasses
+import json
+import math
+import os
+import time
+from typing import List, Optional
+
+import numpy
+
+from .cost import CDK_TEMPLATES, _shapes_module
+from .report import PERCENTILES
+from .stages import load_stages, scale
+
+METRIC_PERIOD = 60
+MAX_WAIT = 60.0  # seconds; waits are capped here once a fleet is saturated
+SIZE_VCPUS = {"medium": 1, "large": 2, "xlarge": 4}
+
+
+def unit_vcpus(platform: str, shape) -> float:
+    if platform == "ecs":
+        return shape.cpu / 1024
+    size = shape.instance_type.split(".")[1]
+    if size in SIZE_VCPUS:
+        return SIZE_VCPUS[size]
+    if size.endswith("xlarge"):
+        return 4 * int(size[: -len("xlarge")])
+    raise ValueError(f"unknown vCPUs for {shape.instance_type}")
+
+
+def arrival_rates(start_rate: float, stages) -> numpy.ndarray:
+    """Requests per second for every second of the stages, ramped linearly."""
+    ends = numpy.cumsum([0.0] + [stage.duration for stage in stages])
+    targets = [start_rate] + [stage.target for stage in stages]
+    return numpy.interp(numpy.arange(int(ends[-1])), ends, targets)
+
+
+class ServiceTime:
+    """Mean and squared coefficient of variation of CPU seconds per request."""
+
+    def __init__(self, mean: float, scv: float) -> None:
+        self.mean = mean
+        self.scv = scv
+
+    @classmethod
+    def from_samples(cls, samples_ms: List[float]) -> "ServiceTime":
+        samples = numpy.asarray(samples_ms, dtype=float) / 1000
+        mean = float(samples.mean())
+        return cls(mean, float(samples.var() / mean**2))
+
+    @classmethod
+    def load(cls, path: str) -> "ServiceTime":
+        """One CPU ms value per line, or a JSON list of them."""
+        with open(path) as source:
+            text = source.read()
+        if text.lstrip().startswith("["):
+            return cls.from_samples(json.loads(text))
+        return cls.from_samples([float(line) for line in text.split() if line])
+
+
+@dataclasses.dataclass
+class Variant:
+    name: str
+    steps: tuple
+    cooldown: float
+    warmup: float
+    min_capacity: int
+    max_capacity: int
+    desired_capacity: int
+
+
+def variants(shapes, shape, sweep: Optional[dict] = None) -> List[Variant]:
+    """The deployed policy and bounds of `shape`, or each override of `sweep`."""
+    policy_fields = {field.name for field in dataclasses.fields(shapes.ScalingPolicy)}
+    bounds = {
+        "min_capacity": shape.min_capacity,
+        "max_capacity": shape.max_capacity,
+        "desired_capacity": getattr(shape, "desired_capacity", None)
+        or shape.desired_count,
+    }
+    result = []
+    for overrides in shapes.expand(sweep) if sweep else [{}]:
+        # Target tracking on ConcurrencyUtilization is not simulated.
+        unknown = set(overrides) - (policy_fields - {"concurrency_target"})
+        unknown -= set(bounds)
+        if unknown:
+            raise ValueError(f"cannot sweep {', '.join(sorted(unknown))}")
+        policy = shapes.ScalingPolicy(
+            **{k: v for k, v in overrides.items() if k in policy_fields}
+        )
+        name = ",".join(f"{k}={json.dumps(v)}" for k, v in overrides.items())
+        result.append(
+            Variant(
+                name=name or "as deployed",
+                steps=policy.steps,
+                cooldown=policy.cooldown,
+                warmup=policy.warmup,
+                **{**bounds, **{k: v for k, v in overrides.items() if k in bounds}},
+            )
+        )
+    return result
+
+
+def step_bands(variants: List[Variant]):
+    """Non-overlapping [low, high) CPU bands and their change, padded per variant.
+
+    Upper-bounded steps cover the range from the previous upper bound, as
+    CloudWatch step adjustments do, and lower-bounded ones up to the next.
+    """
+    bands = []
+    for variant in variants:
+        below = sorted((s for s in variant.steps if s[0] is None), key=lambda s: s[1])
+        above = sorted((s for s in variant.steps if s[0] is not None))
+        rows = []
+        low = -math.inf
+        for _, upper, change in below:
+            rows.append((low, upper, change))
+            low = upper
+        for index, (lower, _, change) in enumerate(above):
+            high = above[index + 1][0] if index + 1 < len(above) else math.inf
+            rows.append((lower, high, change))
+        bands.append(rows)
+    width = max(len(rows) for rows in bands)
+    low = numpy.full((len(variants), width), math.inf)
+    high = numpy.full((len(variants), width), math.inf)
+    change = numpy.zeros((len(variants), width))
+    for index, rows in enumerate(bands):
+        for column, (lower, upper, delta) in enumerate(rows):
+            low[index, column], high[index, column] = lower, upper
+            change[index, column] = delta
+    return low, high, change
+
+
+def simulate(
+    rates: numpy.ndarray,
+    variants: List[Variant],
+    service: ServiceTime,
+    vcpus: float,
+    platform: str,
+    idle_cpu: float = 2.0,
+    keep: Optional[int] = None,
+) -> dict:
+    """Runs every variant over `rates`; `keep` records one variant's timeline."""
+    count = len(variants)
+    seconds = len(rates)
+    low, high, change = step_bands(variants)
+    min_capacity = numpy.array([v.min_capacity for v in variants], dtype=float)
+    max_capacity = numpy.array([v.max_capacity for v in variants], dtype=float)
+    cooldown = numpy.array([v.cooldown for v in variants], dtype=float)
+    warmup = numpy.array([v.warmup for v in variants], dtype=int)
+    ready = numpy.clip(
+        numpy.array([v.desired_capacity for v in variants], dtype=float),
+        min_capacity,
+        max_capacity,
+    )
+    launches = numpy.zeros((count, seconds + int(warmup.max()) + 1))
+    warming = numpy.zeros(count)
+    backlog = numpy.zeros(count)
+    blocked_until = numpy.full(count, -math.inf)
+    minute_served = numpy.zeros(count)
+    minute_capacity = numpy.zeros(count)
+    minute_requests = numpy.zeros(count)
+    rows = numpy.arange(count)
+    # Allen-Cunneen for M/G/c with Poisson arrivals and c = vCPUs per unit.
+    variability = (1 + service.scv) / 2
+    exponent = math.sqrt(2 * (vcpus + 1)) - 1
+
+    waits = numpy.empty((seconds, count), dtype=numpy.float32)
+    unit_seconds = numpy.zeros(count)
+    peak_units = ready.copy()
+    saturated = numpy.zeros(count)
+    scale_outs = numpy.zeros(count)
+    scale_ins = numpy.zeros(count)
+    timeline = []
+
+    for second in range(seconds):
+        arrived = launches[:, second]
+        ready += arrived
+        warming -= arrived
+
+        capacity = ready * vcpus
+        work = rates[second] * service.mean
+        total = backlog + work
+        served = numpy.minimum(total, capacity)
+        backlog = total - served
+        utilisation = numpy.minimum(work / capacity, 0.99)
+        queued = (
+            variability
+            * utilisation**exponent
+            / (vcpus * (1 - utilisation))
+            * service.mean
+        )
+        wait = numpy.minimum(queued + backlog / capacity, MAX_WAIT)
+        waits[second] = wait
+        saturated += backlog > 0
+
+        billed = ready + warming
+        unit_seconds += billed
+        numpy.maximum(peak_units, billed, out=peak_units)
+        minute_served += served
+        minute_capacity += capacity
+        minute_requests += rates[second]
+
+        metric = None
+        if second % METRIC_PERIOD == METRIC_PERIOD - 1:
+            mean = minute_served / minute_capacity
+            per_unit = minute_requests / ready
+            spread = numpy.sqrt(2 * numpy.log(ready)) / numpy.sqrt(
+                numpy.maximum(per_unit, 1)
+            )
+            metric = numpy.minimum(100.0, idle_cpu + 100 * mean * (1 + spread))
+            in_band = (metric[:, None] >= low) & (metric[:, None] < high)
+            step = (change * in_band).sum(axis=1)
+            if platform == "ec2":
+                # Instances still warming up count towards a scale-out.
+                step = numpy.where(step > 0, numpy.maximum(step - warming, 0), step)
+            else:
+                step = numpy.where(second < blocked_until, 0, step)
+            desired = numpy.clip(ready + warming + step, min_capacity, max_capacity)
+            # Scale-in terminates in-service units, always leaving one serving.
+            delta = numpy.maximum(desired - ready - warming, 1 - ready)
+            out = delta > 0
+            launches[rows[out], second + warmup[out]] += delta[out]
+            warming += numpy.where(out, delta, 0)
+            ready += numpy.where(delta < 0, delta, 0)
+            scale_outs += out
+            scale_ins += delta < 0
+            blocked_until = numpy.where(delta != 0, second + cooldown, blocked_until)
+            minute_served[:] = 0
+            minute_capacity[:] = 0
+            minute_requests[:] = 0
+        if keep is not None:
+            timeline.append(
+                (
+                    second,
+                    rates[second],
+                    ready[keep],
+                    warming[keep],
+                    100 * served[keep] / capacity[keep],
+                    None if metric is None else metric[keep],
+                    wait[keep] * 1000,
+                )
+            )
+
+    results = {
+        "unit_hours": unit_seconds / 3600,
+        "peak_units": peak_units,
+        "saturated_s": saturated,
+        "scale_outs": scale_outs,
+        "scale_ins": scale_ins,
+    }
+    order = numpy.argsort(waits, axis=0)
+    weights = numpy.cumsum(rates[order], axis=0)
+    for q in PERCENTILES:
+        index = (weights < weights[-1] * q / 100).sum(axis=0)
+        index = numpy.minimum(index, seconds - 1)
+        ranked = numpy.take_along_axis(waits, order, axis=0)
+        results[f"wait_p{q}_ms"] = ranked[index, numpy.arange(count)] * 1000
+    results["timeline"] = timeline
+    return results
+
+
+def rows_for(variants: List[Variant], results: dict) -> List[dict]:
+    rows = []
+    for index, variant in enumerate(variants):
+        row = {"variant": variant.name}
+        for key, values in results.items():
+            if key != "timeline":
+                row[key] = round(float(values[index]), 3)
+        rows.append(row)
+    return rows
+
+
+def print_table(rows: List[dict], unit: str) -> None:
+    columns = [f"{unit}-h", "peak", "sat s", "outs", "ins"]
+    columns += [f"p{q} ms" for q in PERCENTILES]
+    print("".join(f"{c:>9}" for c in columns) + "  variant")
+    for row in rows:
+        cells = [
+            row["unit_hours"],
+            row["peak_units"],
+            row["saturated_s"],
+            row["scale_outs"],
+            row["scale_ins"],
+        ] + [row[f"wait_p{q}_ms"] for q in PERCENTILES]
+        print("".join(f"{cell:>9.1f}" for cell in cells) + f"  {row['variant']}")
+
+
+def write_timeline(path: str, timeline: list) -> None:
+    with open(path, "w", newline="") as output:
+        writer = csv.writer(output)
+        writer.writerow(
+            ["second", "rate", "ready", "warming", "cpu_pct", "alarm_cpu", "wait_ms"]
+        )
+        for row in timeline:
+            writer.writerow("" if cell is None else f"{cell:.6g}" for cell in row)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--platform", choices=("ec2", "ecs"), default="ecs")
+    service = parser.add_mutually_exclusive_group(required=True)
+    service.add_argument("--cpu-ms", type=float, help="mean CPU ms per request")
+    service.add_argument("--cpu-samples", help="file of CPU ms per request")
+    parser.add_argument(
+        "--cpu-scv",
+        type=float,
+        default=1.0,
+        help="squared coefficient of variation with --cpu-ms",
+    )
+    parser.add_argument("--idle-cpu", type=float, default=2.0, help="percent")
+    parser.add_argument("--compress", type=float, default=1.0)
+    parser.add_argument("--rate-scale", type=float, default=1.0)
+    parser.add_argument("--sweep", help="JSON sweep of policy fields and bounds")
+    parser.add_argument("--stack", help="shape of this sweep variant stack")
+    parser.add_argument("--matrix", help="stack sweep file defining --stack")
+    parser.add_argument("--cdk", default=CDK_TEMPLATES, help="CDK templates directory")
+    parser.add_argument("--top", type=int, help="show the N cheapest variants")
+    parser.add_argument("--max-p99-ms", type=float, help="drop slower variants")
+    parser.add_argument("--timeline", help="per-second CSV of the first variant")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    module = _shapes_module(args.cdk)
+    shape = module.SHAPES[args.platform]()
+    if args.stack:
+        matches = [
+            variant.shape
+            for variant in (module.load_matrix(args.matrix) if args.matrix else [])
+            if variant.stack_name == args.stack
+        ]
+        if not matches:
+            parser.error(f"{args.stack} is not a variant of --matrix")
+        shape = matches[0]
+    sweep = None
+    if args.sweep:
+        with open(args.sweep) as sweep_file:
+            sweep = json.load(sweep_file)
+    try:
+        candidates = variants(module, shape, sweep)
+        vcpus = unit_vcpus(args.platform, shape)
+    except (TypeError, ValueError) as exc:
+        parser.error(str(exc))
+    if args.cpu_samples:
+        service_time = ServiceTime.load(args.cpu_samples)
+    else:
+        service_time = ServiceTime(args.cpu_ms / 1000, args.cpu_scv)
+
+    start_rate, stages = load_stages()
+    stages = scale(stages, args.compress, args.rate_scale)
+    rates = arrival_rates(start_rate * args.rate_scale, stages)
+
+    started = time.perf_counter()
+    results = simulate(
+        rates,
+        candidates,
+        service_time,
+        vcpus,
+        args.platform,
+        args.idle_cpu,
+        keep=0 if args.timeline else None,
+    )
+    elapsed = time.perf_counter() - started
+    rows = rows_for(candidates, results)
+    if args.max_p99_ms is not None:
+        rows = [row for row in rows if row["wait_p99_ms"] <= args.max_p99_ms]
+    rows.sort(key=lambda row: row["unit_hours"])
+    if args.top:
+        rows = rows[: args.top]
+
+    unit = "inst" if args.platform == "ec2" else "task"
+    print(
+        f"{args.platform}: {vcpus:g} vCPU per {unit}, "
+        f"{service_time.mean * 1000:.3f} CPU ms per request "
+        f"(scv {service_time.scv:.2f}), {len(rates)} s, "
+        f"{len(candidates)} variants simulated in {elapsed:.1f} s\n"
+    )
+    print_table(rows, unit)
+    if args.timeline:
+        write_timeline(args.timeline, results["timeline"])
+    if args.json:
+        directory = os.path.dirname(args.json)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.json, "w") as output:
+            json.dump({"platform": args.platform, "variants": rows}, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
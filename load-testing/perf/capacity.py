@@ -0,0 +1,273 @@
+"""Finds the request rate at which API workers saturate on simulated AWS latency.
+
+    cd load-testing
+    pip install -r requirements.txt
+    python -m perf.capacity
+    python -m perf.capacity --s3-latency lognormal:25:0.4 lognormal:60:0.6 \\
+        --dynamodb-latency lognormal:8:0.4 --ceiling 3800 --json results/capacity.json
+    python -m perf.capacity --io-mode async --env SIMULATED_THROTTLE_RATE=0.01
+
+The app runs under gunicorn with STORAGE_BACKEND=simulated, so every S3 and
+DynamoDB call waits for a latency drawn from the given distributions (see
+`Latency` in app/storage.py). For every pair of distributions a light
+calibration step measures how long a request takes with nothing queued, and
+Little's law puts the ceiling at the workers' concurrency (THREAD_POOL_SIZE
+threads in sync mode, capped by the admission limit, which is on unless
+`--env ADMISSION_CONTROL=false`) divided by that time,
+or at one core's worth of `--ceiling` per worker if that is lower.
+Steps of constant arrival rate around the prediction follow. Each reports the
+rate served, latency, thread-pool occupancy and the mean queueing delay
+(requests waiting for a thread or an admission slot, sampled from /metrics,
+divided by the rate served). The knee is the highest offered rate that is
+still served in full.
+
+The predicted maximum per task is the knee per worker times the task's
+workers (`--vcpus` x `--workers-per-cpu`), capped at `--vcpus` x `--ceiling`,
+the CPU-bound rate per core that `python -m app.ceiling` reports. Check it
+against the request rate per task at which latency turns upwards on the
+cost-comparison dashboard.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import time
+
+from . import report
+from .local_stack import LocalStack
+from .replay import drive
+from .stages import Stage
+
+RATE_FACTORS = (0.25, 0.5, 0.75, 0.9, 1.0, 1.1, 1.25, 1.5)
+# A step is served in full when at least this share of its requests succeed.
+SERVED = 0.95
+MAX_ERROR_RATE = 0.01
+
+
+class Sampler:
+    """Polls /metrics and averages the worker's busy and waiting requests."""
+
+    def __init__(self, url: str, io_mode: str, interval: float = 0.1) -> None:
+        self.url = url
+        self.io_mode = io_mode
+        self.interval = interval
+        self.samples = []
+        self.capacity = None
+
+    async def run(self, session) -> None:
+        while True:
+            async with session.get(self.url) as response:
+                self.add(await response.json())
+            await asyncio.sleep(self.interval)
+
+    def add(self, metrics: dict) -> None:
+        pool = metrics["thread_pool"]
+        admission = metrics["admission"] or {}
+        if self.io_mode == "sync":
+            busy, capacity = pool["in_use"], pool["size"]
+            if admission:
+                capacity = min(capacity, admission["limit"])
+        else:
+            busy, capacity = admission.get("in_flight", 0), admission.get("limit")
+        waiting = pool["waiting"] + admission.get("queue_depth", 0)
+        self.capacity = capacity
+        self.samples.append((busy, waiting))
+
+    def mean(self, index: int) -> float:
+        if not self.samples:
+            return 0.0
+        return sum(sample[index] for sample in self.samples) / len(self.samples)
+
+
+async def run_step(url: str, rate: float, duration: float, args):
+    import aiohttp
+
+    sampler = Sampler(f"{url}/metrics", args.io_mode)
+    async with aiohttp.ClientSession() as session:
+        sampling = asyncio.ensure_future(sampler.run(session))
+        try:
+            (summary,) = await drive(
+                f"{url}/", rate, [Stage(rate, duration)], args.max_in_flight, timeout=30
+            )
+        finally:
+            sampling.cancel()
+    served = (summary["requests"] - summary["errors"]) / duration
+    busy, waiting = sampler.mean(0), sampler.mean(1)
+    return sampler.capacity, {
+        "offered_rps": round(rate, 1),
+        "served_rps": round(served, 1),
+        "mean_ms": summary["mean_ms"],
+        "p50_ms": summary["p50_ms"],
+        "p99_ms": summary["p99_ms"],
+        "error_rate": summary["error_rate"],
+        "dropped": summary["dropped"],
+        "occupancy": round(busy / sampler.capacity, 3) if sampler.capacity else None,
+        "queue_ms": round(waiting / served * 1000, 2) if served else None,
+    }
+
+
+def knee(steps: list):
+    served = [
+        step
+        for step in steps
+        if step["served_rps"] >= step["offered_rps"] * SERVED
+        and step["error_rate"] <= MAX_ERROR_RATE
+        and not step["dropped"]
+    ]
+    return max((step["offered_rps"] for step in served), default=None)
+
+
+def per_task(per_worker: float, args) -> dict:
+    workers = max(1, math.ceil(args.vcpus * args.workers_per_cpu))
+    rate = per_worker * workers
+    if args.ceiling:
+        rate = min(rate, args.vcpus * args.ceiling)
+    return {"vcpus": args.vcpus, "workers": workers, "max_rps": round(rate, 1)}
+
+
+def measure(s3_latency: str, dynamodb_latency: str, args) -> dict:
+    app_env = dict(
+        STORAGE_BACKEND="simulated",
+        SIMULATED_S3_LATENCY=s3_latency,
+        SIMULATED_DYNAMODB_LATENCY=dynamodb_latency,
+        IO_MODE=args.io_mode,
+        WEB_WORKERS=str(args.workers),
+        ADMISSION_CONTROL="true",
+    )
+    app_env.update(item.split("=", 1) for item in args.env)
+    with LocalStack(app_env=app_env, aws=False) as stack:
+
+        def step(rate: float, duration: float):
+            capacity, result = asyncio.run(run_step(stack.url, rate, duration, args))
+            time.sleep(1)
+            return capacity, result
+
+        capacity, calibration = step(args.calibration_rate, args.calibration)
+        concurrency = capacity * args.workers if capacity else None
+        predicted = (
+            concurrency / (calibration["mean_ms"] / 1000) if concurrency else None
+        )
+        if predicted and args.ceiling:
+            # A worker uses one core at most.
+            predicted = min(predicted, args.ceiling * args.workers)
+        if args.rates:
+            rates = args.rates
+        elif predicted:
+            rates = [predicted * factor for factor in RATE_FACTORS]
+        else:
+            raise SystemExit("the worker has no concurrency limit: give --rates")
+        steps = []
+        for rate in rates:
+            _, result = step(rate, args.step)
+            steps.append(result)
+            print(
+                f"  offered {result['offered_rps']} req/s, "
+                f"served {result['served_rps']}",
+                flush=True,
+            )
+
+    measured = knee(steps)
+    return {
+        "s3_latency": s3_latency,
+        "dynamodb_latency": dynamodb_latency,
+        "io_mode": args.io_mode,
+        "workers": args.workers,
+        "concurrency": concurrency,
+        "unloaded_ms": calibration["mean_ms"],
+        "predicted_rps": round(predicted, 1) if predicted else None,
+        "knee_rps": measured,
+        "max_served_rps": max(step["served_rps"] for step in steps),
+        "per_task": (
+            per_task(measured / args.workers, args) if measured is not None else None
+        ),
+        "steps": steps,
+    }
+
+
+def print_result(result: dict) -> None:
+    print(
+        f"\nS3 {result['s3_latency']}, DynamoDB {result['dynamodb_latency']}, "
+        f"{result['io_mode']}, {result['workers']} worker(s), "
+        f"concurrency {result['concurrency']}"
+    )
+    columns = ("offered", "served", "p50", "p99", "err%", "busy%", "queue ms")
+    print("".join(f"{column:>10}" for column in columns))
+    for step in result["steps"]:
+        cells = (
+            step["offered_rps"],
+            step["served_rps"],
+            step["p50_ms"],
+            step["p99_ms"],
+            step["error_rate"] * 100,
+            step["occupancy"] * 100 if step["occupancy"] is not None else None,
+            step["queue_ms"],
+        )
+        print(
+            "".join(
+                f"{cell:>10.1f}" if cell is not None else f"{'-':>10}" for cell in cells
+            )
+        )
+    print(
+        f"unloaded {result['unloaded_ms']:.1f} ms, predicted {result['predicted_rps']} "
+        f"req/s, knee {result['knee_rps']} req/s, "
+        f"most served {result['max_served_rps']} req/s"
+    )
+    task = result["per_task"]
+    if task:
+        print(
+            f"per task ({task['vcpus']} vCPU, {task['workers']} workers): "
+            f"{task['max_rps']} req/s"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--s3-latency", nargs="+", default=["lognormal:25:0.4"])
+    parser.add_argument("--dynamodb-latency", nargs="+", default=["lognormal:8:0.4"])
+    parser.add_argument("--io-mode", choices=("sync", "async"), default="sync")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--rates", type=float, nargs="+", help="offered req/s instead of the default"
+    )
+    parser.add_argument("--step", type=float, default=10, help="seconds per rate")
+    parser.add_argument("--calibration", type=float, default=5)
+    parser.add_argument("--calibration-rate", type=float, default=10)
+    parser.add_argument("--max-in-flight", type=int, default=2000)
+    parser.add_argument("--vcpus", type=float, default=1)
+    parser.add_argument("--workers-per-cpu", type=float, default=2)
+    parser.add_argument(
+        "--ceiling", type=float, help="ceiling_rps_per_core from app.ceiling"
+    )
+    parser.add_argument(
+        "--env",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="app environment",
+    )
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = []
+    for s3_latency, dynamodb_latency in itertools.product(
+        args.s3_latency, args.dynamodb_latency
+    ):
+        results.append(measure(s3_latency, dynamodb_latency, args))
+        print_result(results[-1])
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump(
+                {
+                    "revision": report.git_revision(),
+                    "config": vars(args),
+                    "results": results,
+                },
+                output,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,540 @@
+"""Cost per million requests of the Lambda, ECS and EC2 stacks under load.
+
+    cd load-testing
+    python -m perf.cost --export 20240101-120000 --out runs/20240101-120000.csv
+    python -m perf.cost runs/20240101-120000.csv --slo-ms 100 --json cost.json
+
+`--export` pulls one k6 run from CloudWatch into a timeline CSV: per
+scenario requests, errors and p50/p95/p99 latency, and the capacity each
+platform ran with (in-service instances, running tasks, Lambda duration and
+invocations). k6 metrics are stored at 1-second resolution, which CloudWatch
+keeps for three hours; export later with `--period 60`. Capacity metrics
+have 1-minute resolution and are spread over the seconds of each minute.
+
+The analysis reads compute shapes from `cdk/templates/shapes.py`, for the
+default stacks or for variants of a `--matrix` sweep, and prices from a
+local pricing file, then reports for every `testing_stages` stage and every
+platform the cost, the cost per million requests and, with `--slo-ms`, the
+cost per million requests served in seconds whose p50/p95/p99 met the SLO.
+"""
+
+import argparse
+import datetime
+import importlib.util
+import json
+import os
+import sys
+from typing import Dict, NamedTuple, Optional
+
+import numpy
+
+from .report import PERCENTILES
+from .stages import load_stages
+
+CDK_TEMPLATES = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    "cdk",
+    "templates",
+)
+PRICING = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "pricing", "ap-southeast-2.json"
+)
+PLATFORMS = ("ec2", "ecs", "lambda")
+K6_NAMESPACE = "cost-comparison-k6"
+REGION = "ap-southeast-2"
+
+
+class Shapes(NamedTuple):
+    ec2_instance_type: str
+    ec2_min: int
+    ec2_max: int
+    ecs_vcpu: float
+    ecs_memory_gb: float
+    ecs_architecture: str
+    ecs_min: int
+    ecs_max: int
+    lambda_memory_gb: float
+    lambda_architecture: str
+
+
+def _shapes_module(templates: str):
+    # cdk/templates is not importable from here; load the module from its file.
+    spec = importlib.util.spec_from_file_location(
+        "cdk_shapes", os.path.join(templates, "shapes.py")
+    )
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def stack_names(stacks: Optional[dict] = None) -> dict:
+    """The stack tested per platform; `stacks` overrides the default names."""
+    names = {platform: f"cost-comparison-{platform}" for platform in PLATFORMS}
+    names.update({key: value for key, value in (stacks or {}).items() if value})
+    return names
+
+
+def load_shapes(
+    templates: str = CDK_TEMPLATES,
+    stacks: Optional[dict] = None,
+    matrix: Optional[str] = None,
+) -> Shapes:
+    """Compute shapes of the stacks under test, as defined for the CDK app.
+
+    Stacks other than the default ones must be variants of the `matrix` sweep.
+    """
+    module = _shapes_module(templates)
+    shapes = {platform: shape() for platform, shape in module.SHAPES.items()}
+    variants = {
+        variant.stack_name: variant
+        for variant in (module.load_matrix(matrix) if matrix else [])
+    }
+    defaults = stack_names()
+    for platform, name in stack_names(stacks).items():
+        if name == defaults[platform]:
+            continue
+        if name not in variants:
+            raise ValueError(f"{name} is not a variant of the sweep; pass --matrix")
+        shapes[platform] = variants[name].shape
+    ec2, ecs, function = shapes["ec2"], shapes["ecs"], shapes["lambda"]
+    return Shapes(
+        ec2_instance_type=ec2.instance_type,
+        ec2_min=ec2.min_capacity,
+        ec2_max=ec2.max_capacity,
+        ecs_vcpu=ecs.cpu / 1024,
+        ecs_memory_gb=ecs.memory_limit_mib / 1024,
+        ecs_architecture=ecs.architecture,
+        ecs_min=ecs.min_capacity,
+        ecs_max=ecs.max_capacity,
+        lambda_memory_gb=function.memory_size / 1024,
+        lambda_architecture=function.architecture,
+    )
+
+
+def check_prices(shapes: Shapes, pricing: dict) -> None:
+    """Fails unless the pricing file prices every shape under test."""
+    missing = []
+    if shapes.ec2_instance_type not in pricing["ec2"]["hourly"]:
+        missing.append(f"EC2 {shapes.ec2_instance_type}")
+    if shapes.ecs_architecture not in pricing["fargate"]:
+        missing.append(f"Fargate {shapes.ecs_architecture}")
+    if shapes.lambda_architecture not in pricing["lambda"]:
+        missing.append(f"Lambda {shapes.lambda_architecture}")
+    if missing:
+        raise ValueError(f"no price for {', '.join(missing)} in the pricing file")
+
+
+def load_timeline(path: str) -> Dict[str, numpy.ndarray]:
+    """Columns of an exported timeline CSV as float arrays; blanks are NaN."""
+    with open(path) as source:
+        header = source.readline().strip().split(",")
+        values = numpy.genfromtxt(
+            source, delimiter=",", dtype=float, ndmin=2, filling_values=numpy.nan
+        )
+    return {name: values[:, index] for index, name in enumerate(header)}
+
+
+def second_costs(timeline: dict, shapes: Shapes, pricing: dict) -> dict:
+    """Cost of every timeline row, per platform."""
+    timestamps = timeline["timestamp"]
+    period = float(numpy.median(numpy.diff(timestamps))) if len(timestamps) > 1 else 1
+    hours = period / 3600
+
+    def column(name):
+        values = timeline.get(name)
+        if values is None:
+            return numpy.zeros(len(timestamps))
+        return numpy.nan_to_num(values)
+
+    fargate = pricing["fargate"][shapes.ecs_architecture]
+    task_hourly = (
+        shapes.ecs_vcpu * fargate["vcpu_hourly"]
+        + shapes.ecs_memory_gb * fargate["gb_hourly"]
+    )
+    gb_second = pricing["lambda"][shapes.lambda_architecture]["gb_second"]
+    capacity = {
+        "ec2": column("ec2_instances")
+        * pricing["ec2"]["hourly"][shapes.ec2_instance_type]
+        * hours,
+        "ecs": column("ecs_tasks") * task_hourly * hours,
+        "lambda": column("lambda_duration_ms")
+        / 1000
+        * shapes.lambda_memory_gb
+        * gb_second
+        + column("lambda_invocations")
+        * pricing["lambda"]["per_million_requests"]
+        / 1e6,
+    }
+    costs = {}
+    for platform in PLATFORMS:
+        if f"{platform}_requests" not in timeline:
+            continue
+        requests = column(f"{platform}_requests")
+        # Every stack is fronted by an HTTP API; ECS and EC2 also by an ALB.
+        front = requests * pricing["api_gateway_http"]["per_million_requests"] / 1e6
+        if platform != "lambda":
+            front = front + pricing["alb"]["hourly"] * hours
+        costs[platform] = {"capacity": capacity[platform], "front": front}
+    return costs
+
+
+def stage_index(timestamps, start: float, stages) -> numpy.ndarray:
+    """The `testing_stages` index of every row; len(stages) after the last stage."""
+    ends = numpy.cumsum([stage.duration for stage in stages])
+    return numpy.searchsorted(ends, timestamps - start, side="right")
+
+
+def _weighted_percentile(values, weights, groups, count: int, q: float):
+    """Per group, the value below which `q`% of the weight lies."""
+    keep = ~numpy.isnan(values) & (weights > 0)
+    values, weights, groups = values[keep], weights[keep], groups[keep]
+    order = numpy.lexsort((values, groups))
+    values, weights, groups = values[order], weights[order], groups[order]
+    result = numpy.full(count, numpy.nan)
+    if not len(values):
+        return result
+    cumulative = numpy.cumsum(weights)
+    totals = numpy.bincount(groups, weights=weights, minlength=count)
+    before = numpy.concatenate(([0.0], numpy.cumsum(totals)[:-1]))
+    thresholds = before + totals * q / 100
+    present = totals > 0
+    positions = numpy.searchsorted(cumulative, thresholds[present], side="left")
+    result[present] = values[numpy.minimum(positions, len(values) - 1)]
+    return result
+
+
+def analyse(
+    timeline: dict,
+    shapes: Shapes,
+    pricing: dict,
+    stages,
+    start: Optional[float] = None,
+    slo_ms: Optional[float] = None,
+) -> dict:
+    timestamps = timeline["timestamp"]
+    start = timestamps[0] if start is None else start
+    groups = stage_index(timestamps, start, stages)
+    in_run = (timestamps >= start) & (groups < len(stages))
+    groups = numpy.where(in_run, groups, len(stages))
+    count = len(stages) + 1  # the last group collects rows outside the run
+    names = [f"{index + 1:02d}" for index in range(len(stages))]
+
+    results = {}
+    for platform, parts in second_costs(timeline, shapes, pricing).items():
+        requests = numpy.nan_to_num(timeline[f"{platform}_requests"])
+        errors = numpy.nan_to_num(
+            timeline.get(f"{platform}_errors", numpy.zeros(len(timestamps)))
+        )
+        cost = parts["capacity"] + parts["front"]
+        per_stage = {
+            "requests": numpy.bincount(groups, weights=requests, minlength=count),
+            "errors": numpy.bincount(groups, weights=errors, minlength=count),
+            "capacity_cost": numpy.bincount(
+                groups, weights=parts["capacity"], minlength=count
+            ),
+            "cost": numpy.bincount(groups, weights=cost, minlength=count),
+        }
+        for q in PERCENTILES:
+            latency = timeline.get(f"{platform}_p{q}_ms")
+            if latency is None:
+                continue
+            per_stage[f"p{q}_ms"] = _weighted_percentile(
+                latency, requests, groups, count, q
+            )
+            if slo_ms is not None:
+                met = numpy.where(latency <= slo_ms, requests, 0.0)
+                per_stage[f"slo_p{q}_requests"] = numpy.bincount(
+                    groups, weights=met, minlength=count
+                )
+        rows = [_row(name, per_stage, index) for index, name in enumerate(names)]
+        totals = {key: values[:-1].sum() for key, values in per_stage.items()}
+        for q in PERCENTILES:
+            if f"p{q}_ms" in per_stage:
+                latency = timeline[f"{platform}_p{q}_ms"]
+                totals[f"p{q}_ms"] = _weighted_percentile(
+                    latency, requests * in_run, numpy.zeros(len(latency), int), 1, q
+                )[0]
+        rows.append(_summary_row("all", totals))
+        results[platform] = rows
+    return results
+
+
+def _row(name: str, per_stage: dict, index: int) -> dict:
+    return _summary_row(name, {key: values[index] for key, values in per_stage.items()})
+
+
+def _summary_row(name: str, values: dict) -> dict:
+    requests = float(values["requests"])
+    row = {
+        "stage": name,
+        "requests": int(requests),
+        "error_rate": float(values["errors"]) / requests if requests else 0.0,
+        "cost": round(float(values["cost"]), 6),
+        "capacity_cost": round(float(values["capacity_cost"]), 6),
+        "cost_per_million": _per_million(values["cost"], requests),
+    }
+    for q in PERCENTILES:
+        if f"p{q}_ms" in values:
+            latency = float(values[f"p{q}_ms"])
+            row[f"p{q}_ms"] = None if latency != latency else round(latency, 3)
+        if f"slo_p{q}_requests" in values:
+            row[f"slo_p{q}_cost_per_million"] = _per_million(
+                values["cost"], float(values[f"slo_p{q}_requests"])
+            )
+    return row
+
+
+def _per_million(cost: float, requests: float) -> Optional[float]:
+    return round(float(cost) / requests * 1e6, 4) if requests else None
+
+
+def print_report(results: dict, shapes: Shapes, slo_ms: Optional[float]) -> None:
+    print(
+        f"ec2: {shapes.ec2_instance_type} x {shapes.ec2_min}-{shapes.ec2_max}, "
+        f"ecs: {shapes.ecs_vcpu:g} vCPU / {shapes.ecs_memory_gb:g} GB "
+        f"{shapes.ecs_architecture} x {shapes.ecs_min}-{shapes.ecs_max}, "
+        f"lambda: {shapes.lambda_memory_gb * 1024:.0f} MB {shapes.lambda_architecture}"
+    )
+    for platform, rows in results.items():
+        columns = ["requests", "cost $", "$/M"]
+        columns += [f"p{q} ms" for q in PERCENTILES]
+        if slo_ms is not None:
+            columns += [f"$/M p{q}" for q in PERCENTILES]
+        print(f"\n{platform}")
+        print(f"{'stage':<7}" + "".join(f"{c:>11}" for c in columns))
+        for row in rows:
+            cells = [row["requests"], row["cost"], row["cost_per_million"]]
+            cells += [row.get(f"p{q}_ms") for q in PERCENTILES]
+            if slo_ms is not None:
+                cells += [row.get(f"slo_p{q}_cost_per_million") for q in PERCENTILES]
+            print(f"{row['stage']:<7}" + "".join(_cell(cell) for cell in cells))
+
+
+def _cell(value) -> str:
+    if value is None:
+        return f"{'-':>11}"
+    if isinstance(value, int):
+        return f"{value:>11}"
+    return f"{value:>11.4f}"
+
+
+def _stack_outputs(cloudformation, stack_name: str) -> dict:
+    stack = cloudformation.describe_stacks(StackName=stack_name)["Stacks"][0]
+    return {output["OutputKey"]: output["OutputValue"] for output in stack["Outputs"]}
+
+
+def _k6_query(query_id: str, search: str, stat: str, period: int) -> dict:
+    # Status codes, URLs and methods are separate metrics; combine them.
+    combine = "SUM" if stat == "Sum" else "MAX"
+    return {
+        "Id": query_id,
+        "Expression": f"{combine}(SEARCH('Namespace=\"{K6_NAMESPACE}\" {search}', "
+        f"'{stat}', {period}))",
+        "ReturnData": True,
+    }
+
+
+def _metric_query(query_id: str, namespace: str, name: str, dimensions, stat: str):
+    return {
+        "Id": query_id,
+        "MetricStat": {
+            "Metric": {
+                "Namespace": namespace,
+                "MetricName": name,
+                "Dimensions": [
+                    {"Name": key, "Value": value} for key, value in dimensions.items()
+                ],
+            },
+            "Period": 60,
+            "Stat": stat,
+        },
+        "ReturnData": True,
+    }
+
+
+def _fetch(cloudwatch, queries, start, end) -> dict:
+    series = {}
+    paginator = cloudwatch.get_paginator("get_metric_data")
+    for page in paginator.paginate(
+        MetricDataQueries=queries,
+        StartTime=start,
+        EndTime=end,
+        ScanBy="TimestampAscending",
+    ):
+        for result in page["MetricDataResults"]:
+            timestamps, values = series.setdefault(result["Id"], ([], []))
+            timestamps.extend(t.timestamp() for t in result["Timestamps"])
+            values.extend(result["Values"])
+    return {
+        key: (numpy.array(timestamps), numpy.array(values))
+        for key, (timestamps, values) in series.items()
+    }
+
+
+def _resample(timestamps, source, period: float, source_period: float, level: bool):
+    """`source` onto `timestamps`: levels are held, sums spread over the period."""
+    result = numpy.full(len(timestamps), numpy.nan)
+    if source is None or not len(source[1]):
+        return result
+    source_timestamps, values = source
+    order = numpy.argsort(source_timestamps)
+    source_timestamps, values = source_timestamps[order], values[order]
+    index = numpy.searchsorted(source_timestamps, timestamps, side="right") - 1
+    valid = (index >= 0) & (timestamps < source_timestamps[index] + source_period)
+    picked = values[index[valid]]
+    result[valid] = picked if level else picked * period / source_period
+    return result
+
+
+def export(
+    execution_id: str, out: str, period: int, duration: float, stacks: dict
+) -> None:
+    import boto3
+
+    start = datetime.datetime.strptime(execution_id, "%Y%m%d-%H%M%S").replace(
+        tzinfo=datetime.timezone.utc
+    )
+    end = start + datetime.timedelta(seconds=duration)
+    cloudformation = boto3.client("cloudformation", region_name=REGION)
+    cloudwatch = boto3.client("cloudwatch", region_name=REGION)
+    ec2 = _stack_outputs(cloudformation, stacks["ec2"])
+    ecs = _stack_outputs(cloudformation, stacks["ecs"])
+    function = _stack_outputs(cloudformation, stacks["lambda"])
+
+    k6_queries = []
+    for scenario in PLATFORMS:
+        run = f'execution_id="{execution_id}" scenario="{scenario}"'
+        requests = f'{run} MetricName="k6_http_reqs"'
+        k6_queries.append(_k6_query(f"{scenario}_requests", requests, "Sum", period))
+        k6_queries.append(
+            _k6_query(
+                f"{scenario}_errors",
+                f'{requests} expected_response="false"',
+                "Sum",
+                period,
+            )
+        )
+        durations = f'{run} MetricName="k6_http_req_duration" expected_response="true"'
+        for q in PERCENTILES:
+            k6_queries.append(
+                _k6_query(f"{scenario}_p{q}_ms", durations, f"p{q}", period)
+            )
+    capacity_queries = [
+        _metric_query(
+            "ec2_instances",
+            "AWS/AutoScaling",
+            "GroupInServiceInstances",
+            {"AutoScalingGroupName": ec2["ASGName"]},
+            "Average",
+        ),
+        _metric_query(
+            "ecs_tasks",
+            "ECS/ContainerInsights",
+            "RunningTaskCount",
+            {
+                "ServiceName": ecs["EcsServiceName"],
+                "ClusterName": ecs["EcsClusterName"],
+            },
+            "Average",
+        ),
+        _metric_query(
+            "lambda_duration_ms",
+            "AWS/Lambda",
+            "Duration",
+            {"FunctionName": function["LambdaFunctionName"]},
+            "Sum",
+        ),
+        _metric_query(
+            "lambda_invocations",
+            "AWS/Lambda",
+            "Invocations",
+            {"FunctionName": function["LambdaFunctionName"]},
+            "Sum",
+        ),
+    ]
+    series = _fetch(cloudwatch, k6_queries + capacity_queries, start, end)
+
+    timestamps = start.timestamp() + numpy.arange(0, duration, period, dtype=float)
+    columns = {"timestamp": timestamps}
+    for query in k6_queries:
+        columns[query["Id"]] = _resample(
+            timestamps, series.get(query["Id"]), period, period, level=True
+        )
+    for query in capacity_queries:
+        columns[query["Id"]] = _resample(
+            timestamps,
+            series.get(query["Id"]),
+            period,
+            60,
+            level=query["MetricStat"]["Stat"] != "Sum",
+        )
+    directory = os.path.dirname(out)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    numpy.savetxt(
+        out,
+        numpy.column_stack(list(columns.values())),
+        fmt="%.10g",
+        delimiter=",",
+        header=",".join(columns),
+        comments="",
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("timeline", nargs="?", help="timeline CSV to analyse")
+    parser.add_argument("--export", metavar="EXECUTION_ID", help="export a k6 run")
+    parser.add_argument("--out", help="timeline CSV written by --export")
+    parser.add_argument("--period", type=int, default=1, help="export seconds")
+    parser.add_argument("--pricing", default=PRICING)
+    parser.add_argument("--cdk", default=CDK_TEMPLATES, help="CDK templates directory")
+    parser.add_argument("--matrix", help="sweep file defining variant stacks")
+    for platform in PLATFORMS:
+        parser.add_argument(
+            f"--{platform}-stack", help=f"{platform} stack tested, e.g. a variant"
+        )
+    parser.add_argument("--start", type=float, help="run start, epoch seconds")
+    parser.add_argument("--slo-ms", type=float, help="latency SLO for $/M at pXX")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    start_rate, stages = load_stages()
+    stacks = stack_names(
+        {platform: getattr(args, f"{platform}_stack") for platform in PLATFORMS}
+    )
+    if args.export:
+        duration = sum(stage.duration for stage in stages)
+        out = args.out or f"runs/{args.export}.csv"
+        export(args.export, out, args.period, duration, stacks)
+        return
+    if not args.timeline:
+        parser.error("a timeline CSV or --export is required")
+
+    with open(args.pricing) as pricing_file:
+        pricing = json.load(pricing_file)
+    try:
+        shapes = load_shapes(args.cdk, stacks, args.matrix)
+        check_prices(shapes, pricing)
+    except ValueError as exc:
+        parser.error(str(exc))
+    timeline = load_timeline(args.timeline)
+    results = analyse(timeline, shapes, pricing, stages, args.start, args.slo_ms)
+    print_report(results, shapes, args.slo_ms)
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump(
+                {
+                    "stacks": stacks,
+                    "shapes": shapes._asdict(),
+                    "pricing": args.pricing,
+                    "results": results,
+                },
+                output,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""Memory per API worker: the shared master heap versus each worker's own pages.
+
+    cd load-testing
+    python -m perf.footprint
+    python -m perf.footprint --workers 1 2 4 8 --io-mode async --json results/footprint.json
+
+For every worker count the app runs under gunicorn against moto, once per
+configuration:
+
+    baseline   WEB_PRELOAD_MODELS=false WEB_GC_FREEZE=false
+    preload    the botocore models loaded and the heap frozen in the master
+    cache      the same, with the models read from BOTOCORE_MODEL_CACHE
+
+Once every worker has built its clients and warmed its pools (see
+readiness.py), /proc/<pid>/smaps_rollup is read for the master and each
+worker. USS, the pages only that process maps, is what one more worker
+costs; PSS, which splits shared pages between the processes mapping them,
+sums to the memory the whole server holds. RSS counts shared pages in full,
+so summing it overstates the total several times. The Lambda rows import the
+app and build the S3 and DynamoDB clients in a single interpreter, with and
+without the cache, which is what a sandbox holds after INIT.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from . import report
+from .local_stack import SRC_DIR, LocalStack
+
+CONFIGURATIONS = {
+    "baseline": {"WEB_PRELOAD_MODELS": "false", "WEB_GC_FREEZE": "false"},
+    "preload": {"WEB_PRELOAD_MODELS": "true", "WEB_GC_FREEZE": "true"},
+    "cache": {"WEB_PRELOAD_MODELS": "true", "WEB_GC_FREEZE": "true"},
+}
+FIELDS = ("Rss", "Pss", "Private_Clean", "Private_Dirty")
+
+LAMBDA_INIT = """
+from app import clients, main
+clients.s3(), clients.dynamodb()
+with open("/proc/self/smaps_rollup") as rollup:
+    print(rollup.read())
+"""
+
+
+def parse_rollup(text: str) -> dict:
+    values = {}
+    for line in text.splitlines():
+        name, _, rest = line.partition(":")
+        if name in FIELDS:
+            values[name] = int(rest.split()[0]) / 1024
+    return {
+        "rss_mib": round(values["Rss"], 1),
+        "pss_mib": round(values["Pss"], 1),
+        "uss_mib": round(values["Private_Clean"] + values["Private_Dirty"], 1),
+    }
+
+
+def rollup(pid: int) -> dict:
+    with open(f"/proc/{pid}/smaps_rollup") as source:
+        return parse_rollup(source.read())
+
+
+def children(pid: int) -> list:
+    with open(f"/proc/{pid}/task/{pid}/children") as source:
+        return [int(child) for child in source.read().split()]
+
+
+def wait_for_workers(master: int, workers: int, timeout: float = 60) -> list:
+    deadline = time.monotonic() + timeout
+    while True:
+        pids = children(master)
+        if len(pids) >= workers:
+            return pids
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"{len(pids)} of {workers} workers started")
+        time.sleep(0.2)
+
+
+def measure_server(configuration: str, workers: int, cache: str, args) -> dict:
+    app_env = dict(
+        CONFIGURATIONS[configuration],
+        IO_MODE=args.io_mode,
+        WEB_WORKERS=str(workers),
+        BOTOCORE_MODEL_CACHE=cache if configuration == "cache" else "",
+    )
+    app_env.update(item.split("=", 1) for item in args.env)
+    with LocalStack(app_env=app_env) as stack:
+        master = stack.processes[-1].pid
+        pids = wait_for_workers(master, workers)
+        # The workers warm up on their own; /ready only answered for one.
+        time.sleep(args.settle)
+        server = rollup(master)
+        per_worker = [rollup(pid) for pid in pids]
+    total_pss = server["pss_mib"] + sum(worker["pss_mib"] for worker in per_worker)
+    return {
+        "configuration": configuration,
+        "workers": workers,
+        "master": server,
+        "worker_uss_mib": round(
+            sum(worker["uss_mib"] for worker in per_worker) / workers, 1
+        ),
+        "worker_rss_mib": round(
+            sum(worker["rss_mib"] for worker in per_worker) / workers, 1
+        ),
+        "total_pss_mib": round(total_pss, 1),
+    }
+
+
+def measure_lambda(configuration: str, cache: str) -> dict:
+    with LocalStack(server=None) as stack:
+        env = dict(
+            os.environ,
+            **stack.aws_env(),
+            PYTHONPATH=SRC_DIR,
+            BOTOCORE_MODEL_CACHE=cache if configuration == "cache" else "",
+        )
+        output = subprocess.run(
+            [sys.executable, "-c", LAMBDA_INIT],
+            cwd=SRC_DIR,
+            env=env,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+    return {"configuration": configuration, **parse_rollup(output)}
+
+
+def build_cache(path: str) -> None:
+    subprocess.run(
+        [sys.executable, "-m", "app.models", "build", "--out", path],
+        cwd=SRC_DIR,
+        env=dict(os.environ, PYTHONPATH=SRC_DIR),
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+def print_results(servers: list, lambdas: list) -> None:
+    columns = ("workers", "config", "master", "uss/wkr", "rss/wkr", "total pss")
+    print("".join(f"{column:>12}" for column in columns))
+    for result in servers:
+        print(
+            f"{result['workers']:>12}{result['configuration']:>12}"
+            f"{result['master']['uss_mib']:>12.1f}{result['worker_uss_mib']:>12.1f}"
+            f"{result['worker_rss_mib']:>12.1f}{result['total_pss_mib']:>12.1f}"
+        )
+    print("\nLambda INIT (MiB)")
+    for result in lambdas:
+        print(
+            f"{result['configuration']:>12}  rss {result['rss_mib']:.1f}  "
+            f"uss {result['uss_mib']:.1f}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument(
+        "--configurations",
+        nargs="+",
+        choices=tuple(CONFIGURATIONS),
+        default=list(CONFIGURATIONS),
+    )
+    parser.add_argument("--io-mode", choices=("sync", "async"), default="sync")
+    parser.add_argument(
+        "--settle", type=float, default=5, help="seconds to let the workers warm up"
+    )
+    parser.add_argument(
+        "--env",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="app environment",
+    )
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        cache = os.path.join(directory, "botocore-models.pickle")
+        build_cache(cache)
+        servers = []
+        for workers in args.workers:
+            for configuration in args.configurations:
+                servers.append(measure_server(configuration, workers, cache, args))
+                print(
+                    f"  {workers} worker(s), {configuration}: "
+                    f"{servers[-1]['worker_uss_mib']} MiB USS per worker",
+                    flush=True,
+                )
+        lambdas = [
+            measure_lambda(configuration, cache)
+            for configuration in ("baseline", "cache")
+        ]
+    print_results(servers, lambdas)
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump(
+                {
+                    "revision": report.git_revision(),
+                    "config": vars(args),
+                    "servers": servers,
+                    "lambda": lambdas,
+                },
+                output,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,398 @@
+"""Mergeable HDR latency histograms from the k6 JSON output stream.
+
+    cd load-testing
+    k6 run --out json=run.json.gz script.js
+    python -m perf.hdr ingest run.json.gz --out runs/20240101-120000.hdr
+    python -m perf.hdr report runs/20240101-120000.hdr --by window
+    python -m perf.hdr merge --out runs/all.hdr runs/2024*.hdr
+    python -m perf.hdr compare runs/before.hdr runs/after.hdr
+
+`ingest` reads `http_req_duration` points line by line (plain, gzipped or
+`-` for stdin, e.g. a named pipe that k6 writes to) and keeps one histogram
+per scenario, `execution_id` tag and `--window` of seconds, so memory
+depends on the length of the run, never on the size of the stream.
+Latencies of expected responses are recorded in microseconds, with buckets
+at most 1/128 of their value wide (under 0.8% error), like HdrHistogram with
+two significant digits; failed requests are counted separately.
+
+Histograms add up bucket by bucket, so runs and windows merge exactly and
+percentiles are recomputed from the merged counts rather than averaged.
+The `.hdr` file is zlib-compressed: a JSON header, then per histogram its
+key, error count and the (index delta, count) pairs of non-empty buckets
+as varints, typically a few hundred bytes per histogram.
+
+Only the standard library is used, so the file also runs on its own on the
+k6 instance (`python3 hdr.py ...`), where `run_k6.sh` feeds it with HDR_DIR.
+"""
+
+import argparse
+import calendar
+import gzip
+import json
+import math
+import sys
+import time
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    from orjson import loads
+except ImportError:
+    from json import loads
+
+MAGIC = b"K6HDR\x01"
+SUB_BUCKET_BITS = 8  # 256 sub-buckets: values below 256 us are exact
+SUB_BUCKET_HALF = 1 << (SUB_BUCKET_BITS - 1)
+METRIC = "http_req_duration"
+PERCENTILES = (50, 90, 95, 99, 99.9)
+GROUPS = ("scenario", "execution", "window")
+
+Key = Tuple[str, str, int]  # scenario, execution_id, window start (epoch s)
+
+
+def bucket_index(micros: int) -> int:
+    shift = max(0, micros.bit_length() - SUB_BUCKET_BITS)
+    return (shift << (SUB_BUCKET_BITS - 1)) + (micros >> shift)
+
+
+def highest_equivalent(index: int) -> int:
+    """The largest value, in microseconds, recorded into bucket `index`."""
+    shift = max(0, (index >> (SUB_BUCKET_BITS - 1)) - 1)
+    sub_bucket = index - (shift << (SUB_BUCKET_BITS - 1))
+    return ((sub_bucket + 1) << shift) - 1
+
+
+class Histogram:
+    """Latency counts per bucket; adding two histograms merges them."""
+
+    __slots__ = ("counts", "errors")
+
+    def __init__(self) -> None:
+        self.counts = {}
+        self.errors = 0
+
+    def record(self, micros: int) -> None:
+        index = bucket_index(micros)
+        self.counts[index] = self.counts.get(index, 0) + 1
+
+    def add(self, other: "Histogram") -> None:
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.errors += other.errors
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+    def percentiles(self, qs: Iterable[float]) -> Dict[float, Optional[float]]:
+        """Nearest-rank percentiles in ms, as the top of the bucket they fall in."""
+        qs = sorted(qs)
+        result = {q: None for q in qs}
+        total = self.total
+        if not total:
+            return result
+        ranks = [(max(1, math.ceil(q / 100 * total)), q) for q in qs]
+        seen = 0
+        pending = iter(ranks)
+        rank, q = next(pending)
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            while seen >= rank:
+                result[q] = highest_equivalent(index) / 1000
+                try:
+                    rank, q = next(pending)
+                except StopIteration:
+                    return result
+        return result
+
+    def maximum(self) -> Optional[float]:
+        return highest_equivalent(max(self.counts)) / 1000 if self.counts else None
+
+
+def _varint(value: int, out: bytearray) -> None:
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data: bytes, position: int) -> Tuple[int, int]:
+    value = shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+
+def _string(value: str, out: bytearray) -> None:
+    encoded = value.encode("utf-8")
+    _varint(len(encoded), out)
+    out += encoded
+
+
+def dump(path: str, histograms: Dict[Key, Histogram], header: dict) -> None:
+    out = bytearray()
+    _string(json.dumps(dict(header, sub_bucket_bits=SUB_BUCKET_BITS)), out)
+    _varint(len(histograms), out)
+    for (scenario, execution_id, window), histogram in sorted(histograms.items()):
+        _string(scenario, out)
+        _string(execution_id, out)
+        _varint(window, out)
+        _varint(histogram.errors, out)
+        _varint(len(histogram.counts), out)
+        previous = 0
+        for index in sorted(histogram.counts):
+            _varint(index - previous, out)
+            _varint(histogram.counts[index], out)
+            previous = index
+    with open(path, "wb") as output:
+        output.write(MAGIC + zlib.compress(bytes(out), 9))
+
+
+def load(path: str) -> Tuple[dict, Dict[Key, Histogram]]:
+    with open(path, "rb") as source:
+        data = source.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{path} is not a k6 HDR histogram file")
+    data = zlib.decompress(data[len(MAGIC) :])
+
+    def string(position):
+        length, position = _read_varint(data, position)
+        return data[position : position + length].decode("utf-8"), position + length
+
+    text, position = string(0)
+    header = json.loads(text)
+    if header["sub_bucket_bits"] != SUB_BUCKET_BITS:
+        raise ValueError(f"{path} uses {header['sub_bucket_bits']} sub-bucket bits")
+    count, position = _read_varint(data, position)
+    histograms = {}
+    for _ in range(count):
+        scenario, position = string(position)
+        execution_id, position = string(position)
+        window, position = _read_varint(data, position)
+        histogram = Histogram()
+        histogram.errors, position = _read_varint(data, position)
+        buckets, position = _read_varint(data, position)
+        index = 0
+        for _ in range(buckets):
+            delta, position = _read_varint(data, position)
+            index += delta
+            histogram.counts[index], position = _read_varint(data, position)
+        histograms[(scenario, execution_id, window)] = histogram
+    return header, histograms
+
+
+def merge_into(target: Dict[Key, Histogram], source: Dict[Key, Histogram]) -> None:
+    for key, histogram in source.items():
+        existing = target.get(key)
+        if existing is None:
+            existing = target[key] = Histogram()
+        existing.add(histogram)
+
+
+def _open(path: str):
+    if path == "-":
+        return sys.stdin
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, encoding="utf-8")
+
+
+class _EpochSeconds:
+    """Parses k6's RFC 3339 timestamps, caching one result per second."""
+
+    def __init__(self) -> None:
+        self._cache = {}
+
+    def __call__(self, stamp: str) -> int:
+        # 2024-01-01T12:00:00.123456789Z or ...+10:00; the zone follows the
+        # fraction, so the second and the zone together key the cache.
+        zone = "Z" if stamp.endswith("Z") else stamp[-6:]
+        key = stamp[:19] + zone
+        seconds = self._cache.get(key)
+        if seconds is None:
+            seconds = calendar.timegm(time.strptime(stamp[:19], "%Y-%m-%dT%H:%M:%S"))
+            if zone != "Z":
+                offset = int(zone[1:3]) * 3600 + int(zone[4:6]) * 60
+                seconds -= offset if zone[0] == "+" else -offset
+            if len(self._cache) > 4096:
+                self._cache.clear()
+            self._cache[key] = seconds
+        return seconds
+
+
+def ingest(lines: Iterable[str], window: int) -> Tuple[Dict[Key, Histogram], dict]:
+    histograms = {}
+    epoch_seconds = _EpochSeconds()
+    stats = {"lines": 0, "points": 0, "skipped": 0}
+    needle = f'"{METRIC}"'
+    for line in lines:
+        stats["lines"] += 1
+        if needle not in line:
+            continue
+        try:
+            point = loads(line)
+            if point.get("type") != "Point" or point.get("metric") != METRIC:
+                continue
+            data = point["data"]
+            tags = data.get("tags") or {}
+            start = epoch_seconds(data["time"])
+            value = data["value"]
+        except (ValueError, KeyError, TypeError):
+            stats["skipped"] += 1
+            continue
+        key = (
+            tags.get("scenario", "default"),
+            tags.get("execution_id", "none"),
+            start - start % window,
+        )
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram()
+        if tags.get("expected_response", "true") == "true":
+            histogram.record(int(value * 1000))
+        else:
+            histogram.errors += 1
+        stats["points"] += 1
+    return histograms, stats
+
+
+def group(histograms: Dict[Key, Histogram], by: str) -> Dict[tuple, Histogram]:
+    """Histograms merged per scenario, plus execution id or window with `by`."""
+    grouped = {}
+    for (scenario, execution_id, window), histogram in histograms.items():
+        if by == "scenario":
+            key = (scenario,)
+        elif by == "execution":
+            key = (scenario, execution_id)
+        else:
+            key = (scenario, time.strftime("%H:%M:%S", time.gmtime(window)))
+        existing = grouped.get(key)
+        if existing is None:
+            existing = grouped[key] = Histogram()
+        existing.add(histogram)
+    return dict(sorted(grouped.items()))
+
+
+def summary(histogram: Histogram) -> dict:
+    row = {"requests": histogram.total, "errors": histogram.errors}
+    for q, value in histogram.percentiles(PERCENTILES).items():
+        row[f"p{q:g}_ms"] = value
+    row["max_ms"] = histogram.maximum()
+    return row
+
+
+def _cell(value) -> str:
+    if value is None:
+        return f"{'-':>10}"
+    if isinstance(value, int):
+        return f"{value:>10}"
+    return f"{value:>10.2f}"
+
+
+def print_report(grouped: Dict[tuple, Histogram]) -> None:
+    columns = ["requests", "errors"] + [f"p{q:g}" for q in PERCENTILES] + ["max"]
+    print(f"{'group':<28}" + "".join(f"{c:>10}" for c in columns))
+    for key, histogram in grouped.items():
+        row = summary(histogram)
+        print(f"{' '.join(key)[:27]:<28}" + "".join(_cell(v) for v in row.values()))
+
+
+def print_comparison(base: Dict[tuple, Histogram], new: Dict[tuple, Histogram]):
+    columns = [f"p{q:g}" for q in PERCENTILES]
+    print(
+        f"{'group':<28}{'requests':>18}"
+        + "".join(f"{c:>22}" for c in columns)
+        + "   (ms before -> after, change)"
+    )
+    for key in sorted(set(base) | set(new)):
+        before = base.get(key, Histogram())
+        after = new.get(key, Histogram())
+        cells = f"{before.total:>8} -> {after.total:<8}"
+        old_values = before.percentiles(PERCENTILES)
+        new_values = after.percentiles(PERCENTILES)
+        for q in PERCENTILES:
+            old, value = old_values[q], new_values[q]
+            if old is None or value is None:
+                cells += f"{'-':>22}"
+                continue
+            change = (value - old) / old * 100 if old else 0.0
+            cells += f"{old:>8.1f} ->{value:>7.1f} {change:+4.0f}%"
+        print(f"{' '.join(key)[:27]:<28}{cells}")
+
+
+def _load_all(paths: List[str]) -> Dict[Key, Histogram]:
+    merged = {}
+    for path in paths:
+        merge_into(merged, load(path)[1])
+    return merged
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    ingest_parser = commands.add_parser("ingest", help="k6 JSON output to .hdr")
+    ingest_parser.add_argument("source", help="k6 JSON lines, .gz, or - for stdin")
+    ingest_parser.add_argument("--out", required=True)
+    ingest_parser.add_argument("--window", type=int, default=60, help="seconds")
+    merge_parser = commands.add_parser("merge", help="add .hdr files together")
+    merge_parser.add_argument("paths", nargs="+")
+    merge_parser.add_argument("--out", required=True)
+    report_parser = commands.add_parser("report", help="percentiles of .hdr files")
+    report_parser.add_argument("paths", nargs="+")
+    report_parser.add_argument("--by", choices=GROUPS, default="scenario")
+    report_parser.add_argument("--json", help="also write the rows to this file")
+    compare_parser = commands.add_parser("compare", help="percentiles of two runs")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--by", choices=GROUPS[:2], default="scenario")
+    args = parser.parse_args()
+
+    if args.command == "ingest":
+        started = time.perf_counter()
+        with _open(args.source) as source:
+            histograms, stats = ingest(source, args.window)
+        dump(
+            args.out,
+            histograms,
+            {"metric": METRIC, "window_s": args.window, "source": args.source},
+        )
+        print(
+            f"{stats['points']} points from {stats['lines']} lines "
+            f"({stats['skipped']} unreadable) into {len(histograms)} histograms "
+            f"in {time.perf_counter() - started:.1f} s"
+        )
+        print_report(group(histograms, "scenario"))
+    elif args.command == "merge":
+        headers = [load(path)[0] for path in args.paths]
+        dump(
+            args.out,
+            _load_all(args.paths),
+            {
+                "metric": METRIC,
+                "window_s": sorted({h.get("window_s") for h in headers}),
+                "merged": args.paths,
+            },
+        )
+    elif args.command == "report":
+        grouped = group(_load_all(args.paths), args.by)
+        print_report(grouped)
+        if args.json:
+            with open(args.json, "w") as output:
+                json.dump(
+                    [dict(group=list(key), **summary(h)) for key, h in grouped.items()],
+                    output,
+                    indent=2,
+                )
+    else:
+        print_comparison(
+            group(_load_all([args.base]), args.by),
+            group(_load_all([args.new]), args.by),
+        )
+
+
+if __name__ == "__main__":
+    main()
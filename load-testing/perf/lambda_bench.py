@@ -0,0 +1,155 @@
+"""Mangum versus the native Lambda handler on recorded API Gateway events.
+
+    cd load-testing
+    python -m perf.lambda_bench --invocations 500 --memory 512
+
+Each handler runs in a fresh interpreter posing as a Lambda function, with
+moto standing in for S3 and DynamoDB, and is invoked with the events in
+`perf/events`. CPU time per invocation is scaled to what it would take on a
+function of `--memory` MB: Lambda allocates one vCPU per 1769 MB, so below
+that the CPU-bound part of a request stretches the billed duration
+proportionally. The responses of both handlers are compared after masking
+the generated ids, and the run fails if they differ.
+"""
+
+import argparse
+import glob
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+from .local_stack import BUCKET_NAME, SRC_DIR, TABLE_NAME, LocalStack
+
+EVENTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "events")
+HANDLERS = ("mangum", "native")
+MB_PER_VCPU = 1769
+UUID = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+
+
+def load_events() -> dict:
+    events = {}
+    for path in sorted(glob.glob(os.path.join(EVENTS_DIR, "*.json"))):
+        with open(path) as event:
+            events[os.path.basename(path)[: -len(".json")]] = json.load(event)
+    return events
+
+
+def masked(response: dict) -> dict:
+    return json.loads(UUID.sub("<id>", json.dumps(response, sort_keys=True)))
+
+
+def run_invocations(invocations: int, warmup: int) -> dict:
+    import time
+
+    from app import main
+
+    results = {}
+    for name, event in load_events().items():
+        for _ in range(warmup):
+            main.handler(event, None)
+        cpu = []
+        wall = []
+        for _ in range(invocations):
+            cpu_started = time.process_time()
+            wall_started = time.perf_counter()
+            response = main.handler(event, None)
+            wall.append(time.perf_counter() - wall_started)
+            cpu.append(time.process_time() - cpu_started)
+        results[name] = {
+            "cpu_ms": statistics.mean(cpu) * 1000,
+            "wall_p50_ms": statistics.median(wall) * 1000,
+            "response": masked(response),
+        }
+    return results
+
+
+def measure(stack: LocalStack, handler: str, invocations: int, warmup: int) -> dict:
+    load_testing_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(
+        os.environ,
+        **stack.aws_env(),
+        S3_BUCKET_NAME=BUCKET_NAME,
+        DYNAMODB_TABLE=TABLE_NAME,
+        LAMBDA_HANDLER=handler,
+        AWS_LAMBDA_FUNCTION_NAME="lambda-bench",
+        PYTHONPATH=os.pathsep.join([SRC_DIR, load_testing_dir]),
+    )
+    env.pop("STATSD_HOST", None)
+    completed = subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "perf.lambda_bench",
+            "--run",
+            "--invocations",
+            str(invocations),
+            "--warmup",
+            str(warmup),
+        ],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def print_table(results: dict, memory: int) -> None:
+    scale = max(1.0, MB_PER_VCPU / memory)
+    print(
+        f"{'event':<14}{'handler':<9}{'cpu ms':>9}{f'@{memory}MB ms':>12}{'p50 ms':>9}"
+    )
+    for event in results[HANDLERS[0]]:
+        for handler in HANDLERS:
+            result = results[handler][event]
+            print(
+                f"{event:<14}{handler:<9}{result['cpu_ms']:>9.3f}"
+                f"{result['cpu_ms'] * scale:>12.3f}{result['wall_p50_ms']:>9.3f}"
+            )
+
+
+def mismatches(results: dict) -> list:
+    return [
+        event
+        for event, result in results["mangum"].items()
+        if result["response"] != results["native"][event]["response"]
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--invocations", type=int, default=500)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--memory", type=int, default=512, help="function MB")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--run", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run_invocations(args.invocations, args.warmup)))
+        return
+
+    with LocalStack(server=None) as stack:
+        results = {
+            handler: measure(stack, handler, args.invocations, args.warmup)
+            for handler in HANDLERS
+        }
+    print_table(results, args.memory)
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump(results, output, indent=2)
+    different = mismatches(results)
+    if different:
+        for event in different:
+            print(f"\nresponse mismatch for {event}:")
+            for handler in HANDLERS:
+                print(f"  {handler}: {results[handler][event]['response']}")
+        sys.exit(1)
+    print("\nresponses match")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""Runs the API against local S3 and DynamoDB stand-ins (moto server)."""
+
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+SRC_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    "src",
+)
+BUCKET_NAME = "cost-comparison-local"
+TABLE_NAME = "cost-comparison-local"
+REGION = "ap-southeast-2"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(url, timeout=1):
+                return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"{url} did not come up in {timeout} s")
+            time.sleep(0.2)
+
+
+class LocalStack:
+    """Context manager that starts moto and the app and tears both down.
+
+    With `server=None` only moto is started, for callers that run the app
+    in-process; with `aws=False` moto is not, for apps that run on a local
+    STORAGE_BACKEND.
+    """
+
+    def __init__(
+        self, server: str = "gunicorn", app_env: dict = None, aws: bool = True
+    ) -> None:
+        self.server = server
+        self.app_env = app_env or {}
+        self.aws = aws
+        self.processes = []
+        self.aws_port = free_port()
+        self.app_port = free_port()
+        self.url = f"http://127.0.0.1:{self.app_port}"
+
+    def aws_env(self) -> dict:
+        return {
+            "AWS_ACCESS_KEY_ID": "local",
+            "AWS_SECRET_ACCESS_KEY": "local",
+            "AWS_DEFAULT_REGION": REGION,
+            "AWS_ENDPOINT_URL": f"http://127.0.0.1:{self.aws_port}",
+        }
+
+    def __enter__(self) -> "LocalStack":
+        try:
+            if self.aws:
+                self._start_aws()
+            if self.server:
+                self._start_app()
+        except BaseException:
+            self.__exit__(None, None, None)
+            raise
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        for process in reversed(self.processes):
+            process.terminate()
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self.processes.clear()
+
+    def _spawn(self, args, **kwargs) -> subprocess.Popen:
+        process = subprocess.Popen(args, **kwargs)
+        self.processes.append(process)
+        return process
+
+    def _start_aws(self) -> None:
+        import boto3
+
+        self._spawn(
+            [
+                sys.executable,
+                "-m",
+                "moto.server",
+                "-H",
+                "127.0.0.1",
+                "-p",
+                str(self.aws_port),
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        wait_for(f"http://127.0.0.1:{self.aws_port}/moto-api/")
+        session = boto3.session.Session(
+            aws_access_key_id="local",
+            aws_secret_access_key="local",
+            region_name=REGION,
+        )
+        endpoint = self.aws_env()["AWS_ENDPOINT_URL"]
+        session.client("s3", endpoint_url=endpoint).create_bucket(
+            Bucket=BUCKET_NAME,
+            CreateBucketConfiguration={"LocationConstraint": REGION},
+        )
+        session.client("dynamodb", endpoint_url=endpoint).create_table(
+            TableName=TABLE_NAME,
+            KeySchema=[{"AttributeName": "id", "KeyType": "HASH"}],
+            AttributeDefinitions=[{"AttributeName": "id", "AttributeType": "S"}],
+            BillingMode="PAY_PER_REQUEST",
+        )
+
+    def _start_app(self) -> None:
+        env = dict(
+            os.environ,
+            **self.aws_env(),
+            S3_BUCKET_NAME=BUCKET_NAME,
+            DYNAMODB_TABLE=TABLE_NAME,
+            WEB_BIND=f"127.0.0.1:{self.app_port}",
+            PYTHONPATH=SRC_DIR,
+            **self.app_env,
+        )
+        if self.server == "gunicorn":
+            args = [sys.executable, "-m", "app.server"]
+        else:
+            args = [
+                sys.executable,
+                "-m",
+                "uvicorn",
+                "app.main:app",
+                "--host",
+                "127.0.0.1",
+                "--port",
+                str(self.app_port),
+                "--log-level",
+                "warning",
+            ]
+        self._spawn(args, cwd=SRC_DIR, env=env)
+        wait_for(f"{self.url}/ready")
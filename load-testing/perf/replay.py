@@ -0,0 +1,174 @@
+"""Replays the k6 `testing_stages` against a locally running API.
+
+    cd load-testing
+    pip install -r requirements.txt
+    python -m perf.replay --compress 60 --out results/$(git rev-parse --short HEAD).json
+    python -m perf.replay --compare results/before.json results/after.json
+
+The app is started from ../src with moto standing in for S3 and DynamoDB and
+driven by an open-model generator: requests are issued at the stage's arrival
+rate whatever the response times, as k6's ramping-arrival-rate executor does.
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from . import report
+from .local_stack import LocalStack
+from .stages import load_stages, rate_at, scale
+
+
+class StageStats:
+    def __init__(self, name: str, duration: float) -> None:
+        self.name = name
+        self.duration = duration
+        self.latencies = []
+        self.errors = 0
+        self.dropped = 0
+
+    def summary(self) -> dict:
+        return report.summarize(
+            self.name, self.duration, self.latencies, self.errors, self.dropped
+        )
+
+
+async def _request(session, url: str, stats: StageStats) -> None:
+    import aiohttp
+
+    started = time.perf_counter()
+    try:
+        async with session.get(url) as response:
+            await response.read()
+            failed = response.status >= 400
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        failed = True
+    if failed:
+        stats.errors += 1
+    else:
+        stats.latencies.append(time.perf_counter() - started)
+
+
+async def drive(
+    url: str, start_rate: float, stages, max_in_flight: int, timeout: float
+):
+    """Issue requests at the scheduled arrival rate and collect per-stage stats."""
+    import aiohttp
+
+    boundaries = []
+    elapsed = 0.0
+    for index, stage in enumerate(stages):
+        elapsed += stage.duration
+        boundaries.append((elapsed, StageStats(f"{index + 1:02d}", stage.duration)))
+    total = elapsed
+
+    in_flight = set()
+    connector = aiohttp.TCPConnector(limit=max_in_flight)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    async with aiohttp.ClientSession(
+        connector=connector, timeout=client_timeout
+    ) as session:
+        started = time.perf_counter()
+        next_arrival = 0.0
+        stage_index = 0
+        while next_arrival < total:
+            while next_arrival >= boundaries[stage_index][0]:
+                stage_index += 1
+            stats = boundaries[stage_index][1]
+            delay = started + next_arrival - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if len(in_flight) >= max_in_flight:
+                # k6 drops the iteration when no VU is free; do the same.
+                stats.dropped += 1
+            else:
+                task = asyncio.ensure_future(_request(session, url, stats))
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+            rate = rate_at(start_rate, stages, next_arrival)
+            # Idle stretches (rate 0) are skipped in 10 ms steps.
+            next_arrival += 1.0 / rate if rate > 0 else 0.01
+        if in_flight:
+            await asyncio.wait(in_flight)
+    return [stats.summary() for _, stats in boundaries]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--compress", type=float, default=60, help="time compression factor"
+    )
+    parser.add_argument(
+        "--rate-scale", type=float, default=1.0, help="multiply every arrival rate"
+    )
+    parser.add_argument("--server", choices=("gunicorn", "uvicorn"), default="gunicorn")
+    parser.add_argument(
+        "--url", help="drive an already running API instead of starting one"
+    )
+    parser.add_argument("--path", default="/", help="request path")
+    parser.add_argument(
+        "--max-in-flight", type=int, default=1000, help="k6 preAllocatedVUs"
+    )
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument(
+        "--env",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="app environment",
+    )
+    parser.add_argument(
+        "--out", help="write machine-readable results to this JSON file"
+    )
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"))
+    parser.add_argument(
+        "--tolerance", type=float, default=0.1, help="allowed relative regression"
+    )
+    args = parser.parse_args()
+
+    if args.compare:
+        regressions = report.compare(*args.compare, tolerance=args.tolerance)
+        print("\n".join(regressions) or "no regressions")
+        sys.exit(1 if regressions else 0)
+
+    start_rate, stages = load_stages()
+    start_rate *= args.rate_scale
+    stages = scale(stages, args.compress, args.rate_scale)
+    app_env = dict(item.split("=", 1) for item in args.env)
+    config = {
+        "compress": args.compress,
+        "rate_scale": args.rate_scale,
+        "server": args.server,
+        "path": args.path,
+        "max_in_flight": args.max_in_flight,
+        "app_env": app_env,
+    }
+
+    def run(base_url: str):
+        return asyncio.run(
+            drive(
+                base_url + args.path,
+                start_rate,
+                stages,
+                args.max_in_flight,
+                args.timeout,
+            )
+        )
+
+    if args.url:
+        results = run(args.url.rstrip("/"))
+    else:
+        with LocalStack(server=args.server, app_env=app_env) as stack:
+            results = run(stack.url)
+
+    report.print_table(results)
+    if args.out:
+        report.write_results(args.out, config, results)
+    else:
+        print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import json
+import math
+import os
+import subprocess
+import time
+from typing import List, Optional
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(
+    name: str, duration: float, latencies: List[float], errors: int, dropped: int
+) -> dict:
+    latencies = sorted(latencies)
+    completed = len(latencies) + errors
+    summary = {
+        "stage": name,
+        "duration_s": duration,
+        "requests": completed,
+        "throughput_rps": completed / duration if duration else 0.0,
+        "errors": errors,
+        "error_rate": errors / completed if completed else 0.0,
+        "dropped": dropped,
+    }
+    summary["mean_ms"] = _ms(sum(latencies) / len(latencies) if latencies else None)
+    for q in PERCENTILES:
+        summary[f"p{q}_ms"] = _ms(percentile(latencies, q))
+    summary["max_ms"] = _ms(latencies[-1] if latencies else None)
+    return summary
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(path: str, config: dict, stages: List[dict]) -> None:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w") as output:
+        json.dump(
+            {
+                "revision": git_revision(),
+                "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "config": config,
+                "stages": stages,
+            },
+            output,
+            indent=2,
+        )
+
+
+def print_table(stages: List[dict]) -> None:
+    columns = ("req/s", "p50", "p95", "p99", "max")
+    print(
+        f"{'stage':<8}"
+        + "".join(f"{c:>9}" for c in columns)
+        + f"{'err%':>7}{'drop':>6}"
+    )
+    for stage in stages:
+        print(
+            f"{stage['stage']:<8}{stage['throughput_rps']:>9.1f}"
+            + "".join(
+                _cell(stage[key]) for key in ("p50_ms", "p95_ms", "p99_ms", "max_ms")
+            )
+            + f"{stage['error_rate'] * 100:>7.2f}{stage['dropped']:>6}"
+        )
+
+
+def _cell(value: Optional[float]) -> str:
+    return f"{value:>9.1f}" if value is not None else f"{'-':>9}"
+
+
+def compare(baseline_path: str, current_path: str, tolerance: float) -> List[str]:
+    """Stages whose p95/p99, error rate or throughput regressed beyond `tolerance`."""
+    with open(baseline_path) as f:
+        baseline = {s["stage"]: s for s in json.load(f)["stages"]}
+    with open(current_path) as f:
+        current = {s["stage"]: s for s in json.load(f)["stages"]}
+    regressions = []
+    for name, stage in current.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        for key in ("p95_ms", "p99_ms"):
+            if (
+                before[key]
+                and stage[key]
+                and stage[key] > before[key] * (1 + tolerance)
+            ):
+                regressions.append(
+                    f"{name} {key}: {before[key]:.1f} -> {stage[key]:.1f}"
+                )
+        if stage["error_rate"] > before["error_rate"] + tolerance / 100:
+            regressions.append(
+                f"{name} error_rate: {before['error_rate']:.4f} -> {stage['error_rate']:.4f}"
+            )
+        if stage["throughput_rps"] < before["throughput_rps"] * (1 - tolerance):
+            regressions.append(
+                f"{name} throughput_rps: {before['throughput_rps']:.1f} -> {stage['throughput_rps']:.1f}"
+            )
+    return regressions
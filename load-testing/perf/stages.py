@@ -0,0 +1,52 @@
+import os
+import re
+from typing import List, NamedTuple
+
+SCRIPT_TEMPLATE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "script-template.js"
+)
+
+_STAGE = re.compile(r"\{\s*target:\s*(\d+)\s*,\s*duration:\s*'(\d+)([smh])'\s*\}")
+_START_RATE = re.compile(r"const START_RATE\s*=\s*(\d+)")
+_UNIT_SECONDS = {"s": 1, "m": 60, "h": 3600}
+
+
+class Stage(NamedTuple):
+    target: float  # requests per second reached at the end of the stage
+    duration: float  # seconds
+
+
+def load_stages(path: str = SCRIPT_TEMPLATE):
+    """The `testing_stages` array and `START_RATE` from the k6 script."""
+    with open(path) as script:
+        source = script.read()
+    body = source[source.index("testing_stages") :]
+    body = body[: body.index("]")]
+    stages = [
+        Stage(float(target), float(amount) * _UNIT_SECONDS[unit])
+        for target, amount, unit in _STAGE.findall(body)
+    ]
+    start_rate = _START_RATE.search(source)
+    if start_rate is None:
+        raise ValueError(f"no START_RATE in {path}")
+    return float(start_rate.group(1)), stages
+
+
+def scale(
+    stages: List[Stage], compress: float = 1.0, rate_scale: float = 1.0
+) -> List[Stage]:
+    """Shorten every stage by `compress` and multiply every rate by `rate_scale`."""
+    return [
+        Stage(stage.target * rate_scale, stage.duration / compress) for stage in stages
+    ]
+
+
+def rate_at(start_rate: float, stages: List[Stage], elapsed: float) -> float:
+    """Arrival rate at `elapsed` seconds, ramping linearly like k6 does."""
+    previous = start_rate
+    for stage in stages:
+        if elapsed < stage.duration:
+            return previous + (stage.target - previous) * elapsed / stage.duration
+        elapsed -= stage.duration
+        previous = stage.target
+    return 0.0
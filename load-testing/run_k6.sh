@@ -1,13 +1,19 @@
 #!/bin/bash
 cd /testing
-EC2_API_URL=$(aws cloudformation describe-stacks --stack-name cost-comparison-ec2 --region ap-southeast-2 --query 'Stacks[0].Outputs[?OutputKey==`HttpApiUrl`].OutputValue' --output text)
-ECS_API_URL=$(aws cloudformation describe-stacks --stack-name cost-comparison-ecs --region ap-southeast-2 --query 'Stacks[0].Outputs[?OutputKey==`HttpApiUrl`].OutputValue' --output text)
-LAMBDA_API_URL=$(aws cloudformation describe-stacks --stack-name cost-comparison-lambda --region ap-southeast-2 --query 'Stacks[0].Outputs[?OutputKey==`HttpApiUrl`].OutputValue' --output text)
+# Point a run at sweep variants, e.g. LAMBDA_STACK=cost-comparison-lambda-mem1024.
+EC2_STACK=${EC2_STACK:-cost-comparison-ec2}
+ECS_STACK=${ECS_STACK:-cost-comparison-ecs}
+LAMBDA_STACK=${LAMBDA_STACK:-cost-comparison-lambda}
+# HDR_DIR=runs also keeps mergeable latency histograms of the run (hdr.py).
+HDR_DIR=${HDR_DIR:-}
+EC2_API_URL=$(aws cloudformation describe-stacks --stack-name $EC2_STACK --region ap-southeast-2 --query 'Stacks[0].Outputs[?OutputKey==`HttpApiUrl`].OutputValue' --output text)
+ECS_API_URL=$(aws cloudformation describe-stacks --stack-name $ECS_STACK --region ap-southeast-2 --query 'Stacks[0].Outputs[?OutputKey==`HttpApiUrl`].OutputValue' --output text)
+LAMBDA_API_URL=$(aws cloudformation describe-stacks --stack-name $LAMBDA_STACK --region ap-southeast-2 --query 'Stacks[0].Outputs[?OutputKey==`HttpApiUrl`].OutputValue' --output text)
 
-ECS_SERVICE_NAME=$(aws cloudformation describe-stacks --stack-name cost-comparison-ecs --region ap-southeast-2 --query 'Stacks[0].Outputs[?OutputKey==`EcsServiceName`].OutputValue' --output text)
-ECS_CLUSTER_NAME=$(aws cloudformation describe-stacks --stack-name cost-comparison-ecs --region ap-southeast-2 --query 'Stacks[0].Outputs[?OutputKey==`EcsClusterName`].OutputValue' --output text)
-EC2_ASG_NAME=$(aws cloudformation describe-stacks --stack-name cost-comparison-ec2 --region ap-southeast-2 --query 'Stacks[0].Outputs[?OutputKey==`ASGName`].OutputValue' --output text)
-LAMBDA_FUNCTION_NAME=$(aws cloudformation describe-stacks --stack-name cost-comparison-lambda --region ap-southeast-2 --query 'Stacks[0].Outputs[?OutputKey==`LambdaFunctionName`].OutputValue' --output text)
+ECS_SERVICE_NAME=$(aws cloudformation describe-stacks --stack-name $ECS_STACK --region ap-southeast-2 --query 'Stacks[0].Outputs[?OutputKey==`EcsServiceName`].OutputValue' --output text)
+ECS_CLUSTER_NAME=$(aws cloudformation describe-stacks --stack-name $ECS_STACK --region ap-southeast-2 --query 'Stacks[0].Outputs[?OutputKey==`EcsClusterName`].OutputValue' --output text)
+EC2_ASG_NAME=$(aws cloudformation describe-stacks --stack-name $EC2_STACK --region ap-southeast-2 --query 'Stacks[0].Outputs[?OutputKey==`ASGName`].OutputValue' --output text)
+LAMBDA_FUNCTION_NAME=$(aws cloudformation describe-stacks --stack-name $LAMBDA_STACK --region ap-southeast-2 --query 'Stacks[0].Outputs[?OutputKey==`LambdaFunctionName`].OutputValue' --output text)
 SERVER_HOSTNAME=$(hostname)
 
 sudo sh -c "sed -e 's@EC2_API_URL@$EC2_API_URL@g ; s@ECS_API_URL@$ECS_API_URL@g ; s@LAMBDA_API_URL@$LAMBDA_API_URL@g ; s@ECS_SERVICE_NAME@$ECS_SERVICE_NAME@g ; s@ECS_CLUSTER_NAME@$ECS_CLUSTER_NAME@g ; s@EC2_ASG_NAME@$EC2_ASG_NAME@g ; s@LAMBDA_FUNCTION_NAME@$LAMBDA_FUNCTION_NAME@g ; s@SERVER_HOSTNAME@$SERVER_HOSTNAME@g' dashboard-template.json > dashboard.json"
@@ -17,5 +23,21 @@ EXECUTION_ID=$(date +'%Y%m%d-%H%M%S')
 sudo sh -c "sed -e 's@EXECUTION_ID@$EXECUTION_ID@g ; s@EC2_API_URL@$EC2_API_URL@g ; s@ECS_API_URL@$ECS_API_URL@g ; s@LAMBDA_API_URL@$LAMBDA_API_URL@g' script-template.js > script.js"
 echo "**********************************************************"
 echo "Use Execution ID $EXECUTION_ID to filter CloudWatch metrics"
+echo "Stacks: $EC2_STACK $ECS_STACK $LAMBDA_STACK"
 echo "**********************************************************"
-K6_STATSD_ENABLE_TAGS=true ./k6 run --out output-statsd script.js --no-thresholds --no-summary
\ No newline at end of file
+K6_OUTPUTS="--out output-statsd"
+if [ -n "$HDR_DIR" ]; then
+    # k6 writes its JSON stream into a pipe, so nothing grows on disk.
+    mkdir -p $HDR_DIR
+    HDR_PIPE=$(mktemp -u /tmp/k6-$EXECUTION_ID-XXXX.json)
+    mkfifo $HDR_PIPE
+    python3 hdr.py ingest $HDR_PIPE --out $HDR_DIR/$EXECUTION_ID.hdr &
+    HDR_PID=$!
+    K6_OUTPUTS="$K6_OUTPUTS --out json=$HDR_PIPE"
+fi
+K6_STATSD_ENABLE_TAGS=true ./k6 run $K6_OUTPUTS script.js --no-thresholds --no-summary
+if [ -n "$HDR_DIR" ]; then
+    wait $HDR_PID
+    rm -f $HDR_PIPE
+    echo "Latency histograms: $HDR_DIR/$EXECUTION_ID.hdr"
+fi
\ No newline at end of file
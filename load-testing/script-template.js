@@ -1,4 +1,5 @@
 import http from 'k6/http';
+import { Rate } from 'k6/metrics';
 
 const testing_stages = [
   { target: 100, duration: '15m' }, // 00:15
@@ -15,48 +16,118 @@ const testing_stages = [
   { target: 500, duration: '25m' }, // 04:40
   { target: 15, duration: '80m' }, // 06:00
 ]
+const START_RATE = 50;
+
+// `k6 run -e MODE=bulk` posts BULK_SIZE records per request to /bulk instead,
+// at 1/BULK_SIZE of the arrival rate, so both modes create records at the
+// same rate and their cost per record can be compared. `-e MODE=read` makes
+// every iteration create a record, read it back with GET /{id} and read one
+// of the VU's RECENT_IDS most recently created records.
+const MODE = __ENV.MODE || 'single';
+const BULK_SIZE = parseInt(__ENV.BULK_SIZE || '25');
+const RECENT_IDS = parseInt(__ENV.RECENT_IDS || '100');
+const EXEC_SUFFIX = { single: '', bulk: 'Bulk', read: 'Read' };
+
+function scenario(target) {
+  const bulk = MODE === 'bulk';
+  const divisor = bulk ? BULK_SIZE : 1;
+  return {
+    executor: 'ramping-arrival-rate',
+    exec: `${target}${EXEC_SUFFIX[MODE]}`,
+    startRate: Math.max(1, Math.round(START_RATE / divisor)),
+    timeUnit: '1s',
+    preAllocatedVUs: 1000,
+    stages: testing_stages.map((stage) => ({
+      target: Math.max(1, Math.round(stage.target / divisor)),
+      duration: stage.duration,
+    })),
+  };
+}
 
 export const options = {
   tags: {
     execution_id: 'EXECUTION_ID',
+    mode: MODE,
   },
   discardResponseBodies: true,
   scenarios: {
-    ec2: {
-      executor: 'ramping-arrival-rate',
-      exec: 'ec2',
-      startRate: 50,
-      timeUnit: '1s',
-      preAllocatedVUs: 1000,
-      stages: testing_stages,
-    },
-    ecs: {
-      executor: 'ramping-arrival-rate',
-      exec: 'ecs',
-      startRate: 50,
-      timeUnit: '1s',
-      preAllocatedVUs: 1000,
-      stages: testing_stages,
-    },
-    lambda: {
-      executor: 'ramping-arrival-rate',
-      exec: 'lambda',
-      startRate: 50,
-      timeUnit: '1s',
-      preAllocatedVUs: 1000,
-      stages: testing_stages,
-    },
+    ec2: scenario('ec2'),
+    ecs: scenario('ecs'),
+    lambda: scenario('lambda'),
   },
 };
-  
+
+// Lets the APIs tag their own StatsD timings with the execution id.
+const params = { headers: { 'X-Execution-Id': 'EXECUTION_ID' } };
+
 export function ec2() {
-  http.get('EC2_API_URL');
+  http.get('EC2_API_URL', params);
 }
 
 export function ecs() {
-  http.get('ECS_API_URL');
+  http.get('ECS_API_URL', params);
 }
 
 export function lambda() {
-  http.get('LAMBDA_API_URL');
-}
\ No newline at end of file
+  http.get('LAMBDA_API_URL', params);
+}
+
+const bulkBody = JSON.stringify({ count: BULK_SIZE });
+const bulkParams = {
+  headers: { ...params.headers, 'Content-Type': 'application/json' },
+  tags: { name: 'bulk' },
+};
+
+// The API URLs end with a slash.
+export function ec2Bulk() {
+  http.post('EC2_API_URLbulk', bulkBody, bulkParams);
+}
+
+export function ecsBulk() {
+  http.post('ECS_API_URLbulk', bulkBody, bulkParams);
+}
+
+export function lambdaBulk() {
+  http.post('LAMBDA_API_URLbulk', bulkBody, bulkParams);
+}
+
+// Share of GET /{id} requests answered from the API's read cache.
+const cacheHit = new Rate('cache_hit');
+const recentIds = [];
+const createParams = { ...params, responseType: 'text', tags: { name: 'create' } };
+const readParams = { ...params, tags: { name: 'read' } };
+
+function read(baseUrl, id) {
+  const response = http.get(`${baseUrl}${id}`, readParams);
+  if (response.status === 200) {
+    cacheHit.add(response.headers['X-Cache'] === 'hit');
+  }
+}
+
+function createAndRead(baseUrl) {
+  const created = http.get(baseUrl, createParams);
+  if (created.status !== 200) {
+    return;
+  }
+  const id = created.json('id');
+  read(baseUrl, id);
+  if (recentIds.length > 0) {
+    read(baseUrl, recentIds[Math.floor(Math.random() * recentIds.length)]);
+  }
+  recentIds.push(id);
+  if (recentIds.length > RECENT_IDS) {
+    recentIds.shift();
+  }
+}
+
+export function ec2Read() {
+  createAndRead('EC2_API_URL');
+}
+
+export function ecsRead() {
+  createAndRead('ECS_API_URL');
+}
+
+export function lambdaRead() {
+  createAndRead('LAMBDA_API_URL');
+}
@@ -0,0 +1,265 @@
+"""Admission control: a per-worker concurrency limit with a bounded wait queue.
+
+At most ADMISSION_MAX_IN_FLIGHT requests run at once in a worker; the next
+ADMISSION_QUEUE_SIZE wait in FIFO order for up to ADMISSION_QUEUE_TIMEOUT_MS.
+Anything beyond that is answered at once with a 503 and `Retry-After`, so
+an overloaded worker fails a few requests fast instead of letting every
+request queue until the load balancer gives up on it.
+
+Each worker samples its in-flight requests and queue depth every second and,
+with ADMISSION_METRICS_SERVICE set, publishes them with PutMetricData every
+ADMISSION_METRICS_INTERVAL_MS as `InFlight`, `QueueDepth`, `Shed` and
+`ConcurrencyUtilization` (in flight plus queued, as a percentage of the
+limit), with a `Service` dimension; with WRITE_ACK=journal also
+`JournalDepth` and `JournalOldestAge`, the records not yet uploaded and how
+long the oldest has waited. The EC2 and ECS stacks can scale on the
+fleet's average utilisation, which moves as soon as requests back up, while
+CPU lags behind for an I/O-bound service.
+"""
+
+import asyncio
+import collections
+import logging
+import math
+import os
+import threading
+import time
+
+from . import clients, writers
+from .config import settings
+from .errors import Overloaded
+from .fast_path import error_response
+from .telemetry import ON_LAMBDA
+
+logger = logging.getLogger(__name__)
+
+
+def max_in_flight() -> int:
+    if settings.admission_max_in_flight > 0:
+        return settings.admission_max_in_flight
+    # Beyond the thread pool, sync requests only queue inside anyio.
+    return 100 if settings.io_mode == "async" else settings.thread_pool_size
+
+
+class Limiter:
+    """The concurrency limit of one worker; used from its event loop only."""
+
+    def __init__(self, limit: int, queue_size: int, queue_timeout: float) -> None:
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiters = collections.deque()
+        self.admitted = 0
+        self.queued = 0
+        self.shed_queue_full = 0
+        self.shed_timeout = 0
+        self.waited = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    @property
+    def shed(self) -> int:
+        return self.shed_queue_full + self.shed_timeout
+
+    def _overloaded(self, reason: str) -> Overloaded:
+        return Overloaded(
+            f"worker overloaded: {reason}", retry_after=settings.admission_retry_after
+        )
+
+    async def acquire(self) -> None:
+        if self.in_flight < self.limit and not self.waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return
+        if len(self.waiters) >= self.queue_size:
+            self.shed_queue_full += 1
+            raise self._overloaded("wait queue is full")
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        self.queued += 1
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.shed_timeout += 1
+            raise self._overloaded(
+                f"queued for over {self.queue_timeout * 1000:.0f} ms"
+            ) from None
+        except BaseException:
+            # Cancelled after release() handed this request the slot.
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+        waited = time.perf_counter() - started
+        self.waited += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        self.admitted += 1
+
+    def release(self) -> None:
+        # The slot passes straight to the oldest waiter still waiting.
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def utilisation(self) -> float:
+        return (self.in_flight + len(self.waiters)) / self.limit * 100
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "queue_size": self.queue_size,
+            "in_flight": self.in_flight,
+            "queue_depth": len(self.waiters),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "shed_queue_full": self.shed_queue_full,
+            "shed_timeout": self.shed_timeout,
+            "queue_wait_avg_ms": (
+                self.wait_total / self.waited * 1000 if self.waited else 0.0
+            ),
+            "queue_wait_max_ms": self.wait_max * 1000,
+        }
+
+
+limiter = (
+    Limiter(
+        max_in_flight(), settings.admission_queue_size, settings.admission_queue_timeout
+    )
+    if settings.admission_control and not ON_LAMBDA
+    else None
+)
+
+
+def stats():
+    return limiter.stats() if limiter is not None else None
+
+
+class AdmissionMiddleware:
+    """Applies the worker's limiter to every request except `exempt` paths."""
+
+    def __init__(self, app, exempt: tuple = ("/metrics", "/admin/")) -> None:
+        self.app = app
+        self.exempt = exempt
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(self.exempt):
+            await self.app(scope, receive, send)
+            return
+        try:
+            await limiter.acquire()
+        except Overloaded as exc:
+            await error_response(exc)(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
+
+
+class _Series:
+    """One-second samples of a gauge, sent as CloudWatch StatisticValues."""
+
+    __slots__ = ("count", "total", "minimum", "maximum")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+
+    def statistic_values(self) -> dict:
+        return {
+            "SampleCount": self.count,
+            "Sum": self.total,
+            "Minimum": self.minimum,
+            "Maximum": self.maximum,
+        }
+
+
+class Publisher:
+    """Samples the limiter every second and sends the samples every interval."""
+
+    def __init__(self, service: str, namespace: str, interval: float) -> None:
+        self.dimensions = [{"Name": "Service", "Value": service}]
+        self.namespace = namespace
+        self.interval = interval
+        self.failures = 0
+        self._shed = 0
+
+    def run(self) -> None:
+        while True:
+            series = collections.defaultdict(_Series)
+            deadline = time.monotonic() + self.interval
+            while time.monotonic() < deadline:
+                time.sleep(1)
+                series["InFlight"].add(limiter.in_flight)
+                series["QueueDepth"].add(len(limiter.waiters))
+                series["ConcurrencyUtilization"].add(limiter.utilisation())
+                journal = writers.journal_stats()
+                if journal is not None:
+                    series["JournalDepth"].add(journal["depth_records"])
+                    series["JournalOldestAge"].add(journal["oldest_unflushed_s"])
+            shed, self._shed = limiter.shed - self._shed, limiter.shed
+            self.publish(series, shed)
+
+    def publish(self, series: dict, shed: int) -> None:
+        units = {"ConcurrencyUtilization": "Percent", "JournalOldestAge": "Seconds"}
+        metric_data = [
+            {
+                "MetricName": name,
+                "Dimensions": self.dimensions,
+                "StatisticValues": values.statistic_values(),
+                "Unit": units.get(name, "Count"),
+            }
+            for name, values in series.items()
+        ]
+        metric_data.append(
+            {
+                "MetricName": "Shed",
+                "Dimensions": self.dimensions,
+                "Value": shed,
+                "Unit": "Count",
+            }
+        )
+        try:
+            clients.client("cloudwatch").put_metric_data(
+                Namespace=self.namespace, MetricData=metric_data
+            )
+        except Exception:
+            self.failures += 1
+            logger.warning("Could not publish admission metrics", exc_info=True)
+
+
+_publisher_pid = None
+
+
+def start_publisher() -> None:
+    """Starts this worker's metric publisher, once per process."""
+    global _publisher_pid
+    if limiter is None or not settings.admission_metrics_service:
+        return
+    if _publisher_pid == os.getpid():
+        return
+    _publisher_pid = os.getpid()
+    publisher = Publisher(
+        settings.admission_metrics_service,
+        settings.admission_metrics_namespace,
+        settings.admission_metrics_interval,
+    )
+    threading.Thread(
+        target=publisher.run, name="admission-metrics", daemon=True
+    ).start()
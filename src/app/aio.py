@@ -0,0 +1,205 @@
+import asyncio
+import time
+
+from aiobotocore.config import AioConfig
+from aiobotocore.session import get_session
+
+from . import clients, resilience, storage, telemetry
+from .config import settings
+from .errors import DeadlineExceeded, Overloaded, WriteError
+from .writers import to_attribute_values
+
+# aiobotocore clients are bound to the event loop they were created on. Under
+# uvicorn/gunicorn there is one loop per worker; Mangum reuses the same loop
+# across invocations of a warm Lambda sandbox, so the clients survive too.
+_clients = {}
+_session = None
+
+
+def _instrument(client) -> None:
+    # aiohttp reports waits for a free connection through its trace hooks;
+    # aiobotocore does not expose them, so attach them to its client session.
+    import aiohttp
+
+    try:
+        http_session = client._endpoint.http_session
+        connector = http_session._connector
+        trace_configs = http_session._session._trace_configs
+    except AttributeError:
+        return
+    stats = clients.register_pool(client.meta.endpoint_url, connector.limit)
+    stats.in_use = lambda: len(connector._acquired)
+
+    async def on_request_start(session, context, params):
+        context.queued_at = None
+
+    async def on_queued_start(session, context, params):
+        context.queued_at = time.perf_counter()
+
+    async def on_connection_ready(session, context, params):
+        waited = (
+            time.perf_counter() - context.queued_at
+            if context.queued_at is not None
+            else 0.0
+        )
+        stats.checked_out(waited, context.queued_at is not None)
+
+    trace = aiohttp.TraceConfig()
+    trace.on_request_start.append(on_request_start)
+    trace.on_connection_queued_start.append(on_queued_start)
+    trace.on_connection_create_end.append(on_connection_ready)
+    trace.on_connection_reuseconn.append(on_connection_ready)
+    trace.freeze()
+    trace_configs.append(trace)
+
+
+async def _create_client(session, service: str):
+    client = await session.create_client(
+        service, config=AioConfig(**clients.client_options())
+    ).__aenter__()
+    _instrument(client)
+    resilience.register(client)
+    return client
+
+
+def _get_session():
+    global _session
+    if _session is None:
+        from . import models
+
+        _session = get_session()
+        models.install(_session)
+    return _session
+
+
+def preload_models() -> None:
+    from . import models
+
+    models.preload(_get_session())
+
+
+async def _create_clients():
+    if storage.is_local():
+        local = storage.AsyncStorage(storage.backend())
+        return local, local
+    session = _get_session()
+    s3 = await _create_client(session, "s3")
+    try:
+        dynamo_db = await _create_client(session, "dynamodb")
+    except BaseException:
+        await s3.__aexit__(None, None, None)
+        raise
+    return s3, dynamo_db
+
+
+async def get_clients():
+    loop = asyncio.get_running_loop()
+    task = _clients.get(loop)
+    if task is None or (task.done() and task.exception() is not None):
+        task = _clients[loop] = loop.create_task(_create_clients())
+    return await task
+
+
+async def close_clients() -> None:
+    task = _clients.pop(asyncio.get_running_loop(), None)
+    if task is None or not task.done() or task.exception() is not None:
+        return
+    for client in task.result():
+        await client.__aexit__(None, None, None)
+
+
+async def write_record(
+    bucket_name: str,
+    table_name: str,
+    guid: str,
+    batch_writer=None,
+    segment_writer=None,
+    journal=None,
+) -> dict:
+    """Stores one record; returns the attributes of its DynamoDB item."""
+    if journal is not None:
+        write = _append_record(journal, guid)
+    else:
+        write = _write_record(
+            bucket_name, table_name, guid, batch_writer, segment_writer
+        )
+    if settings.request_deadline <= 0:
+        return await write
+    with resilience.deadline(settings.request_deadline):
+        try:
+            return await asyncio.wait_for(write, settings.request_deadline)
+        except asyncio.TimeoutError:
+            raise resilience.deadline_exceeded()
+
+
+async def _append_record(journal, guid: str) -> dict:
+    try:
+        await telemetry.timed(
+            "journal", asyncio.wrap_future(journal.append(guid, guid.encode("utf-8")))
+        )
+    except Overloaded:
+        raise
+    except Exception as exc:
+        raise WriteError(guid, {"journal": exc})
+    return {"id": guid}
+
+
+async def _write_record(
+    bucket_name: str, table_name: str, guid: str, batch_writer, segment_writer
+) -> dict:
+    s3, dynamo_db = await get_clients()
+    payload = guid.encode("utf-8")
+    if segment_writer is not None:
+        # The item records where the payload landed, so it is written after.
+        try:
+            location = await telemetry.timed(
+                "s3",
+                asyncio.wrap_future(segment_writer.append(guid, payload, timeout=0)),
+            )
+        except (Overloaded, DeadlineExceeded):
+            raise
+        except Exception as exc:
+            raise WriteError(guid, {"s3": exc})
+        attributes = {"id": guid, **location.as_item()}
+        item = to_attribute_values(attributes)
+        try:
+            with telemetry.segment("dynamodb"):
+                if batch_writer is not None:
+                    await asyncio.wrap_future(batch_writer.submit(item, timeout=0))
+                else:
+                    await dynamo_db.put_item(TableName=table_name, Item=item)
+        except (Overloaded, DeadlineExceeded):
+            raise
+        except Exception as exc:
+            raise WriteError(guid, {"dynamodb": exc})
+        return attributes
+
+    item = {"id": {"S": guid}}
+    if batch_writer is not None:
+        # Never block the event loop on a full buffer: fail fast instead.
+        item_written = asyncio.wrap_future(batch_writer.submit(item, timeout=0))
+    else:
+        item_written = dynamo_db.put_item(TableName=table_name, Item=item)
+    results = await asyncio.gather(
+        telemetry.timed(
+            "s3",
+            resilience.put_object_async(
+                s3, Bucket=bucket_name, Key=f"{guid}.txt", Body=payload
+            ),
+        ),
+        telemetry.timed("dynamodb", item_written),
+        return_exceptions=True,
+    )
+    for result in results:
+        if isinstance(result, BaseException) and not isinstance(result, Exception):
+            raise result
+        if isinstance(result, DeadlineExceeded):
+            raise result
+    failures = {
+        target: result
+        for target, result in zip(("s3", "dynamodb"), results)
+        if isinstance(result, Exception)
+    }
+    if failures:
+        raise WriteError(guid, failures)
+    return {"id": guid}
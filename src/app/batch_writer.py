@@ -0,0 +1,207 @@
+import logging
+import queue
+import random
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Optional
+
+from .errors import Overloaded
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH_SIZE = 25  # BatchWriteItem limit
+ENQUEUE_POLL = 0.005  # seconds between retries while the queue is full
+
+
+class _Pending:
+    __slots__ = ("item", "future")
+
+    def __init__(self, item: dict) -> None:
+        self.item = item
+        self.future = Future()
+
+
+class BatchWriter:
+    """Coalesces concurrent put requests into BatchWriteItem calls.
+
+    Items are low-level DynamoDB items (`{"id": {"S": "..."}}`). `submit`
+    returns a future that resolves once the item is confirmed written, so a
+    request can be answered only after its own item is durable. Batches are
+    sent when they are full or when the oldest item has waited `max_wait`
+    seconds, whichever comes first.
+    """
+
+    def __init__(
+        self,
+        client,
+        table_name: str,
+        key: str = "id",
+        max_wait: float = 0.01,
+        queue_size: int = 1000,
+        enqueue_timeout: float = 1.0,
+        max_attempts: int = 8,
+        base_backoff: float = 0.025,
+        workers: int = 2,
+    ) -> None:
+        self.client = client
+        self.table_name = table_name
+        self.key = key
+        self.max_wait = max_wait
+        self.enqueue_timeout = enqueue_timeout
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._closed = threading.Event()
+        self._lock = threading.Lock()
+        self._threads = [
+            threading.Thread(
+                target=self._run, name=f"ddb-batch-writer-{i}", daemon=True
+            )
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, item: dict, timeout: Optional[float] = None) -> Future:
+        """Queue an item, waiting up to `timeout` seconds for buffer space."""
+        pending = _Pending(item)
+        timeout = self.enqueue_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        while True:
+            # close() takes the lock too, so nothing is queued once it has begun.
+            # The lock only covers the non-blocking put; waiting for space
+            # happens outside it so each caller's timeout bounds its own wait.
+            with self._lock:
+                if self._closed.is_set():
+                    raise RuntimeError("batch writer is closed")
+                try:
+                    self._queue.put_nowait(pending)
+                except queue.Full:
+                    pass
+                else:
+                    return pending.future
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise Overloaded("DynamoDB batch writer queue is full")
+            time.sleep(min(ENQUEUE_POLL, remaining))
+
+    def put(self, item: dict, timeout: Optional[float] = None) -> None:
+        self.submit(item).result(timeout)
+
+    def close(self, timeout: float = 10.0) -> None:
+        """Stop accepting items and flush everything already queued."""
+        with self._lock:
+            self._closed.set()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        # Whatever the workers did not take before the timeout is never sent.
+        error = RuntimeError("batch writer closed before the item was written")
+        while True:
+            try:
+                self._queue.get_nowait().future.set_exception(error)
+            except queue.Empty:
+                break
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            if batch:
+                self._write(batch)
+            elif self._closed.is_set():
+                return
+
+    def _collect(self) -> List[_Pending]:
+        try:
+            first = self._queue.get(timeout=0.1)
+        except queue.Empty:
+            return []
+        batch = [first]
+        keys = {self._key_of(first)}
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < MAX_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            try:
+                pending = (
+                    self._queue.get(timeout=remaining)
+                    if remaining > 0
+                    else self._queue.get_nowait()
+                )
+            except queue.Empty:
+                break
+            key = self._key_of(pending)
+            if key in keys:
+                # BatchWriteItem rejects duplicate keys; send it on its own.
+                self._write([pending])
+                continue
+            keys.add(key)
+            batch.append(pending)
+        return batch
+
+    def _key_of(self, pending: _Pending):
+        return repr(pending.item[self.key])
+
+    def _write(self, batch: List[_Pending]) -> None:
+        _write_batch(
+            self.client,
+            self.table_name,
+            batch,
+            self.key,
+            self.max_attempts,
+            self.base_backoff,
+        )
+
+
+def write_items(
+    client,
+    table_name: str,
+    items: List[dict],
+    key: str = "id",
+    max_attempts: int = 8,
+    base_backoff: float = 0.025,
+) -> List[Future]:
+    """Writes up to MAX_BATCH_SIZE items now, in the calling thread.
+
+    Returns one already resolved future per item, in order.
+    """
+    batch = [_Pending(item) for item in items]
+    _write_batch(client, table_name, batch, key, max_attempts, base_backoff)
+    return [pending.future for pending in batch]
+
+
+def _write_batch(
+    client,
+    table_name: str,
+    batch: List[_Pending],
+    key: str,
+    max_attempts: int,
+    base_backoff: float,
+) -> None:
+    by_key = {repr(pending.item[key]): pending for pending in batch}
+    requests = [{"PutRequest": {"Item": pending.item}} for pending in batch]
+    attempt = 0
+    try:
+        while requests:
+            attempt += 1
+            response = client.batch_write_item(RequestItems={table_name: requests})
+            unprocessed = response.get("UnprocessedItems", {}).get(table_name, [])
+            unprocessed_keys = {
+                repr(request["PutRequest"]["Item"][key]) for request in unprocessed
+            }
+            for item_key, pending in list(by_key.items()):
+                if item_key not in unprocessed_keys:
+                    pending.future.set_result(None)
+                    del by_key[item_key]
+            requests = unprocessed
+            if requests:
+                if attempt >= max_attempts:
+                    raise RuntimeError(
+                        f"{len(requests)} items still unprocessed after "
+                        f"{attempt} BatchWriteItem attempts"
+                    )
+                time.sleep(random.uniform(0, base_backoff * 2 ** (attempt - 1)))
+    except Exception as exc:
+        logger.warning("BatchWriteItem failed for %d items: %s", len(by_key), exc)
+        for pending in by_key.values():
+            pending.future.set_exception(exc)
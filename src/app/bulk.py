@@ -0,0 +1,309 @@
+"""Creates many records in one request for POST /bulk.
+
+Each record gets its own id and is written exactly as `process_request`
+writes one: its payload to S3 (as `{id}.txt`, or into a segment) and then
+its item to DynamoDB. S3 PUTs run with at most BULK_S3_CONCURRENCY in
+flight per request, and items go to DynamoDB with BatchWriteItem, through
+the shared batch writer in DYNAMODB_WRITE_MODE=batch. A record whose
+payload could not be stored gets no item. Failures are reported per record
+instead of failing the whole request.
+"""
+
+import asyncio
+import contextvars
+import threading
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, List, Optional
+
+from pydantic import BaseModel
+
+from . import clients, reads, resilience, telemetry, writers
+from .batch_writer import MAX_BATCH_SIZE, write_items
+from .config import settings
+
+_lock = threading.Lock()
+_executor = None
+
+
+def executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.thread_pool_size, thread_name_prefix="bulk"
+                )
+    return _executor
+
+
+class BulkRequest(BaseModel):
+    count: Optional[int] = None
+    payloads: Optional[List[str]] = None
+
+    def payload_list(self) -> List[Optional[bytes]]:
+        """One entry per record; None stores the record's own id, as `/` does."""
+        if (self.count is None) == (self.payloads is None):
+            raise ValueError("send either count or payloads")
+        size = self.count if self.payloads is None else len(self.payloads)
+        if not 1 <= size <= settings.bulk_max_items:
+            raise ValueError(
+                f"a bulk request creates 1 to {settings.bulk_max_items} records"
+            )
+        if self.payloads is None:
+            return [None] * self.count
+        return [payload.encode("utf-8") for payload in self.payloads]
+
+
+class Record:
+    __slots__ = ("guid", "payload", "attributes", "failures")
+
+    def __init__(self, payload: Optional[bytes], guid: Optional[str] = None) -> None:
+        self.guid = guid or str(uuid.uuid4())
+        self.payload = self.guid.encode("utf-8") if payload is None else payload
+        self.attributes = {"id": self.guid}
+        self.failures = {}
+
+    def failed(self, target: str, exc: BaseException) -> None:
+        self.failures[target] = exc
+
+    def result(self) -> dict:
+        if not self.failures:
+            return {"id": self.guid, "status": "created"}
+        return {
+            "id": self.guid,
+            "status": "failed",
+            "failed": {
+                target: f"{type(exc).__name__}: {exc}"
+                for target, exc in self.failures.items()
+            },
+        }
+
+
+def summary(records: List[Record]) -> dict:
+    for record in records:
+        if not record.failures:
+            reads.cache_written(record.guid, record.attributes, record.payload)
+    items = [record.result() for record in records]
+    failed = sum(1 for record in records if record.failures)
+    return {"created": len(records) - failed, "failed": failed, "items": items}
+
+
+def status_code(body: dict) -> int:
+    """200 when every record was created, 207 for some, 502 for none."""
+    if not body["failed"]:
+        return 200
+    return 207 if body["created"] else 502
+
+
+def _settle(futures: Dict, target: str, on_result=None) -> None:
+    """Waits for futures (within the deadline) and records their outcome."""
+    done, not_done = wait(futures, timeout=resilience.remaining())
+    for future in done:
+        record = futures[future]
+        try:
+            result = future.result()
+        except Exception as exc:
+            record.failed(target, exc)
+        else:
+            if on_result is not None:
+                on_result(record, result)
+    for future in not_done:
+        futures[future].failed(target, resilience.deadline_exceeded())
+
+
+def _located(record: Record, location) -> None:
+    record.attributes.update(location.as_item())
+
+
+def write_bulk(bucket_name: str, table_name: str, payloads: List[bytes]) -> dict:
+    with resilience.deadline(settings.request_deadline):
+        records = [Record(payload) for payload in payloads]
+        store(bucket_name, table_name, records)
+        return summary(records)
+
+
+def store(bucket_name: str, table_name: str, records: List[Record]) -> None:
+    """Writes the records, noting each one's failures on the record."""
+    with telemetry.segment("s3"):
+        segment_writer = writers.get_segment_writer()
+        if segment_writer is not None:
+            _append_segments(segment_writer, records)
+        else:
+            _put_objects(bucket_name, records)
+    with telemetry.segment("dynamodb"):
+        _write_items(table_name, [r for r in records if not r.failures])
+
+
+def _append_segments(segment_writer, records: List[Record]) -> None:
+    futures = {}
+    for record in records:
+        try:
+            futures[segment_writer.append(record.guid, record.payload)] = record
+        except Exception as exc:
+            record.failed("s3", exc)
+    _settle(futures, "s3", _located)
+
+
+def _put_objects(bucket_name: str, records: List[Record]) -> None:
+    client = clients.s3()
+    in_flight = {}
+    for record in records:
+        while len(in_flight) >= settings.bulk_s3_concurrency:
+            done, _ = wait(
+                in_flight, timeout=resilience.remaining(), return_when=FIRST_COMPLETED
+            )
+            if not done:
+                break
+            _settle({future: in_flight.pop(future) for future in done}, "s3")
+        if resilience.remaining() == 0:
+            record.failed("s3", resilience.deadline_exceeded())
+            continue
+        future = executor().submit(
+            contextvars.copy_context().run,
+            resilience.put_object,
+            client,
+            Bucket=bucket_name,
+            Key=f"{record.guid}.txt",
+            Body=record.payload,
+        )
+        in_flight[future] = record
+    _settle(in_flight, "s3")
+
+
+def _write_items(table_name: str, records: List[Record]) -> None:
+    batch_writer = writers.get_batch_writer()
+    if batch_writer is not None:
+        futures = {}
+        for record in records:
+            item = writers.to_attribute_values(record.attributes)
+            try:
+                futures[batch_writer.submit(item)] = record
+            except Exception as exc:
+                record.failed("dynamodb", exc)
+        _settle(futures, "dynamodb")
+        return
+    futures = {}
+    for chunk in _chunks(records):
+        futures[_submit_chunk(table_name, chunk)] = chunk
+    done, not_done = wait(futures, timeout=resilience.remaining())
+    for future in not_done:
+        for record in futures[future]:
+            record.failed("dynamodb", resilience.deadline_exceeded())
+    for future in done:
+        _settle_chunk(futures[future], future)
+
+
+def _chunks(records: List[Record]):
+    for start in range(0, len(records), MAX_BATCH_SIZE):
+        yield records[start : start + MAX_BATCH_SIZE]
+
+
+def _submit_chunk(table_name: str, chunk: List[Record]):
+    return executor().submit(
+        contextvars.copy_context().run,
+        write_items,
+        clients.dynamodb(),
+        table_name,
+        [writers.to_attribute_values(record.attributes) for record in chunk],
+        max_attempts=settings.dynamodb_batch_max_attempts,
+    )
+
+
+def _settle_chunk(chunk: List[Record], future) -> None:
+    try:
+        item_futures = future.result()
+    except Exception as exc:
+        for record in chunk:
+            record.failed("dynamodb", exc)
+        return
+    for record, item_future in zip(chunk, item_futures):
+        exc = item_future.exception()
+        if exc is not None:
+            record.failed("dynamodb", exc)
+
+
+async def write_bulk_async(
+    bucket_name: str, table_name: str, payloads: List[bytes]
+) -> dict:
+    from . import aio
+
+    with resilience.deadline(settings.request_deadline):
+        records = [Record(payload) for payload in payloads]
+        with telemetry.segment("s3"):
+            segment_writer = writers.get_segment_writer()
+            if segment_writer is not None:
+                tasks = {}
+                for record in records:
+                    try:
+                        future = segment_writer.append(
+                            record.guid, record.payload, timeout=0
+                        )
+                    except Exception as exc:
+                        record.failed("s3", exc)
+                    else:
+                        tasks[asyncio.wrap_future(future)] = record
+                await _settle_async(tasks, "s3", _located)
+            else:
+                s3, _ = await aio.get_clients()
+                semaphore = asyncio.Semaphore(settings.bulk_s3_concurrency)
+
+                async def put(record: Record):
+                    async with semaphore:
+                        return await resilience.put_object_async(
+                            s3,
+                            Bucket=bucket_name,
+                            Key=f"{record.guid}.txt",
+                            Body=record.payload,
+                        )
+
+                tasks = {
+                    asyncio.ensure_future(put(record)): record for record in records
+                }
+                await _settle_async(tasks, "s3")
+        with telemetry.segment("dynamodb"):
+            await _write_items_async(table_name, [r for r in records if not r.failures])
+        return summary(records)
+
+
+async def _write_items_async(table_name: str, records: List[Record]) -> None:
+    # BatchWriteItem runs on threads with the boto3 client, as in batch mode.
+    batch_writer = writers.get_batch_writer()
+    if batch_writer is not None:
+        tasks = {}
+        for record in records:
+            item = writers.to_attribute_values(record.attributes)
+            try:
+                tasks[asyncio.wrap_future(batch_writer.submit(item, timeout=0))] = (
+                    record
+                )
+            except Exception as exc:
+                record.failed("dynamodb", exc)
+        await _settle_async(tasks, "dynamodb")
+        return
+    chunks = {}
+    for chunk in _chunks(records):
+        chunks[asyncio.wrap_future(_submit_chunk(table_name, chunk))] = chunk
+    if not chunks:
+        return
+    done, not_done = await asyncio.wait(chunks, timeout=resilience.remaining())
+    for task in not_done:
+        for record in chunks[task]:
+            record.failed("dynamodb", resilience.deadline_exceeded())
+    for task in done:
+        _settle_chunk(chunks[task], task)
+
+
+async def _settle_async(tasks: Dict, target: str, on_result=None) -> None:
+    if not tasks:
+        return
+    done, not_done = await asyncio.wait(tasks, timeout=resilience.remaining())
+    for task in not_done:
+        task.cancel()
+        tasks[task].failed(target, resilience.deadline_exceeded())
+    for task in done:
+        record = tasks[task]
+        if task.exception() is not None:
+            record.failed(target, task.exception())
+        elif on_result is not None:
+            on_result(record, task.result())
@@ -0,0 +1,159 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+MISSING = object()  # cached answer for a key the backend does not have
+
+
+class CacheStats:
+    def __init__(self) -> None:
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.loads = 0
+        self.evictions = 0
+        self.expirations = 0
+
+
+class LRUCache:
+    """Bounded LRU cache with per-entry expiry and single-flight loading.
+
+    `get_or_load` calls the loader once per key however many threads miss
+    it at the same time, and `get_or_load_async` does the same for tasks.
+    A loader returns MISSING for keys the backend does not have; those are
+    kept for `negative_ttl` so repeated lookups of missing keys stay local.
+    """
+
+    def __init__(self, max_entries: int, ttl: float, negative_ttl: float) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.stats = CacheStats()
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._loading = {}
+        self._loading_async = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _lookup(self, key):
+        """Returns the cached value or None; call with the lock held."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires <= time.monotonic():
+            del self._entries[key]
+            self.stats.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        if value is MISSING:
+            self.stats.negative_hits += 1
+        else:
+            self.stats.hits += 1
+        return entry
+
+    def _store(self, key, value) -> None:
+        ttl = self.negative_ttl if value is MISSING else self.ttl
+        if ttl <= 0:
+            self._entries.pop(key, None)
+            return
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats.evictions += 1
+
+    def _store_loaded(self, key, value) -> None:
+        entry = self._entries.get(key)
+        if value is MISSING and entry is not None and entry[1] is not MISSING:
+            # Written through while the load was in flight; keep the write.
+            return
+        self._store(key, value)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._lookup(key)
+        return default if entry is None else entry[1]
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            self._store(key, value)
+
+    def get_or_load(self, key, loader):
+        """Returns `(value, hit)`; MISSING values are returned as is."""
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None:
+                return entry[1], True
+            future = self._loading.get(key)
+            if future is None:
+                future = self._loading[key] = Future()
+                owner = True
+                self.stats.misses += 1
+                self.stats.loads += 1
+            else:
+                owner = False
+                self.stats.coalesced += 1
+        if not owner:
+            return future.result(), False
+        try:
+            value = loader()
+        except BaseException as exc:
+            with self._lock:
+                del self._loading[key]
+            future.set_exception(exc)
+            raise
+        with self._lock:
+            self._store_loaded(key, value)
+            del self._loading[key]
+        future.set_result(value)
+        return value, False
+
+    async def get_or_load_async(self, key, loader):
+        """`get_or_load` for coroutine loaders, on one event loop."""
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None:
+                return entry[1], True
+            task = self._loading_async.get(key)
+            if task is None:
+                self.stats.misses += 1
+                self.stats.loads += 1
+            else:
+                self.stats.coalesced += 1
+        if task is not None:
+            # Shielded so a cancelled waiter does not cancel everyone's load.
+            return await asyncio.shield(task), False
+        task = self._loading_async[key] = asyncio.ensure_future(loader())
+        task.add_done_callback(lambda done: self._loaded(key, done))
+        return await asyncio.shield(task), False
+
+    def _loaded(self, key, task) -> None:
+        self._loading_async.pop(key, None)
+        if not task.cancelled() and task.exception() is None:
+            with self._lock:
+                self._store_loaded(key, task.result())
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            stats = self.stats
+            lookups = stats.hits + stats.negative_hits + stats.misses + stats.coalesced
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": stats.hits,
+                "negative_hits": stats.negative_hits,
+                "misses": stats.misses,
+                "coalesced": stats.coalesced,
+                "loads": stats.loads,
+                "evictions": stats.evictions,
+                "expirations": stats.expirations,
+                "hit_ratio": (
+                    (stats.hits + stats.negative_hits) / lookups if lookups else None
+                ),
+            }
@@ -0,0 +1,242 @@
+"""Per-worker throughput ceiling, with records kept on the worker instead of AWS.
+
+    python -m app.ceiling                          # GET /, 64 connections, 10 s
+    python -m app.ceiling --backend sqlite --io-mode async --json ceiling.json
+    python -m app.ceiling --path /health
+
+Starts `app.server` with a single worker and STORAGE_BACKEND=memory (or
+--backend), so no request waits on S3 or DynamoDB, and keeps every connection
+busy: each sends its next request as soon as the previous one is answered.
+The worker's CPU time comes from /proc, so CPU per request, and the ceiling
+per core it implies, hold even with the load generator on the same machine.
+If the worker used well under one core, it waited on the storage backend or
+the generator could not keep up.
+
+Run it inside each platform's image (`docker run IMAGE python -m app.ceiling`
+for ECS, `/api/.venv/bin/python -m app.ceiling` on an EC2 instance) and keep
+the result next to the load test it belongs to: the ceiling times the worker
+count is the most a task or instance can serve before AWS latency is added.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+HOST = "127.0.0.1"
+
+
+def _free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind((HOST, 0))
+        return probe.getsockname()[1]
+
+
+def _worker_cpu_seconds(master_pid: int) -> float:
+    """User plus system CPU time of the gunicorn master's children."""
+    ticks = os.sysconf("SC_CLK_TCK")
+    total = 0
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as stat:
+                # The command name may contain spaces; fields follow the ")".
+                fields = stat.read().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        if int(fields[1]) == master_pid:
+            total += int(fields[11]) + int(fields[12])
+    return total / ticks
+
+
+def _request(path: str) -> bytes:
+    return f"GET {path} HTTP/1.1\r\nHost: {HOST}\r\n\r\n".encode("ascii")
+
+
+async def _response(reader) -> int:
+    head = await reader.readuntil(b"\r\n\r\n")
+    length = 0
+    for line in head.split(b"\r\n")[1:]:
+        name, _, value = line.partition(b":")
+        if name.strip().lower() == b"content-length":
+            length = int(value)
+    if length:
+        await reader.readexactly(length)
+    return int(head[9:12])
+
+
+class Results:
+    def __init__(self) -> None:
+        self.latencies = []
+        self.errors = 0
+
+    def record(self, status: int, seconds: float) -> None:
+        self.latencies.append(seconds)
+        self.errors += status >= 400
+
+
+async def _connection(port: int, request: bytes, until: float, results) -> None:
+    reader, writer = await asyncio.open_connection(HOST, port)
+    try:
+        while time.perf_counter() < until:
+            started = time.perf_counter()
+            writer.write(request)
+            status = await _response(reader)
+            results.record(status, time.perf_counter() - started)
+    finally:
+        writer.close()
+
+
+async def drive(port: int, path: str, connections: int, seconds: float) -> Results:
+    request = _request(path)
+    results = Results()
+    until = time.perf_counter() + seconds
+    await asyncio.gather(
+        *(_connection(port, request, until, results) for _ in range(connections))
+    )
+    return results
+
+
+async def _get(port: int, path: str) -> int:
+    reader, writer = await asyncio.open_connection(HOST, port)
+    try:
+        writer.write(_request(path))
+        return await _response(reader)
+    finally:
+        writer.close()
+
+
+async def wait_ready(port: int, server, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit(f"app.server exited with status {server.returncode}")
+        try:
+            if await _get(port, "/ready") == 200:
+                return
+        except (OSError, asyncio.IncompleteReadError):
+            pass
+        await asyncio.sleep(0.2)
+    raise SystemExit(f"app.server was not ready after {timeout:.0f} s")
+
+
+def _percentile(ordered: list, percentile: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+
+
+def measure(args, port: int, master_pid: int) -> dict:
+    asyncio.run(drive(port, args.path, args.connections, args.warmup))
+    cpu_before = _worker_cpu_seconds(master_pid)
+    started = time.perf_counter()
+    results = asyncio.run(drive(port, args.path, args.connections, args.duration))
+    elapsed = time.perf_counter() - started
+    cpu = _worker_cpu_seconds(master_pid) - cpu_before
+    ordered = sorted(results.latencies)
+    requests = len(ordered)
+    return {
+        "backend": args.backend,
+        "io_mode": args.io_mode,
+        "path": args.path,
+        "connections": args.connections,
+        "duration_s": round(elapsed, 2),
+        "requests": requests,
+        "errors": results.errors,
+        "rps": round(requests / elapsed, 1),
+        "p50_ms": round(_percentile(ordered, 50) * 1000, 2) if ordered else None,
+        "p99_ms": round(_percentile(ordered, 99) * 1000, 2) if ordered else None,
+        "max_ms": round(ordered[-1] * 1000, 2) if ordered else None,
+        "worker_cpu_utilisation": round(cpu / elapsed, 2),
+        "cpu_ms_per_request": round(cpu / requests * 1000, 3) if requests else None,
+        "ceiling_rps_per_core": round(requests / cpu, 1) if cpu else None,
+    }
+
+
+def print_report(result: dict) -> None:
+    print(
+        f"{result['backend']}/{result['io_mode']} GET {result['path']}, "
+        f"{result['connections']} connections, {result['duration_s']} s"
+    )
+    for name in (
+        "requests",
+        "errors",
+        "rps",
+        "p50_ms",
+        "p99_ms",
+        "max_ms",
+        "worker_cpu_utilisation",
+        "cpu_ms_per_request",
+        "ceiling_rps_per_core",
+    ):
+        print(f"  {name:<24}{result[name]}")
+    if result["worker_cpu_utilisation"] < 0.9:
+        print("  the worker was not CPU-bound: it waited on storage or the generator")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--backend", default="memory", choices=("memory", "filesystem", "sqlite")
+    )
+    parser.add_argument(
+        "--io-mode",
+        default=os.environ.get("IO_MODE", "sync"),
+        choices=("sync", "async"),
+    )
+    parser.add_argument("--path", default="/")
+    parser.add_argument("--connections", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--warmup", type=float, default=2)
+    parser.add_argument(
+        "--env", action="append", default=[], help="KEY=VALUE for the server"
+    )
+    parser.add_argument("--json", help="also write the result to this file")
+    args = parser.parse_args()
+
+    port = _free_port()
+    with tempfile.TemporaryDirectory(prefix="ceiling-") as storage_path:
+        env = dict(os.environ)
+        env.setdefault("AWS_DEFAULT_REGION", "ap-southeast-2")
+        env.setdefault("S3_BUCKET_NAME", "ceiling")
+        env.setdefault("DYNAMODB_TABLE", "ceiling")
+        env.update(
+            STORAGE_BACKEND=args.backend,
+            STORAGE_PATH=storage_path,
+            IO_MODE=args.io_mode,
+            WEB_WORKERS="1",
+            WEB_BIND=f"{HOST}:{port}",
+            STATSD_HOST="",
+            ADMISSION_METRICS_SERVICE="",
+        )
+        env.update(variable.split("=", 1) for variable in args.env)
+        src_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env["PYTHONPATH"] = os.pathsep.join(
+            filter(None, [src_dir, env.get("PYTHONPATH")])
+        )
+        server = subprocess.Popen(
+            [sys.executable, "-m", "app.server"],
+            env=env,
+            stdout=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        try:
+            asyncio.run(wait_ready(port, server, timeout=60))
+            result = measure(args, port, server.pid)
+        finally:
+            os.killpg(server.pid, signal.SIGTERM)
+            server.wait()
+
+    print_report(result)
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump(result, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+import logging
+import threading
+import time
+
+from . import resilience
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# Low-level clients are cheaper to build than boto3 resources (no resource
+# model to load) and are thread-safe once built, so each process builds one
+# per service on first use and reuses it across requests and invocations.
+# boto3 sessions are not thread-safe, so the shared session and every client
+# built from it are created under the lock.
+_lock = threading.Lock()
+_session = None
+_clients = {}
+construction_times = {}
+
+
+def max_pool_connections() -> int:
+    """Connections per endpoint pool, sized to this worker's concurrency."""
+    if settings.aws_max_pool_connections > 0:
+        return settings.aws_max_pool_connections
+    if settings.io_mode == "async":
+        return 100
+    # Every thread-pool thread may hold one connection, plus the background
+    # batch and segment writer threads.
+    writer_threads = settings.dynamodb_batch_workers + 2
+    # A hedged S3 PUT holds a second connection while the first is in flight.
+    hedges = settings.thread_pool_size if settings.s3_hedge else 0
+    # POST /bulk runs its writes on a second pool of the same size (bulk.py).
+    bulk_threads = settings.thread_pool_size
+    return settings.thread_pool_size + writer_threads + hedges + bulk_threads
+
+
+def client_options() -> dict:
+    """botocore Config options shared by the boto3 and aiobotocore clients."""
+    return dict(
+        max_pool_connections=max_pool_connections(),
+        connect_timeout=settings.aws_connect_timeout,
+        read_timeout=settings.aws_read_timeout,
+        tcp_keepalive=settings.aws_tcp_keepalive,
+        retries={
+            "mode": settings.aws_retry_mode,
+            "max_attempts": settings.aws_max_attempts,
+        },
+    )
+
+
+def client_config():
+    from botocore.config import Config
+
+    return Config(**client_options())
+
+
+def client(service: str):
+    if service in ("s3", "dynamodb") and settings.storage_backend != "aws":
+        # Only imported when configured, so AWS deployments never load it.
+        from . import storage
+
+        return storage.backend()
+    existing = _clients.get(service)
+    if existing is not None:
+        return existing
+    with _lock:
+        if service not in _clients:
+            started = time.perf_counter()
+            created = _get_session().client(service, config=client_config())
+            _instrument(created)
+            resilience.register(created)
+            _clients[service] = created
+            construction_times[service] = time.perf_counter() - started
+        return _clients[service]
+
+
+def _get_session():
+    # Callers hold _lock.
+    global _session
+    if _session is None:
+        import boto3
+
+        from . import models
+
+        _session = boto3.session.Session()
+        models.install(_session._session)
+    return _session
+
+
+def preload_models() -> None:
+    """Loads the service models into the shared session (see models.py)."""
+    from . import models
+
+    with _lock:
+        models.preload(_get_session()._session)
+
+
+def s3():
+    return client("s3")
+
+
+def dynamodb():
+    return client("dynamodb")
+
+
+class PoolStats:
+    """Checkout counters for one endpoint's connection pool."""
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self.in_use = None  # callable reporting connections currently checked out
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.saturated = 0
+        self.timeouts = 0
+        self.discarded = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def checked_out(self, waited: float, saturated: bool) -> None:
+        with self.lock:
+            self.checkouts += 1
+            self.saturated += saturated
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+    def timed_out(self) -> None:
+        with self.lock:
+            self.timeouts += 1
+
+    def returned(self, discarded: bool) -> None:
+        if discarded:
+            with self.lock:
+                self.discarded += 1
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "maxsize": self.maxsize,
+                "in_use": self.in_use() if self.in_use else None,
+                "checkouts": self.checkouts,
+                "saturated": self.saturated,
+                "timeouts": self.timeouts,
+                "discarded": self.discarded,
+                "wait_avg_ms": (
+                    self.wait_total / self.checkouts * 1000 if self.checkouts else 0.0
+                ),
+                "wait_max_ms": self.wait_max * 1000,
+            }
+
+
+_pool_stats = {}
+_pool_stats_lock = threading.Lock()
+
+
+def pool_stats() -> dict:
+    return {endpoint: stats.snapshot() for endpoint, stats in _pool_stats.items()}
+
+
+def register_pool(endpoint: str, maxsize: int) -> PoolStats:
+    with _pool_stats_lock:
+        stats = _pool_stats.get(endpoint)
+        if stats is None:
+            stats = _pool_stats[endpoint] = PoolStats(maxsize)
+        return stats
+
+
+def _instrumented(pool_class):
+    class InstrumentedPool(pool_class):
+        def __init__(self, host, port=None, *args, **kwargs):
+            if settings.aws_pool_block:
+                # Wait for a pooled connection instead of opening a throwaway one.
+                kwargs["block"] = True
+            super().__init__(host, port, *args, **kwargs)
+            endpoint = f"{self.scheme}://{host}" + (f":{port}" if port else "")
+            self.stats = register_pool(endpoint, self.pool.maxsize)
+            self.stats.in_use = self._in_use
+
+        def _in_use(self) -> int:
+            pool = self.pool
+            return pool.maxsize - pool.qsize() if pool is not None else 0
+
+        def _get_conn(self, timeout=None):
+            if timeout is None and self.block:
+                timeout = settings.aws_pool_timeout
+            # The queue starts with maxsize placeholders; empty means every
+            # slot is checked out.
+            saturated = self.pool is not None and self.pool.qsize() == 0
+            started = time.perf_counter()
+            try:
+                conn = super()._get_conn(timeout)
+            except Exception:
+                self.stats.timed_out()
+                raise
+            self.stats.checked_out(time.perf_counter() - started, saturated)
+            return conn
+
+        def _put_conn(self, conn):
+            discarded = self.pool is not None and self.pool.full()
+            self.stats.returned(discarded)
+            super()._put_conn(conn)
+
+    InstrumentedPool.__name__ = f"Instrumented{pool_class.__name__}"
+    return InstrumentedPool
+
+
+def _instrument(created) -> None:
+    # botocore does not expose its urllib3 pools, so swap the pool classes on
+    # the client's http session before any pool has been created.
+    try:
+        http_session = created._endpoint.http_session
+        classes = {
+            scheme: _instrumented(pool_class)
+            for scheme, pool_class in http_session._pool_classes_by_scheme.items()
+        }
+        http_session._pool_classes_by_scheme = classes
+        http_session._manager.pool_classes_by_scheme = classes
+    except AttributeError:
+        logger.warning("Connection pool metrics unavailable for %s", created)
@@ -0,0 +1,283 @@
+import os
+from dataclasses import dataclass
+
+
+def env_str(name: str, default: str) -> str:
+    return os.environ.get(name, default).strip() or default
+
+
+def env_int(name: str, default: int) -> int:
+    value = os.environ.get(name, "").strip()
+    return int(value) if value else default
+
+
+def env_float(name: str, default: float) -> float:
+    value = os.environ.get(name, "").strip()
+    return float(value) if value else default
+
+
+def env_bool(name: str, default: bool) -> bool:
+    value = os.environ.get(name, "").strip().lower()
+    if not value:
+        return default
+    return value in ("1", "true", "yes", "on")
+
+
+def env_choice(name: str, default: str, choices: tuple) -> str:
+    value = env_str(name, default).lower()
+    if value not in choices:
+        raise ValueError(f"{name} must be one of {', '.join(choices)}, got {value!r}")
+    return value
+
+
+@dataclass(frozen=True)
+class Settings:
+    # "sync" runs process_request on the anyio thread pool with boto3,
+    # "async" runs it on the event loop with aiobotocore.
+    io_mode: str
+    # "lazy" builds AWS clients on first use, "eager" at import (INIT phase).
+    startup_mode: str
+    init_report: bool
+    # Pickled botocore models from `python -m app.models build`; unset reads
+    # botocore's JSON files.
+    botocore_model_cache: str
+    # Where records go: "aws" for S3 and DynamoDB, or "memory", "filesystem"
+    # or "sqlite" on the worker itself, under STORAGE_PATH (see storage.py).
+    storage_backend: str
+    storage_path: str
+    # STORAGE_BACKEND=simulated: latency per attempt, as a distribution in
+    # milliseconds (see storage.Latency), and the share of attempts that are
+    # throttled or fail.
+    simulated_s3_latency: str
+    simulated_dynamodb_latency: str
+    simulated_throttle_rate: float
+    simulated_error_rate: float
+    # Threads anyio may use for sync handlers; the AWS connection pools are
+    # sized from it unless AWS_MAX_POOL_CONNECTIONS is set.
+    thread_pool_size: int
+    aws_max_pool_connections: int
+    aws_connect_timeout: float
+    aws_read_timeout: float
+    aws_tcp_keepalive: bool
+    aws_pool_block: bool
+    aws_pool_timeout: float
+    # botocore retry mode; "adaptive" also rate-limits sends client-side
+    # once the service throttles (see resilience.py).
+    aws_retry_mode: str
+    aws_max_attempts: int
+    # Time budget for a request's writes; 0 disables it.
+    request_deadline: float
+    # Send a second, identical S3 PUT when the first is slower than the
+    # given percentile of recent PUTs.
+    s3_hedge: bool
+    s3_hedge_percentile: float
+    s3_hedge_min_delay: float
+    s3_hedge_max_ratio: float
+    # "single" calls PutItem per request, "batch" coalesces concurrent
+    # requests into BatchWriteItem calls (see batch_writer.py).
+    dynamodb_write_mode: str
+    dynamodb_batch_max_wait: float
+    dynamodb_batch_queue_size: int
+    dynamodb_batch_enqueue_timeout: float
+    dynamodb_batch_max_attempts: int
+    dynamodb_batch_workers: int
+    # "object" writes one {guid}.txt per request, "segment" packs payloads
+    # into larger segment objects (see segment_writer.py).
+    s3_write_mode: str
+    s3_segment_prefix: str
+    s3_segment_max_bytes: int
+    s3_segment_max_age: float
+    s3_segment_index: bool
+    # "remote" answers once S3 and DynamoDB have the record, "journal" once
+    # it is in the worker's local journal (see journal.py).
+    write_ack: str
+    journal_dir: str
+    journal_max_bytes: int
+    journal_segment_bytes: int
+    journal_commit_wait: float
+    journal_upload_batch: int
+    journal_upload_workers: int
+    # POST /bulk: most records per request, and S3 PUTs in flight per request.
+    bulk_max_items: int
+    bulk_s3_concurrency: int
+    # GET /{id}: entries in the in-process read cache (0 disables it), and
+    # how long found and missing records are cached.
+    read_cache_size: int
+    read_cache_ttl: float
+    read_cache_negative_ttl: float
+    # Per-worker concurrency limit and wait queue (see admission.py); 0 in
+    # flight means THREAD_POOL_SIZE in sync mode and 100 in async mode.
+    admission_control: bool
+    admission_max_in_flight: int
+    admission_queue_size: int
+    admission_queue_timeout: float
+    admission_retry_after: int
+    # In-flight and queue-depth metrics; not published without a service.
+    admission_metrics_service: str
+    admission_metrics_namespace: str
+    admission_metrics_interval: float
+    # Answer /health and /ready in a raw ASGI middleware instead of FastAPI
+    # routes.
+    health_fast_path: bool
+    # /ready fails until AWS clients are built and connections opened with
+    # probe calls (see readiness.py), or the timeout has passed. Under
+    # app.server, it also fails until every worker on the host is ready.
+    readiness_warmup: bool
+    readiness_connections: int
+    readiness_probes: int
+    readiness_timeout: float
+    readiness_dir: str
+    # Sampling profiler (see profiler.py); PROFILER starts it in every worker.
+    profiler: bool
+    profiler_interval: float
+    profiler_mode: str
+    profiler_max_stacks: int
+    profiler_max_depth: int
+    profiler_dir: str
+    profiler_export_interval: float
+    profiler_top: int
+    # Bearer token of the /admin routes; they are not served without one.
+    admin_token: str
+    # "mangum" serves every Lambda event through ASGI, "native" answers the
+    # hot routes straight from the event (see lambda_handler.py).
+    lambda_handler: str
+    # Per-request timings sent over StatsD (telemetry.py); off without a host.
+    # With an EMF namespace they are printed as Embedded Metric Format instead.
+    platform: str
+    emf_namespace: str
+    statsd_host: str
+    statsd_port: int
+    statsd_prefix: str
+    statsd_flush_interval: float
+    statsd_reservoir: int
+    # Launcher (server.py) settings; 0 workers means size from available CPUs.
+    web_bind: str
+    web_workers: int
+    web_workers_per_cpu: float
+    web_loop: str
+    web_http: str
+    web_keepalive: int
+    web_backlog: int
+    web_graceful_timeout: int
+    # In the gunicorn master, before forking: load the botocore models, then
+    # move every object to gc's permanent generation (see server.py).
+    web_preload_models: bool
+    web_gc_freeze: bool
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        return cls(
+            io_mode=env_choice("IO_MODE", "sync", ("sync", "async")),
+            startup_mode=env_choice("STARTUP_MODE", "lazy", ("lazy", "eager")),
+            init_report=env_bool("INIT_REPORT", False),
+            botocore_model_cache=os.environ.get("BOTOCORE_MODEL_CACHE", "").strip(),
+            storage_backend=env_choice(
+                "STORAGE_BACKEND",
+                "aws",
+                ("aws", "memory", "filesystem", "sqlite", "simulated"),
+            ),
+            storage_path=env_str("STORAGE_PATH", "/tmp/api-storage"),
+            simulated_s3_latency=env_str("SIMULATED_S3_LATENCY", "lognormal:25:0.4"),
+            simulated_dynamodb_latency=env_str(
+                "SIMULATED_DYNAMODB_LATENCY", "lognormal:8:0.4"
+            ),
+            simulated_throttle_rate=env_float("SIMULATED_THROTTLE_RATE", 0),
+            simulated_error_rate=env_float("SIMULATED_ERROR_RATE", 0),
+            thread_pool_size=env_int("THREAD_POOL_SIZE", 40),
+            aws_max_pool_connections=env_int("AWS_MAX_POOL_CONNECTIONS", 0),
+            aws_connect_timeout=env_float("AWS_CONNECT_TIMEOUT", 2),
+            aws_read_timeout=env_float("AWS_READ_TIMEOUT", 10),
+            aws_tcp_keepalive=env_bool("AWS_TCP_KEEPALIVE", True),
+            aws_pool_block=env_bool("AWS_POOL_BLOCK", False),
+            aws_pool_timeout=env_float("AWS_POOL_TIMEOUT", 1),
+            aws_retry_mode=env_choice(
+                "AWS_RETRY_MODE", "legacy", ("legacy", "standard", "adaptive")
+            ),
+            aws_max_attempts=env_int("AWS_MAX_ATTEMPTS", 3),
+            request_deadline=env_float("REQUEST_DEADLINE_MS", 0) / 1000,
+            s3_hedge=env_bool("S3_HEDGE", False),
+            s3_hedge_percentile=env_float("S3_HEDGE_PERCENTILE", 95),
+            s3_hedge_min_delay=env_float("S3_HEDGE_MIN_DELAY_MS", 20) / 1000,
+            s3_hedge_max_ratio=env_float("S3_HEDGE_MAX_RATIO", 0.05),
+            dynamodb_write_mode=env_choice(
+                "DYNAMODB_WRITE_MODE", "single", ("single", "batch")
+            ),
+            dynamodb_batch_max_wait=env_float("DYNAMODB_BATCH_MAX_WAIT_MS", 10) / 1000,
+            dynamodb_batch_queue_size=env_int("DYNAMODB_BATCH_QUEUE_SIZE", 1000),
+            dynamodb_batch_enqueue_timeout=env_float(
+                "DYNAMODB_BATCH_ENQUEUE_TIMEOUT_MS", 1000
+            )
+            / 1000,
+            dynamodb_batch_max_attempts=env_int("DYNAMODB_BATCH_MAX_ATTEMPTS", 8),
+            dynamodb_batch_workers=env_int("DYNAMODB_BATCH_WORKERS", 2),
+            s3_write_mode=env_choice("S3_WRITE_MODE", "object", ("object", "segment")),
+            s3_segment_prefix=env_str("S3_SEGMENT_PREFIX", "segments/"),
+            s3_segment_max_bytes=env_int("S3_SEGMENT_MAX_BYTES", 4 * 1024 * 1024),
+            s3_segment_max_age=env_float("S3_SEGMENT_MAX_AGE_MS", 50) / 1000,
+            s3_segment_index=env_bool("S3_SEGMENT_INDEX", True),
+            write_ack=env_choice("WRITE_ACK", "remote", ("remote", "journal")),
+            journal_dir=env_str("JOURNAL_DIR", "/var/tmp/api-journal"),
+            journal_max_bytes=env_int("JOURNAL_MAX_BYTES", 64 * 1024 * 1024),
+            journal_segment_bytes=env_int("JOURNAL_SEGMENT_BYTES", 16 * 1024 * 1024),
+            journal_commit_wait=env_float("JOURNAL_COMMIT_WAIT_MS", 0) / 1000,
+            journal_upload_batch=env_int("JOURNAL_UPLOAD_BATCH", 100),
+            journal_upload_workers=env_int("JOURNAL_UPLOAD_WORKERS", 4),
+            bulk_max_items=env_int("BULK_MAX_ITEMS", 100),
+            bulk_s3_concurrency=env_int("BULK_S3_CONCURRENCY", 16),
+            read_cache_size=env_int("READ_CACHE_SIZE", 10000),
+            read_cache_ttl=env_float("READ_CACHE_TTL_MS", 60000) / 1000,
+            read_cache_negative_ttl=env_float("READ_CACHE_NEGATIVE_TTL_MS", 5000)
+            / 1000,
+            admission_control=env_bool("ADMISSION_CONTROL", False),
+            admission_max_in_flight=env_int("ADMISSION_MAX_IN_FLIGHT", 0),
+            admission_queue_size=env_int("ADMISSION_QUEUE_SIZE", 64),
+            admission_queue_timeout=env_float("ADMISSION_QUEUE_TIMEOUT_MS", 1000)
+            / 1000,
+            admission_retry_after=env_int("ADMISSION_RETRY_AFTER", 1),
+            admission_metrics_service=os.environ.get(
+                "ADMISSION_METRICS_SERVICE", ""
+            ).strip(),
+            admission_metrics_namespace=env_str(
+                "ADMISSION_METRICS_NAMESPACE", "cost-comparison-app"
+            ),
+            admission_metrics_interval=env_float("ADMISSION_METRICS_INTERVAL_MS", 60000)
+            / 1000,
+            health_fast_path=env_bool("HEALTH_FAST_PATH", True),
+            readiness_warmup=env_bool("READINESS_WARMUP", True),
+            readiness_connections=env_int("READINESS_CONNECTIONS", 4),
+            readiness_probes=env_int("READINESS_PROBES", 2),
+            readiness_timeout=env_float("READINESS_TIMEOUT_MS", 30000) / 1000,
+            readiness_dir=env_str("READINESS_DIR", "/tmp/api-ready"),
+            profiler=env_bool("PROFILER", False),
+            profiler_interval=env_float("PROFILER_INTERVAL_MS", 10) / 1000,
+            profiler_mode=env_choice("PROFILER_MODE", "cpu", ("cpu", "wall")),
+            profiler_max_stacks=env_int("PROFILER_MAX_STACKS", 5000),
+            profiler_max_depth=env_int("PROFILER_MAX_DEPTH", 64),
+            profiler_dir=env_str("PROFILER_DIR", "/tmp/profiles"),
+            profiler_export_interval=env_float("PROFILER_EXPORT_INTERVAL_MS", 60000)
+            / 1000,
+            profiler_top=env_int("PROFILER_TOP", 20),
+            admin_token=os.environ.get("ADMIN_TOKEN", "").strip(),
+            lambda_handler=env_choice("LAMBDA_HANDLER", "mangum", ("mangum", "native")),
+            platform=env_str("PLATFORM", "local"),
+            emf_namespace=os.environ.get("EMF_NAMESPACE", "").strip(),
+            statsd_host=os.environ.get("STATSD_HOST", "").strip(),
+            statsd_port=env_int("STATSD_PORT", 8125),
+            statsd_prefix=env_str("STATSD_PREFIX", "api"),
+            statsd_flush_interval=env_float("STATSD_FLUSH_INTERVAL_MS", 1000) / 1000,
+            statsd_reservoir=env_int("STATSD_RESERVOIR", 100),
+            web_bind=env_str("WEB_BIND", "0.0.0.0:80"),
+            web_workers=env_int("WEB_WORKERS", 0),
+            web_workers_per_cpu=env_float("WEB_WORKERS_PER_CPU", 2),
+            web_loop=env_choice("WEB_LOOP", "auto", ("auto", "asyncio", "uvloop")),
+            web_http=env_choice("WEB_HTTP", "auto", ("auto", "h11", "httptools")),
+            # Longer than the 60 s ALB idle timeout, so the ALB closes first.
+            web_keepalive=env_int("WEB_KEEPALIVE", 75),
+            web_backlog=env_int("WEB_BACKLOG", 2048),
+            web_graceful_timeout=env_int("WEB_GRACEFUL_TIMEOUT", 25),
+            web_preload_models=env_bool("WEB_PRELOAD_MODELS", True),
+            web_gc_freeze=env_bool("WEB_GC_FREEZE", True),
+        )
+
+
+settings = Settings.from_env()
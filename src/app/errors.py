@@ -0,0 +1,27 @@
+class WriteError(Exception):
+    """One or more of the storage writes for a record failed."""
+
+    def __init__(self, guid: str, failures: dict) -> None:
+        self.guid = guid
+        self.failures = failures
+        super().__init__(
+            f"write failed for {guid}: " + ", ".join(sorted(self.describe()))
+        )
+
+    def describe(self) -> dict:
+        return {
+            target: f"{type(exc).__name__}: {exc}"
+            for target, exc in self.failures.items()
+        }
+
+
+class Overloaded(Exception):
+    """The service cannot take more work right now; the client should retry."""
+
+    def __init__(self, message: str, retry_after: int = 1) -> None:
+        self.retry_after = retry_after
+        super().__init__(message)
+
+
+class DeadlineExceeded(Exception):
+    """The request's time budget ran out before its writes finished."""
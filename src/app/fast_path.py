@@ -0,0 +1,83 @@
+from fastapi.responses import JSONResponse
+
+from . import readiness
+from .errors import DeadlineExceeded, Overloaded, WriteError
+
+try:
+    import orjson  # noqa: F401
+    from fastapi.responses import ORJSONResponse as FastJSONResponse
+except ImportError:  # pragma: no cover - orjson is in requirements.txt
+    import json
+
+    class FastJSONResponse(JSONResponse):
+        def render(self, content) -> bytes:
+            return json.dumps(content, separators=(",", ":")).encode("utf-8")
+
+
+def error_response(exc: Exception) -> JSONResponse:
+    """The response for a storage error raised by a handler."""
+    if isinstance(exc, WriteError):
+        return JSONResponse(
+            status_code=502, content={"id": exc.guid, "failed": exc.describe()}
+        )
+    if isinstance(exc, Overloaded):
+        return JSONResponse(
+            status_code=503,
+            content={"detail": str(exc)},
+            headers={"Retry-After": str(exc.retry_after)},
+        )
+    if isinstance(exc, DeadlineExceeded):
+        return JSONResponse(status_code=504, content={"detail": str(exc)})
+    raise TypeError(f"no error response for {type(exc).__name__}")
+
+
+HEALTH_BODY = b'{"status":"healthy"}'
+READY_BODY = b'{"status":"ready"}'
+WARMING_BODY = b'{"status":"warming"}'
+
+
+def _headers(body: bytes) -> list:
+    return [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode("latin-1")),
+    ]
+
+
+HEALTH_HEADERS = _headers(HEALTH_BODY)
+_STARTS = {
+    body: {"type": "http.response.start", "status": status, "headers": _headers(body)}
+    for status, body in ((200, HEALTH_BODY), (200, READY_BODY), (503, WARMING_BODY))
+}
+
+
+def probe_body(path: str) -> bytes:
+    """The body answering a liveness or readiness probe; see readiness.py."""
+    if path == "/health":
+        return HEALTH_BODY
+    return READY_BODY if readiness.is_ready() else WARMING_BODY
+
+
+def probe_status(body: bytes) -> int:
+    return _STARTS[body]["status"]
+
+
+class HealthFastPath:
+    """Answers load balancer health probes before FastAPI routing runs."""
+
+    def __init__(self, app, paths: tuple = ("/health", "/ready")) -> None:
+        self.app = app
+        self.paths = paths
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] == "http"
+            and scope["path"] in self.paths
+            and scope["method"] in ("GET", "HEAD")
+        ):
+            body = probe_body(scope["path"])
+            await send(_STARTS[body])
+            if scope["method"] == "HEAD":
+                body = b""
+            await send({"type": "http.response.body", "body": body})
+            return
+        await self.app(scope, receive, send)
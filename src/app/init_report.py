@@ -0,0 +1,181 @@
+"""Cold-start breakdown: import time per package and client construction time.
+
+With INIT_REPORT=1 the app prints one JSON line at the end of module import
+and another after the first Lambda invocation. For a per-module import
+breakdown of a deployed function, set PYTHONPROFILEIMPORTTIME=1 on it and feed
+the captured log to `--from-log`.
+
+    python -m app.init_report                  # compare startup modes locally
+    python -m app.init_report --from-log init.log
+
+Every local measurement runs in a fresh interpreter, as a cold start would.
+"""
+
+import json
+import os
+import time
+
+from . import clients
+
+# The app imports this module first thing, so anything only the command line
+# needs is imported inside the functions below.
+IMPORT_TIME_LINE = r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)"
+
+BASELINE = """
+import boto3
+from fastapi import FastAPI
+from mangum import Mangum
+app = FastAPI()
+s3 = boto3.resource("s3")
+dynamo_db = boto3.resource("dynamodb")
+handler = Mangum(app, lifespan="off")
+"""
+
+# The first request's own client work: the baseline built its resources at
+# import, while the app builds its clients on first use unless STARTUP_MODE is
+# eager.
+APP_FIRST_REQUEST = "from app import clients; clients.s3(); clients.dynamodb()"
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+{code}
+imported = time.perf_counter()
+{first_request}
+constructed = time.perf_counter()
+print(json.dumps({{
+    "init_ms": (imported - started) * 1000,
+    "first_request_clients_ms": (constructed - imported) * 1000,
+}}))
+"""
+
+MODES = {
+    "baseline": ({}, BASELINE, "pass"),
+    "eager": ({"STARTUP_MODE": "eager"}, "import app.main", APP_FIRST_REQUEST),
+    "lazy": ({"STARTUP_MODE": "lazy"}, "import app.main", APP_FIRST_REQUEST),
+}
+
+_import_started = None
+
+
+def mark_import_started(started: float) -> None:
+    global _import_started
+    _import_started = started
+
+
+def summary(stage: str) -> dict:
+    return {
+        "stage": stage,
+        "startup_mode": os.environ.get("STARTUP_MODE", "lazy"),
+        "import_ms": (
+            round((time.perf_counter() - _import_started) * 1000, 2)
+            if stage == "init" and _import_started is not None
+            else None
+        ),
+        "clients_ms": {
+            service: round(seconds * 1000, 2)
+            for service, seconds in clients.construction_times.items()
+        },
+    }
+
+
+def log_summary(stage: str) -> None:
+    print(json.dumps({"init_report": summary(stage)}), flush=True)
+
+
+def parse_import_times(lines) -> dict:
+    """Self import time in ms per top-level package from -X importtime output."""
+    import re
+    from collections import defaultdict
+
+    pattern = re.compile(IMPORT_TIME_LINE)
+    totals = defaultdict(float)
+    for line in lines:
+        match = pattern.search(line)
+        if match:
+            totals[match.group(4).split(".")[0]] += int(match.group(1)) / 1000
+    return dict(totals)
+
+
+def measure(mode: str, runs: int) -> dict:
+    import statistics
+    import subprocess
+    import sys
+    from collections import defaultdict
+
+    env_overrides, code, first_request = MODES[mode]
+    probe = PROBE.format(code=code, first_request=first_request)
+    env = dict(os.environ, **env_overrides)
+    env.setdefault("AWS_DEFAULT_REGION", "ap-southeast-2")
+    env.setdefault("S3_BUCKET_NAME", "init-report")
+    env.setdefault("DYNAMODB_TABLE", "init-report")
+    src_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [src_dir, env.get("PYTHONPATH")]))
+    samples = []
+    packages = defaultdict(list)
+    for _ in range(runs):
+        completed = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", probe],
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        samples.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+        for package, ms in parse_import_times(completed.stderr.splitlines()).items():
+            packages[package].append(ms)
+    return {
+        "init_ms": statistics.median(s["init_ms"] for s in samples),
+        "first_request_clients_ms": statistics.median(
+            s["first_request_clients_ms"] for s in samples
+        ),
+        "import_ms_by_package": {
+            package: statistics.median(values)
+            for package, values in sorted(
+                packages.items(), key=lambda kv: -statistics.median(kv[1])
+            )
+        },
+    }
+
+
+def print_report(results: dict, top: int) -> None:
+    print(f"{'mode':<10}{'init ms':>10}{'1st req ms':>12}{'total ms':>10}")
+    for mode, result in results.items():
+        total = result["init_ms"] + result["first_request_clients_ms"]
+        print(
+            f"{mode:<10}{result['init_ms']:>10.1f}"
+            f"{result['first_request_clients_ms']:>12.1f}{total:>10.1f}"
+        )
+    for mode, result in results.items():
+        print(f"\nslowest imports ({mode}), ms self time:")
+        for package, ms in list(result["import_ms_by_package"].items())[:top]:
+            print(f"  {package:<30}{ms:>8.1f}")
+
+
+def main() -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=MODES)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--from-log", help="parse captured -X importtime output")
+    args = parser.parse_args()
+
+    if args.from_log:
+        with open(args.from_log) as log:
+            packages = parse_import_times(log)
+        for package, ms in sorted(packages.items(), key=lambda kv: -kv[1])[: args.top]:
+            print(f"{package:<30}{ms:>8.1f}")
+        return
+
+    results = {mode: measure(mode, args.runs) for mode in args.modes}
+    print_report(results, args.top)
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,479 @@
+"""A local write-ahead journal that requests are acknowledged from.
+
+With WRITE_ACK=journal, `GET /` answers once its record is appended to this
+worker's journal and fsynced, and a background uploader stores it in S3 and
+DynamoDB afterwards. Requests arriving while a commit is being fsynced are
+written together by the next one (group commit), so one fsync covers all of
+them.
+
+The journal is a directory of numbered segment files of records:
+
+    length (4 bytes) | crc32 (4) | appended at (8) | id length (2) | id | payload
+
+A segment that reaches JOURNAL_SEGMENT_BYTES is closed and a new one
+started. The uploader reads committed records in order, in batches of
+JOURNAL_UPLOAD_BATCH, retries failed records until they are stored, then
+records how far it got in `checkpoint` and deletes the segments before it.
+When a journal is opened, every record after the checkpoint is uploaded
+again: a record may be stored twice, which rewrites the same object and
+item, but a record that was acknowledged is not lost while the disk
+survives. A record cut short by a crash was never acknowledged and is
+truncated.
+
+Appends are refused with a 503 while records not yet uploaded take more than
+JOURNAL_MAX_BYTES, so a long S3 or DynamoDB outage sheds load instead of
+filling the disk.
+
+Each gunicorn worker locks its own numbered subdirectory of JOURNAL_DIR, so a
+restarted worker takes over the journal of the one it replaces. Every minute
+a worker also uploads any journal whose lock nobody holds, such as one left
+by a worker that exited while its replacement was already running.
+"""
+
+import collections
+import fcntl
+import itertools
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, List, Optional
+
+from .errors import Overloaded
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct("<II")  # length and crc32 of what follows
+BODY = struct.Struct("<dH")  # appended at, id length
+CHECKPOINT = "checkpoint"
+MAX_BACKOFF = 30.0
+ORPHAN_INTERVAL = 60.0
+
+Entry = collections.namedtuple("Entry", ("guid", "payload", "appended", "size"))
+
+
+def _segment_name(index: int) -> str:
+    return f"{index:010d}.log"
+
+
+def _encode(guid: str, payload: bytes, appended: float) -> bytes:
+    encoded_id = guid.encode("utf-8")
+    body = BODY.pack(appended, len(encoded_id)) + encoded_id + payload
+    return HEADER.pack(len(body), zlib.crc32(body)) + body
+
+
+def _read_entries(path: str, offset: int, end: Optional[int], limit: int):
+    """Up to `limit` whole, intact records from `offset`, and where they end."""
+    entries = []
+    with open(path, "rb") as source:
+        source.seek(offset)
+        while len(entries) < limit:
+            if end is not None and offset + HEADER.size > end:
+                break
+            header = source.read(HEADER.size)
+            if len(header) < HEADER.size:
+                break
+            length, crc = HEADER.unpack(header)
+            body = source.read(length)
+            if len(body) < length or zlib.crc32(body) != crc:
+                break
+            appended, id_length = BODY.unpack_from(body)
+            guid = body[BODY.size : BODY.size + id_length].decode("utf-8")
+            size = HEADER.size + length
+            entries.append(Entry(guid, body[BODY.size + id_length :], appended, size))
+            offset += size
+    return entries, offset
+
+
+def _fsync_directory(path: str) -> None:
+    descriptor = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+def _try_lock(directory: str):
+    """An exclusive lock on `directory`, or None if another process holds it."""
+    lock = open(os.path.join(directory, "lock"), "a")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.close()
+        return None
+    return lock
+
+
+def claim(root: str):
+    """The first numbered subdirectory of `root` no other process holds."""
+    for slot in itertools.count():
+        directory = os.path.join(root, str(slot))
+        os.makedirs(directory, exist_ok=True)
+        lock = _try_lock(directory)
+        if lock is not None:
+            return directory, lock
+
+
+def drain_orphans(root: str, open_journal: Callable, timeout: float) -> None:
+    """Uploads the journals under `root` that no process holds."""
+    for name in sorted(os.listdir(root)):
+        directory = os.path.join(root, name)
+        if not any(entry.endswith(".log") for entry in os.listdir(directory)):
+            continue
+        lock = _try_lock(directory)
+        if lock is None:
+            continue
+        logger.warning("Uploading the orphaned journal %s", directory)
+        open_journal(directory, lock).close(timeout)
+
+
+def follow_orphans(root: str, open_journal: Callable, timeout: float) -> None:
+    while True:
+        time.sleep(ORPHAN_INTERVAL)
+        try:
+            drain_orphans(root, open_journal, timeout)
+        except Exception:
+            logger.exception("Could not upload orphaned journals")
+
+
+class Journal:
+    """Appends records durably and uploads them in the background.
+
+    `directory` must be locked by the caller, who hands the lock over in
+    `lock`. `upload` stores a batch of entries and returns those it could
+    not store. `append` returns a future that resolves once the record is on
+    disk.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        lock,
+        upload: Callable[[List[Entry]], List[Entry]],
+        max_bytes: int = 64 * 1024 * 1024,
+        segment_bytes: int = 16 * 1024 * 1024,
+        commit_wait: float = 0.0,
+        upload_batch: int = 100,
+        upload_workers: int = 4,
+    ) -> None:
+        self.directory = directory
+        self.upload = upload
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.commit_wait = commit_wait
+        self.upload_batch = upload_batch
+        self.upload_workers = upload_workers
+        self.counters = collections.Counter()
+        self._lock_file = lock
+        self._lock = threading.Lock()
+        self._appended = threading.Condition(self._lock)
+        self._committed = threading.Condition(self._lock)
+        self._buffer = []
+        self._waiters = []
+        self._closed = False
+        self._failure = None
+        self._stopping = threading.Event()
+        self._recover()
+        self._tail = self._open_tail()
+        self._threads = [
+            threading.Thread(target=self._commit, name="journal-commit", daemon=True),
+            threading.Thread(target=self._upload, name="journal-upload", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _path(self, index: int) -> str:
+        return os.path.join(self.directory, _segment_name(index))
+
+    def _segments(self) -> List[int]:
+        return sorted(
+            int(name[:-4])
+            for name in os.listdir(self.directory)
+            if name.endswith(".log")
+        )
+
+    def _open_tail(self) -> int:
+        return os.open(
+            self._path(self._tail_index), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644
+        )
+
+    def _recover(self) -> None:
+        """Counts the records after the checkpoint; they are uploaded again."""
+        segments = self._segments()
+        try:
+            with open(os.path.join(self.directory, CHECKPOINT)) as source:
+                checkpoint = json.load(source)
+            position = (checkpoint["segment"], checkpoint["offset"])
+        except FileNotFoundError:
+            position = (segments[0] if segments else 0, 0)
+        if not any(index >= position[0] for index in segments):
+            position = (position[0], 0)
+        self._checkpoint = position
+        self._pending_records = 0
+        self._pending_bytes = 0
+        self._oldest = None
+        self._tail_index, self._tail_offset = position
+        for index in segments:
+            if index < position[0]:
+                os.remove(self._path(index))
+                continue
+            offset = position[1] if index == position[0] else 0
+            while True:
+                entries, offset = _read_entries(self._path(index), offset, None, 10000)
+                if not entries:
+                    break
+                if self._oldest is None:
+                    self._oldest = entries[0].appended
+                self._pending_records += len(entries)
+                self._pending_bytes += sum(entry.size for entry in entries)
+            size = os.path.getsize(self._path(index))
+            if size > offset:
+                logger.warning(
+                    "Truncating %d bytes of incomplete records from %s",
+                    size - offset,
+                    self._path(index),
+                )
+                os.truncate(self._path(index), offset)
+            self._tail_index, self._tail_offset = index, offset
+        self._durable = (self._tail_index, self._tail_offset)
+        self.counters["replayed"] = self._pending_records
+        if self._pending_records:
+            logger.warning(
+                "Replaying %d journal records from %s",
+                self._pending_records,
+                self.directory,
+            )
+
+    def append(self, guid: str, payload: bytes) -> Future:
+        record = _encode(guid, payload, time.time())
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("journal is closed")
+            if self._failure is not None:
+                raise self._failure
+            if self._pending_bytes + len(record) > self.max_bytes:
+                self.counters["rejected"] += 1
+                raise Overloaded("journal is full")
+            self._pending_bytes += len(record)
+            self._pending_records += 1
+            self._buffer.append(record)
+            self._waiters.append(future)
+            self._appended.notify()
+        return future
+
+    def _commit(self) -> None:
+        while True:
+            with self._lock:
+                while not self._buffer and not self._closed:
+                    self._appended.wait()
+                if not self._buffer:
+                    return
+            if self.commit_wait:
+                # Let more requests join this commit.
+                time.sleep(self.commit_wait)
+            with self._lock:
+                buffer, self._buffer = self._buffer, []
+                waiters, self._waiters = self._waiters, []
+            data = b"".join(buffer)
+            try:
+                self._write(data)
+            except OSError as exc:
+                logger.exception("Journal commit failed")
+                with self._lock:
+                    self._pending_bytes -= len(data)
+                    self._pending_records -= len(buffer)
+                for future in waiters:
+                    future.set_exception(exc)
+                continue
+            if self._tail_offset >= self.segment_bytes:
+                self._rotate()
+            with self._lock:
+                self.counters["commits"] += 1
+                self.counters["appended"] += len(buffer)
+                if self._oldest is None:
+                    self._oldest = time.time()
+                self._durable = (self._tail_index, self._tail_offset)
+                self._committed.notify_all()
+            for future in waiters:
+                future.set_result(None)
+
+    def _write(self, data: bytes) -> None:
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(self._tail, view) :]
+            os.fdatasync(self._tail)
+        except OSError as exc:
+            try:
+                os.ftruncate(self._tail, self._tail_offset)
+            except OSError:
+                # Partly written records would follow: stop appending.
+                self._failure = exc
+            raise
+        self._tail_offset += len(data)
+
+    def _rotate(self) -> None:
+        try:
+            os.close(self._tail)
+            self._tail_index, self._tail_offset = self._tail_index + 1, 0
+            self._tail = self._open_tail()
+            _fsync_directory(self.directory)
+        except OSError as exc:
+            logger.exception("Could not start a new journal segment")
+            self._failure = exc
+
+    def _next_batch(self, position, timeout: float):
+        """Committed records from `position`, waiting up to `timeout` for some."""
+        index, offset = position
+        with self._lock:
+            if self._durable <= position and timeout:
+                self._committed.wait(timeout)
+            durable = self._durable
+        while (index, offset) < durable:
+            end = durable[1] if index == durable[0] else None
+            entries, offset = _read_entries(
+                self._path(index), offset, end, self.upload_batch
+            )
+            if entries:
+                return entries, (index, offset)
+            if index == durable[0]:
+                break
+            index, offset = index + 1, 0
+        return [], (index, offset)
+
+    def _upload(self) -> None:
+        """Uploads up to `upload_workers` batches at once, checkpointing each
+        once it and every batch before it are stored."""
+        in_flight = collections.deque()
+        position = self._checkpoint
+        with ThreadPoolExecutor(
+            self.upload_workers, thread_name_prefix="journal-upload"
+        ) as uploads:
+            while True:
+                while in_flight and in_flight[0][0].done():
+                    future, end, entries = in_flight.popleft()
+                    if not future.result():
+                        return
+                    self._save_checkpoint(end, entries)
+                    if in_flight and in_flight[0][2]:
+                        with self._lock:
+                            self._oldest = in_flight[0][2][0].appended
+                if len(in_flight) >= self.upload_workers:
+                    wait([future for future, _, _ in in_flight], 1.0, FIRST_COMPLETED)
+                    continue
+                entries, end = self._next_batch(position, 0 if in_flight else 1.0)
+                if end != position:
+                    future = Future()
+                    if entries:
+                        if not in_flight:
+                            with self._lock:
+                                self._oldest = entries[0].appended
+                        future = uploads.submit(self._store, entries)
+                    else:
+                        future.set_result(True)
+                    in_flight.append((future, end, entries))
+                    position = end
+                elif in_flight:
+                    wait([in_flight[0][0]], 0.01)
+                elif self._stopping.is_set():
+                    return
+
+    def _store(self, entries: List[Entry]) -> bool:
+        """Stores every entry, retrying failures; False if stopped first."""
+        attempt = 0
+        while entries:
+            try:
+                failed = self.upload(entries)
+            except Exception:
+                logger.exception("Journal upload failed")
+                failed = entries
+            with self._lock:
+                self.counters["uploaded"] += len(entries) - len(failed)
+                self.counters["upload_failures"] += len(failed)
+            if failed:
+                attempt += 1
+                delay = min(MAX_BACKOFF, 0.1 * 2 ** (attempt - 1))
+                logger.warning(
+                    "%d journal records not stored; retrying in %.1f s",
+                    len(failed),
+                    delay,
+                )
+                if self._stopping.wait(delay):
+                    return False
+            entries = failed
+        return True
+
+    def _save_checkpoint(self, position, entries: List[Entry]) -> None:
+        path = os.path.join(self.directory, CHECKPOINT)
+        with open(f"{path}.tmp", "w") as output:
+            json.dump({"segment": position[0], "offset": position[1]}, output)
+            output.flush()
+            os.fsync(output.fileno())
+        os.replace(f"{path}.tmp", path)
+        _fsync_directory(self.directory)
+        for index in range(self._checkpoint[0], position[0]):
+            try:
+                os.remove(self._path(index))
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self._checkpoint = position
+            self._pending_records -= len(entries)
+            self._pending_bytes -= sum(entry.size for entry in entries)
+            if not self._pending_records:
+                self._oldest = None
+            elif entries:
+                # At most this old: what follows was appended after it.
+                self._oldest = entries[-1].appended
+
+    def close(self, timeout: float = 10.0) -> None:
+        """Commits what was appended and uploads what it can within `timeout`.
+
+        Records left over are uploaded when the journal is next opened.
+        """
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            self._closed = True
+            self._appended.notify()
+        self._threads[0].join()
+        os.close(self._tail)
+        while self._pending_records and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self._stopping.set()
+        self._threads[1].join(max(0.0, deadline - time.monotonic()) + 1.0)
+        if not self._pending_records and not self._threads[1].is_alive():
+            # Everything is stored: leave an empty journal behind.
+            for index in self._segments():
+                os.remove(self._path(index))
+            try:
+                os.remove(os.path.join(self.directory, CHECKPOINT))
+            except FileNotFoundError:
+                pass
+        self._lock_file.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            oldest = self._oldest
+            stats = {
+                "directory": self.directory,
+                "depth_records": self._pending_records,
+                "depth_bytes": self._pending_bytes,
+                "max_bytes": self.max_bytes,
+                "oldest_unflushed_s": (
+                    round(max(0.0, time.time() - oldest), 3)
+                    if oldest is not None
+                    else 0.0
+                ),
+                "segments": self._tail_index - self._checkpoint[0] + 1,
+            }
+        stats.update(self.counters)
+        commits = stats.get("commits")
+        stats["records_per_commit"] = (
+            round(stats.get("appended", 0) / commits, 2) if commits else None
+        )
+        return stats
@@ -0,0 +1,134 @@
+"""Serves API Gateway HTTP API (payload v2) events without the ASGI stack.
+
+Mangum turns every event into an ASGI scope, runs it through FastAPI and
+turns the response back into a Lambda result. With LAMBDA_HANDLER=native,
+`GET /` and `GET`/`HEAD /health` are dispatched straight from the event and
+rendered with the same response classes as the routes in main.py, in the
+shape Mangum returns them; every other event is passed to the fallback.
+"""
+
+import base64
+import logging
+import os
+import uuid
+
+from fastapi.responses import PlainTextResponse
+
+from . import reads, telemetry, writers
+from .config import settings
+from .errors import DeadlineExceeded, Overloaded, WriteError
+from .fast_path import HEALTH_BODY, HEALTH_HEADERS, FastJSONResponse, error_response
+
+logger = logging.getLogger(__name__)
+
+# Content types Mangum returns as text; anything else is base64 encoded.
+TEXT_MIME_TYPES = (
+    "text/",
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "application/vnd.api+json",
+    "application/vnd.oai.openapi",
+)
+
+
+def lambda_response(status: int, raw_headers, body: bytes) -> dict:
+    """A payload v2 result laid out exactly as Mangum's HTTPGateway builds it."""
+    headers = {}
+    cookies = []
+    for key, value in raw_headers:
+        key = key.decode().lower()
+        value = value.decode()
+        if key == "set-cookie":
+            cookies.append(value)
+        else:
+            headers[key] = f"{headers[key]},{value}" if key in headers else value
+    response = {"statusCode": status, "body": "", "isBase64Encoded": False}
+    if body:
+        content_type = headers.get("content-type", "")
+        if any(mime_type in content_type for mime_type in TEXT_MIME_TYPES):
+            try:
+                response["body"] = body.decode("utf-8")
+            except UnicodeDecodeError:
+                response["body"] = base64.b64encode(body).decode("ascii")
+                response["isBase64Encoded"] = True
+        else:
+            response["body"] = base64.b64encode(body).decode("ascii")
+            response["isBase64Encoded"] = True
+    if headers:
+        response["headers"] = headers
+    if cookies:
+        response["cookies"] = cookies
+    return response
+
+
+def _rendered(response) -> tuple:
+    return response.status_code, response.raw_headers, response.body
+
+
+@telemetry.instrumented
+def process_request():
+    guid = str(uuid.uuid4())
+    bucket_name = os.environ["S3_BUCKET_NAME"]
+    ddb_table = os.environ["DYNAMODB_TABLE"]
+    if settings.io_mode == "async":
+        import asyncio
+
+        from . import aio
+
+        # The same loop Mangum runs the app on, so the aiobotocore clients
+        # cached for it are reused across invocations.
+        item = asyncio.get_event_loop().run_until_complete(
+            aio.write_record(
+                bucket_name,
+                ddb_table,
+                guid,
+                batch_writer=writers.get_batch_writer(),
+                segment_writer=writers.get_segment_writer(),
+            )
+        )
+    else:
+        item = writers.write_record(bucket_name, ddb_table, guid)
+    reads.cache_written(guid, item, guid.encode("utf-8"))
+    return _rendered(FastJSONResponse({"id": guid}))
+
+
+def health(method: str):
+    return 200, HEALTH_HEADERS, HEALTH_BODY if method == "GET" else b""
+
+
+def route(event: dict):
+    """The native handler for an event, or None if it needs the ASGI app."""
+    if event.get("version") != "2.0":
+        return None
+    http = event["requestContext"]["http"]
+    method = http["method"]
+    path = http["path"] or "/"
+    if path == "/" and method == "GET":
+        return process_request
+    if path == "/health" and (
+        method == "GET" or (method == "HEAD" and settings.health_fast_path)
+    ):
+        return lambda: health(method)
+    return None
+
+
+def handle(event: dict, context, fallback) -> dict:
+    handler = route(event)
+    if handler is None:
+        return fallback(event, context)
+    header = (event.get("headers") or {}).get("x-execution-id")
+    with telemetry.request_timer(telemetry.execution_id(header)) as timings:
+        try:
+            status, raw_headers, body = handler()
+        except (WriteError, Overloaded, DeadlineExceeded) as exc:
+            status, raw_headers, body = _rendered(error_response(exc))
+        except Exception:
+            # What Starlette's ServerErrorMiddleware sends to Mangum.
+            logger.exception("An error occurred running the application.")
+            status, raw_headers, body = _rendered(
+                PlainTextResponse("Internal Server Error", status_code=500)
+            )
+        if timings is not None:
+            timings.status = status
+    return lambda_response(status, raw_headers, body)
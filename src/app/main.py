@@ -1,28 +1,150 @@
-import boto3
+import time
+
+# Taken before any other import, so import_ms covers the whole app.
+_import_started = time.perf_counter()
+
+from . import init_report
+
+init_report.mark_import_started(_import_started)
+
+import hmac
 import uuid
 import os
-from fastapi import FastAPI
-from mangum import Mangum
+from typing import Optional
+from fastapi import Depends, FastAPI, HTTPException, Request, Response
+
+from . import bulk, clients, readiness, reads, resilience, telemetry, writers
+from .config import settings
+from .errors import DeadlineExceeded, Overloaded, WriteError
+from .fast_path import (
+    FastJSONResponse,
+    HealthFastPath,
+    error_response,
+    probe_body,
+    probe_status,
+)
+
+# Optional features are only imported when they are switched on.
+admission = None
+if settings.admission_control:
+    from . import admission
+profiler = None
+if settings.profiler or settings.admin_token:
+    from . import profiler
 
 app = FastAPI()
-s3 = boto3.resource("s3")
-dynamo_db = boto3.resource("dynamodb")
+if admission is not None and admission.limiter is not None:
+    # Inside the timing middleware, so queueing and shed requests are timed.
+    app.add_middleware(admission.AdmissionMiddleware)
+if telemetry.aggregator is not None:
+    app.add_middleware(telemetry.TimingMiddleware)
+if settings.health_fast_path:
+    # Added last so it is the outermost middleware and probes skip the rest.
+    app.add_middleware(HealthFastPath)
+
+
+@app.on_event("startup")
+def size_thread_pool():
+    # Sync handlers run on anyio's default limiter; the AWS connection pools
+    # are sized from the same setting.
+    import anyio.to_thread
+
+    anyio.to_thread.current_default_thread_limiter().total_tokens = (
+        settings.thread_pool_size
+    )
+
+
+@app.on_event("startup")
+def warm_up():
+    readiness.start()
+    if admission is not None:
+        admission.start_publisher()
+    if profiler is not None:
+        profiler.start_worker()
+
+
+@app.on_event("shutdown")
+def flush_writers():
+    writers.close_writers()
+    if profiler is not None:
+        profiler.stop()
+
+
+@app.exception_handler(WriteError)
+@app.exception_handler(Overloaded)
+@app.exception_handler(DeadlineExceeded)
+async def storage_error_handler(request: Request, exc: Exception):
+    return error_response(exc)
+
 
+if settings.lambda_handler == "native":
+    from . import lambda_handler
 
-@app.get("/")
-def process_request():
-    bucket_name = os.environ["S3_BUCKET_NAME"]
-    ddb_table = os.environ["DYNAMODB_TABLE"]
+if settings.io_mode == "async":
+    from . import aio
 
-    guid = str(uuid.uuid4())
-    encoded_string = guid.encode("utf-8")
-    file_name = f"{guid}.txt"
-    s3.Bucket(bucket_name).put_object(Key=file_name, Body=encoded_string)
+    @app.get("/", response_class=FastJSONResponse)
+    @telemetry.instrumented
+    async def process_request():
+        bucket_name = os.environ["S3_BUCKET_NAME"]
+        ddb_table = os.environ["DYNAMODB_TABLE"]
 
-    table = dynamo_db.Table(ddb_table)
-    table.put_item(Item={"id": guid})
+        guid = str(uuid.uuid4())
+        item = await aio.write_record(
+            bucket_name,
+            ddb_table,
+            guid,
+            batch_writer=writers.get_batch_writer(),
+            segment_writer=writers.get_segment_writer(),
+            journal=writers.get_journal(),
+        )
+        reads.cache_written(guid, item, guid.encode("utf-8"))
 
-    return {"id": guid}
+        # Returning a response skips FastAPI's validation and JSON encoding.
+        return FastJSONResponse({"id": guid})
+
+    @app.post("/bulk", response_class=FastJSONResponse)
+    @telemetry.instrumented
+    async def bulk_request(body: bulk.BulkRequest):
+        payloads = _bulk_payloads(body)
+        result = await bulk.write_bulk_async(
+            os.environ["S3_BUCKET_NAME"], os.environ["DYNAMODB_TABLE"], payloads
+        )
+        return FastJSONResponse(result, status_code=bulk.status_code(result))
+
+    @app.on_event("shutdown")
+    async def close_async_clients():
+        await aio.close_clients()
+
+else:
+
+    @app.get("/", response_class=FastJSONResponse)
+    @telemetry.instrumented
+    def process_request():
+        bucket_name = os.environ["S3_BUCKET_NAME"]
+        ddb_table = os.environ["DYNAMODB_TABLE"]
+
+        guid = str(uuid.uuid4())
+        item = writers.write_record(bucket_name, ddb_table, guid)
+        reads.cache_written(guid, item, guid.encode("utf-8"))
+
+        return FastJSONResponse({"id": guid})
+
+    @app.post("/bulk", response_class=FastJSONResponse)
+    @telemetry.instrumented
+    def bulk_request(body: bulk.BulkRequest):
+        payloads = _bulk_payloads(body)
+        result = bulk.write_bulk(
+            os.environ["S3_BUCKET_NAME"], os.environ["DYNAMODB_TABLE"], payloads
+        )
+        return FastJSONResponse(result, status_code=bulk.status_code(result))
+
+
+def _bulk_payloads(body: bulk.BulkRequest):
+    try:
+        return body.payload_list()
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
 
 
 @app.get("/health")
@@ -30,9 +152,172 @@ def health_check():
     return {"status": "healthy"}
 
 
-handler = Mangum(app, lifespan="off")
+@app.get("/ready")
+def readiness_check():
+    body = probe_body("/ready")
+    return Response(body, probe_status(body), media_type="application/json")
+
+
+@app.get("/metrics")
+async def metrics():
+    from . import storage
+
+    # On the event loop, so it still answers while every thread is busy.
+    return {
+        "pools": clients.pool_stats(),
+        "resilience": resilience.stats(),
+        "read_cache": reads.cache_stats(),
+        "readiness": readiness.report(),
+        "admission": admission.stats() if admission is not None else None,
+        "thread_pool": _thread_pool_stats(),
+        "storage": storage.stats(),
+        "journal": writers.journal_stats(),
+    }
+
+
+def _thread_pool_stats() -> dict:
+    import anyio.to_thread
+
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    return {
+        "size": int(limiter.total_tokens),
+        "in_use": limiter.borrowed_tokens,
+        "waiting": limiter.statistics().tasks_waiting,
+    }
+
+
+def require_admin(request: Request) -> None:
+    if not settings.admin_token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    supplied = request.headers.get("authorization", "").encode("utf-8")
+    expected = f"Bearer {settings.admin_token}".encode("utf-8")
+    if not hmac.compare_digest(supplied, expected):
+        raise HTTPException(status_code=401, detail="invalid admin token")
+
+
+@app.get("/admin/profiler", dependencies=[Depends(require_admin)])
+async def profiler_status():
+    return profiler.status()
+
+
+@app.post("/admin/profiler/start", dependencies=[Depends(require_admin)])
+async def profiler_start(
+    interval_ms: Optional[float] = None, mode: Optional[str] = None
+):
+    if interval_ms is not None and interval_ms <= 0:
+        raise HTTPException(status_code=422, detail="interval_ms must be positive")
+    if mode not in (None, "cpu", "wall"):
+        raise HTTPException(status_code=422, detail="mode must be cpu or wall")
+    profiler.control(True, interval_ms / 1000 if interval_ms else None, mode)
+    return profiler.status()
+
+
+@app.post("/admin/profiler/stop", dependencies=[Depends(require_admin)])
+async def profiler_stop():
+    profiler.control(False, None, None)
+    return profiler.status()
+
+
+@app.get("/admin/profiler/collapsed", dependencies=[Depends(require_admin)])
+def profiler_collapsed():
+    return Response(profiler.host_collapsed(), media_type="text/plain")
+
+
+# Declared after the fixed paths so that /health, /ready and /metrics match
+# first.
+if settings.io_mode == "async":
+
+    @app.get("/{guid}", response_class=FastJSONResponse)
+    @telemetry.instrumented
+    async def read_request(guid: str, body: bool = False):
+        _check_guid(guid)
+        record, hit = await reads.read_record_async(
+            os.environ["S3_BUCKET_NAME"], os.environ["DYNAMODB_TABLE"], guid, body
+        )
+        return _read_response(record, hit)
+
+else:
+
+    @app.get("/{guid}", response_class=FastJSONResponse)
+    @telemetry.instrumented
+    def read_request(guid: str, body: bool = False):
+        _check_guid(guid)
+        record, hit = reads.read_record(
+            os.environ["S3_BUCKET_NAME"], os.environ["DYNAMODB_TABLE"], guid, body
+        )
+        return _read_response(record, hit)
+
+
+def _check_guid(guid: str) -> None:
+    # Only ids this API could have issued reach the backend or the cache.
+    try:
+        uuid.UUID(guid)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="record not found")
+
+
+def _read_response(record, hit: bool):
+    headers = {"X-Cache": "hit" if hit else "miss"}
+    if record is None:
+        return FastJSONResponse(
+            {"detail": "record not found"}, status_code=404, headers=headers
+        )
+    return FastJSONResponse(record, headers=headers)
+
+
+_mangum = None
+_first_invocation = True
+
+
+def handler(event, context):
+    global _first_invocation
+    if settings.lambda_handler == "native":
+        response = lambda_handler.handle(event, context, run_mangum)
+    else:
+        response = run_mangum(event, context)
+    telemetry.flush()
+    if profiler is not None:
+        profiler.invocation_finished()
+    if _first_invocation:
+        _first_invocation = False
+        if settings.init_report:
+            init_report.log_summary("first_invocation")
+    return response
+
+
+def run_mangum(event, context):
+    global _mangum
+    if _mangum is None:
+        _mangum = _build_mangum()
+    return _mangum(event, context)
+
+
+def _build_mangum():
+    from mangum import Mangum
+
+    return Mangum(app, lifespan="off")
+
+
+if settings.startup_mode == "eager":
+    clients.s3()
+    clients.dynamodb()
+
+if "AWS_LAMBDA_FUNCTION_NAME" in os.environ:
+    # Only Lambda needs the ASGI adapter; build it during the INIT phase there.
+    _mangum = _build_mangum()
+    # Lambda runs no ASGI startup events.
+    if profiler is not None:
+        profiler.start_worker()
+
+if settings.init_report:
+    init_report.log_summary("init")
 
 if __name__ == "__main__":
     os.environ["S3_BUCKET_NAME"] = "test_s3"
     os.environ["DYNAMODB_TABLE"] = "test_table"
-    process_request()
+    if settings.io_mode == "async":
+        import asyncio
+
+        asyncio.run(process_request())
+    else:
+        process_request()
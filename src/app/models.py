@@ -0,0 +1,191 @@
+"""botocore service models: preloaded before fork, optionally from a compact cache.
+
+Building a client makes botocore read and parse the service's JSON model,
+endpoint rule set, partitions and retry configuration; S3's model alone is
+several megabytes, mostly documentation. Every gunicorn worker and every
+Lambda sandbox does this for itself.
+
+`preload()` has a botocore session load the models of SERVICES into its
+loader's cache. `app.server` calls it in the gunicorn master, on the session
+the workers inherit, so they build their clients from the master's copy
+instead of parsing their own.
+
+    python -m app.models build --out botocore-models.pickle
+
+writes the same data, without documentation, as one pickle. With
+BOTOCORE_MODEL_CACHE pointing at it, sessions read it instead of the JSON
+files. The cache is ignored, with a warning, if it was built by another
+botocore version. Build it where it is used: in the image, on the instance
+or in the Lambda bundle.
+"""
+
+import argparse
+import logging
+import os
+import pickle
+import threading
+import time
+from typing import Optional
+
+from botocore.loaders import Loader
+
+from . import storage
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+SERVICES = ("s3", "dynamodb", "cloudwatch")
+MODEL_TYPES = ("service-2", "endpoint-rule-set-1")
+DATA = ("endpoints", "partitions", "sdk-default-configuration", "_retry")
+
+
+class CachedLoader(Loader):
+    """A loader that answers from the prebuilt cache, and from disk otherwise."""
+
+    def __init__(self, cache: dict, search_paths: list) -> None:
+        super().__init__(
+            extra_search_paths=search_paths, include_default_search_paths=False
+        )
+        self._models = cache["models"]
+        self._data = cache["data"]
+
+    def load_service_model(self, service_name, type_name, api_version=None):
+        model = None
+        if api_version is None:
+            model = self._models.get((service_name, type_name))
+        if model is None:
+            model = super().load_service_model(service_name, type_name, api_version)
+        return model
+
+    def load_data_with_path(self, name):
+        found = self._data.get(name)
+        if found is None:
+            found = super().load_data_with_path(name)
+        return found
+
+
+_lock = threading.Lock()
+_cache = None
+
+
+def _load_cache() -> Optional[dict]:
+    global _cache
+    if _cache is None:
+        with _lock:
+            if _cache is None:
+                _cache = _read(settings.botocore_model_cache)
+    return _cache or None
+
+
+def _read(path: str) -> dict:
+    import botocore
+
+    started = time.perf_counter()
+    try:
+        with open(path, "rb") as source:
+            cache = pickle.load(source)
+    except (OSError, pickle.UnpicklingError, EOFError) as exc:
+        logger.warning("Ignoring the botocore model cache %s: %s", path, exc)
+        return {}
+    if cache.get("botocore") != botocore.__version__:
+        logger.warning(
+            "Ignoring the botocore model cache %s: built for botocore %s, not %s",
+            path,
+            cache.get("botocore"),
+            botocore.__version__,
+        )
+        return {}
+    logger.info(
+        "Loaded the botocore model cache in %.1f ms",
+        (time.perf_counter() - started) * 1000,
+    )
+    return cache
+
+
+def install(session) -> None:
+    """Has a botocore session read models from BOTOCORE_MODEL_CACHE, if set."""
+    if not settings.botocore_model_cache:
+        return
+    cache = _load_cache()
+    if cache is None:
+        return
+    search_paths = session.get_component("data_loader").search_paths
+    session.register_component("data_loader", CachedLoader(cache, search_paths))
+
+
+def used_services() -> tuple:
+    """The services this configuration builds clients for."""
+    services = () if storage.is_local() else ("s3", "dynamodb")
+    if settings.admission_metrics_service:
+        services += ("cloudwatch",)
+    return services
+
+
+def preload(session) -> None:
+    """Loads everything building a client of each used service reads from disk."""
+    services = used_services()
+    if not services:
+        return
+    loader = session.get_component("data_loader")
+    for name in DATA:
+        loader.load_data_with_path(name)
+    for service in services:
+        for type_name in MODEL_TYPES:
+            loader.load_service_model(service, type_name)
+
+
+def _strip_documentation(value):
+    # Blanked rather than dropped: botocore indexes some of these keys, and a
+    # member may be named "documentation" too.
+    if isinstance(value, dict):
+        return {
+            key: (
+                ""
+                if key in ("documentation", "documentationUrl")
+                and isinstance(item, str)
+                else _strip_documentation(item)
+            )
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [_strip_documentation(item) for item in value]
+    return value
+
+
+def build(path: str, services=SERVICES) -> dict:
+    import botocore
+    import boto3
+
+    # boto3 adds its own search path, with extras for its models.
+    loader = boto3.session.Session()._session.get_component("data_loader")
+    cache = {
+        "botocore": botocore.__version__,
+        "models": {
+            (service, type_name): _strip_documentation(
+                loader.load_service_model(service, type_name)
+            )
+            for service in services
+            for type_name in MODEL_TYPES
+        },
+        "data": {name: loader.load_data_with_path(name) for name in DATA},
+    }
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as output:
+        pickle.dump(cache, output, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary, path)
+    return cache
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("command", choices=("build",))
+    parser.add_argument("--out", default="botocore-models.pickle")
+    parser.add_argument("--services", nargs="+", default=list(SERVICES))
+    args = parser.parse_args()
+
+    build(args.out, args.services)
+    print(f"{args.out}: {os.path.getsize(args.out)} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,374 @@
+"""Sampling profiler for the API workers and the Lambda handler.
+
+With PROFILER=true, or after `POST /admin/profiler/start`, a thread in each
+worker samples every PROFILER_INTERVAL_MS: the Python stack of every other
+thread, folded into one `thread;frame;frame` line per distinct stack and
+counted. In `cpu` mode (PROFILER_MODE) a thread is only sampled when its CPU
+clock moved since the previous sample, so threads that stayed blocked on a
+socket, the thread-pool queue or the event loop's selector drop out and the
+counts show where the CPU goes; `wall` mode samples every thread. A worker keeps at most
+PROFILER_MAX_STACKS distinct stacks and counts samples of any further ones
+under `[other]`, so memory stays bounded over a six-hour run.
+
+Every PROFILER_EXPORT_INTERVAL_MS, and when it stops, each worker writes its
+counts to PROFILER_DIR/<session>-<host>-<pid>.collapsed in the folded format
+read by flamegraph.pl, inferno and speedscope:
+
+    python -m app.profiler merge /tmp/profiles/<session>-*.collapsed > api.collapsed
+    flamegraph.pl api.collapsed > api.svg
+
+A session is one start of the profiler on the host: the server's boot with
+PROFILER=true, or one `POST /admin/profiler/start`. Restarting starts a new
+session, so its counts never overwrite the previous session's file.
+`GET /admin/profiler/collapsed` returns the merge of the current session's
+files for every worker on the host. On Lambda, where nothing outlives the
+sandbox, each invocation ends with one JSON log line of the invocation's
+hottest stacks instead.
+
+The admin routes need `Authorization: Bearer $ADMIN_TOKEN` and are not
+served without one. Starting and stopping writes PROFILER_DIR/control.json,
+which every worker checks once a second, so one request reaches them all.
+"""
+
+import collections
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+from .config import settings
+from .telemetry import ON_LAMBDA
+
+logger = logging.getLogger(__name__)
+
+OTHER = "[other]"
+CONTROL_FILE = "control.json"
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+_SRC_DIR = os.path.dirname(_APP_DIR)
+
+
+def _short_path(filename: str) -> str:
+    for marker in ("site-packages/", "dist-packages/"):
+        index = filename.rfind(marker)
+        if index >= 0:
+            return filename[index + len(marker) :]
+    if filename.startswith(_APP_DIR):
+        return os.path.relpath(filename, _SRC_DIR)
+    return os.path.basename(filename)
+
+
+def _thread_cpu_time(native_id: int) -> Optional[float]:
+    # The clock id glibc's pthread_getcpuclockid builds from a thread id;
+    # unlike a pthread handle, a stale id only makes clock_gettime fail.
+    try:
+        return time.clock_gettime((~native_id << 3) | 6)
+    except OSError:
+        return None
+
+
+class Profiler:
+    def __init__(
+        self, interval: float, mode: str, max_stacks: int, max_depth: int, session: str
+    ) -> None:
+        self.interval = interval
+        self.mode = mode
+        self.max_stacks = max_stacks
+        self.max_depth = max_depth
+        self.session = session
+        self.lock = threading.Lock()
+        self.counts = collections.Counter()
+        self.samples = 0
+        self.ticks = 0
+        self.sampling_time = 0.0
+        self.started = None
+        self.exported = None
+        self._labels = {}
+        self._cpu_times = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        self.started = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        next_sample = time.perf_counter()
+        while not self._stop.is_set():
+            started = time.perf_counter()
+            self.sample()
+            self.sampling_time += time.perf_counter() - started
+            self.ticks += 1
+            if (
+                not ON_LAMBDA
+                and time.monotonic() - (self.exported or self.started)
+                >= settings.profiler_export_interval
+            ):
+                export(self)
+            # A late sample is not made up for: skipped ticks stay skipped.
+            next_sample = max(next_sample + self.interval, time.perf_counter())
+            self._stop.wait(next_sample - time.perf_counter())
+
+    def sample(self) -> None:
+        own = threading.get_ident()
+        threads = {thread.ident: thread for thread in threading.enumerate()}
+        stacks = []
+        cpu_times = {}
+        for ident, frame in sys._current_frames().items():
+            thread = threads.get(ident)
+            if ident == own or thread is None:
+                continue
+            if self.mode == "cpu":
+                cpu_time = _thread_cpu_time(thread.native_id)
+                previous = self._cpu_times.get(ident)
+                cpu_times[ident] = cpu_time
+                if cpu_time is None or previous is None or cpu_time <= previous:
+                    continue
+            stacks.append(self._fold(thread.name, frame))
+        self._cpu_times = cpu_times
+        with self.lock:
+            for stack in stacks:
+                if stack not in self.counts and len(self.counts) >= self.max_stacks:
+                    stack = OTHER
+                self.counts[stack] += 1
+            self.samples += len(stacks)
+
+    def _fold(self, thread_name: str, frame) -> str:
+        labels = []
+        while frame is not None:
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                name = getattr(code, "co_qualname", code.co_name)
+                label = self._labels[code] = f"{_short_path(code.co_filename)}:{name}"
+            labels.append(label)
+            frame = frame.f_back
+        if len(labels) > self.max_depth:
+            labels = labels[: self.max_depth] + ["[truncated]"]
+        # Pool threads are numbered; one root per pool keeps them together.
+        labels.append(thread_name.rstrip("0123456789_-"))
+        return ";".join(reversed(labels))
+
+    def take(self) -> collections.Counter:
+        """The counts so far; the profiler starts counting afresh."""
+        with self.lock:
+            counts, self.counts = self.counts, collections.Counter()
+            self.samples = 0
+        return counts
+
+    def collapsed(self) -> str:
+        with self.lock:
+            return format_collapsed(self.counts)
+
+    def status(self) -> dict:
+        elapsed = time.monotonic() - self.started if self.started else 0.0
+        with self.lock:
+            stacks = len(self.counts)
+            other = self.counts.get(OTHER, 0)
+        return {
+            "running": not self._stop.is_set(),
+            "session": self.session,
+            "mode": self.mode,
+            "interval_ms": self.interval * 1000,
+            "samples": self.samples,
+            "stacks": stacks,
+            "other": other,
+            "ticks": self.ticks,
+            "overhead": round(self.sampling_time / elapsed, 4) if elapsed else 0.0,
+        }
+
+
+def format_collapsed(counts: Dict[str, int]) -> str:
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(counts.items()))
+
+
+def parse_collapsed(lines: Iterable[str]) -> collections.Counter:
+    counts = collections.Counter()
+    for line in lines:
+        stack, _, count = line.rstrip("\n").rpartition(" ")
+        if stack:
+            counts[stack] += int(count)
+    return counts
+
+
+def _export_path(session: str) -> str:
+    name = f"{session}-{socket.gethostname()}-{os.getpid()}.collapsed"
+    return os.path.join(settings.profiler_dir, name)
+
+
+def _write(path: str, text: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "w") as output:
+        output.write(text)
+    os.replace(temporary, path)
+
+
+def export(active: Profiler) -> None:
+    active.exported = time.monotonic()
+    _write(_export_path(active.session), active.collapsed())
+
+
+def host_collapsed() -> str:
+    """The last export of every worker on this host in the current session,
+    with this worker's counts now."""
+    active = profiler
+    if active is not None:
+        export(active)
+    counts = collections.Counter()
+    if _session is None:
+        return ""
+    try:
+        names = os.listdir(settings.profiler_dir)
+    except FileNotFoundError:
+        names = []
+    for name in names:
+        # Workers that have since exited still count towards their session.
+        if name.startswith(f"{_session}-") and name.endswith(".collapsed"):
+            with open(os.path.join(settings.profiler_dir, name)) as source:
+                counts.update(parse_collapsed(source))
+    return format_collapsed(counts)
+
+
+profiler = None
+_session = None
+_lock = threading.Lock()
+
+
+def start(
+    interval: Optional[float] = None,
+    mode: Optional[str] = None,
+    session: Optional[str] = None,
+) -> None:
+    global profiler, _session
+    with _lock:
+        if profiler is not None:
+            profiler.stop()
+            if not ON_LAMBDA:
+                export(profiler)
+        profiler = Profiler(
+            interval or settings.profiler_interval,
+            mode or settings.profiler_mode,
+            settings.profiler_max_stacks,
+            settings.profiler_max_depth,
+            # Started from the environment: the gunicorn master's pid is shared
+            # by this boot's workers and no other.
+            session or f"boot{os.getppid()}",
+        )
+        _session = profiler.session
+        profiler.start()
+
+
+def stop() -> None:
+    global profiler
+    with _lock:
+        if profiler is None:
+            return
+        profiler.stop()
+        if not ON_LAMBDA:
+            export(profiler)
+        profiler = None
+
+
+def status() -> dict:
+    active = profiler
+    return active.status() if active is not None else {"running": False}
+
+
+def invocation_finished() -> None:
+    """Logs the hottest stacks of a Lambda invocation."""
+    active = profiler
+    if active is None:
+        return
+    counts = active.take()
+    leaves = collections.Counter()
+    for stack, count in counts.items():
+        leaves[stack.rsplit(";", 1)[-1]] += count
+    summary = {
+        "samples": sum(counts.values()),
+        "interval_ms": active.interval * 1000,
+        "functions": leaves.most_common(settings.profiler_top),
+        "stacks": format_collapsed(dict(counts.most_common(settings.profiler_top))),
+    }
+    print(json.dumps({"profile": summary}), flush=True)
+
+
+def control(enabled: bool, interval: Optional[float], mode: Optional[str]) -> None:
+    """Starts or stops the profiler in this worker and, through the control
+    file, in every other worker on the host."""
+    session = str(time.time_ns()) if enabled else None
+    if enabled:
+        start(interval, mode, session)
+    else:
+        stop()
+    state = {"enabled": enabled, "interval": interval, "mode": mode, "session": session}
+    _write(os.path.join(settings.profiler_dir, CONTROL_FILE), json.dumps(state))
+
+
+def _follow_control() -> None:
+    path = os.path.join(settings.profiler_dir, CONTROL_FILE)
+    seen = None
+    while True:
+        try:
+            modified = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            modified = None
+        if modified is not None and modified != seen:
+            seen = modified
+            try:
+                with open(path) as source:
+                    state = json.load(source)
+            except (OSError, ValueError):
+                logger.warning("Could not read %s", path, exc_info=True)
+                continue
+            running = profiler is not None
+            if state["enabled"] and (not running or state.get("session") != _session):
+                start(state["interval"], state["mode"], state.get("session"))
+            elif not state["enabled"] and running:
+                stop()
+        time.sleep(1)
+
+
+_worker_pid = None
+
+
+def start_worker() -> None:
+    """Starts this worker's profiler and control-file watcher, once per process."""
+    global _worker_pid
+    if _worker_pid == os.getpid():
+        return
+    _worker_pid = os.getpid()
+    if settings.profiler:
+        start()
+    if settings.admin_token and not ON_LAMBDA:
+        threading.Thread(
+            target=_follow_control, name="profiler-control", daemon=True
+        ).start()
+
+
+def main() -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Merge collapsed-stack files.")
+    parser.add_argument("command", choices=("merge",))
+    parser.add_argument("paths", nargs="+")
+    args = parser.parse_args()
+
+    counts = collections.Counter()
+    for path in args.paths:
+        with open(path) as source:
+            counts.update(parse_collapsed(source))
+    sys.stdout.write(format_collapsed(counts))
+
+
+if __name__ == "__main__":
+    main()
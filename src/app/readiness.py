@@ -0,0 +1,239 @@
+"""Readiness: a worker only takes traffic once its AWS connections are warm.
+
+`/health` is liveness and passes as soon as the process serves HTTP.
+`/ready` answers 503 until the warm-up has run: the S3 and DynamoDB clients
+(and the batch and segment writers and the journal, if enabled) are built, and
+READINESS_CONNECTIONS probe calls per service run concurrently for
+READINESS_PROBES rounds, so DNS is resolved and that many TLS connections
+sit in each pool. The load balancer health checks use `/ready`.
+
+A worker whose probes keep failing becomes ready anyway after
+READINESS_TIMEOUT_MS, so an AWS outage does not take every target out of
+service.
+
+The load balancer's probe reaches whichever worker accepts it, so under
+`app.server` each worker also marks itself ready with a file named after its
+pid in READINESS_DIR/<master pid>, and `/ready` only passes once every
+worker the gunicorn master currently runs has one.
+
+Time to ready is logged as one JSON line, sent over StatsD and shown in
+`/metrics`, both since the app was imported and since boot; on EC2 and
+Fargate the uptime is close to the instance or task age, which is what the
+scaling policy's warmup should cover.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from . import clients, telemetry, writers
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+_ready = threading.Event()
+_started = time.perf_counter()
+_report = {"status": "warming"}
+if telemetry.ON_LAMBDA:
+    # No target group routes to Lambda; STARTUP_MODE=eager warms its INIT.
+    _ready.set()
+    _report["status"] = "ready"
+
+
+_host_dir = None
+
+
+def join_host(master_pid: int) -> None:
+    """Makes this worker's readiness part of the host's; see the docstring."""
+    global _host_dir
+    _host_dir = os.path.join(settings.readiness_dir, str(master_pid))
+    os.makedirs(_host_dir, exist_ok=True)
+    try:
+        # A worker that had this pid before under the same master.
+        os.unlink(os.path.join(_host_dir, str(os.getpid())))
+    except FileNotFoundError:
+        pass
+
+
+def _workers_ready() -> bool:
+    master = os.path.basename(_host_dir)
+    try:
+        with open(f"/proc/{master}/task/{master}/children") as children:
+            workers = children.read().split()
+        ready = set(os.listdir(_host_dir))
+    except OSError:
+        # Without /proc only this worker's own state is known.
+        return True
+    return all(worker in ready for worker in workers)
+
+
+def is_ready() -> bool:
+    return _ready.is_set() and (_host_dir is None or _workers_ready())
+
+
+def report() -> dict:
+    return dict(_report)
+
+
+def _uptime():
+    try:
+        with open("/proc/uptime") as uptime:
+            return float(uptime.read().split()[0])
+    except (OSError, ValueError):
+        return None
+
+
+_uptime_at_start = _uptime()
+
+
+def _probes():
+    """(service, operation, parameters) for each configured resource."""
+    probes = []
+    if os.environ.get("S3_BUCKET_NAME"):
+        probes.append(("s3", "head_bucket", {"Bucket": os.environ["S3_BUCKET_NAME"]}))
+    if os.environ.get("DYNAMODB_TABLE"):
+        probes.append(
+            ("dynamodb", "describe_table", {"TableName": os.environ["DYNAMODB_TABLE"]})
+        )
+    return probes
+
+
+def _mark_ready(steps: dict, errors: list) -> None:
+    uptime = _uptime()
+    _report.update(
+        status="ready",
+        warmed=not errors,
+        steps_ms={name: round(seconds * 1000, 2) for name, seconds in steps.items()},
+        ready_ms=round((time.perf_counter() - _started) * 1000, 2),
+        boot_to_ready_s=round(uptime, 2) if uptime is not None else None,
+        boot_to_start_s=(
+            round(_uptime_at_start, 2) if _uptime_at_start is not None else None
+        ),
+        errors=list(dict.fromkeys(errors))[-3:],
+    )
+    _ready.set()
+    if _host_dir is not None:
+        open(os.path.join(_host_dir, str(os.getpid())), "w").close()
+    print(json.dumps({"readiness": _report}), flush=True)
+    if telemetry.aggregator is not None:
+        telemetry.aggregator.timing("readiness.ready", _report["ready_ms"] / 1000)
+        if uptime is not None:
+            telemetry.aggregator.timing("readiness.boot_to_ready", uptime)
+
+
+class _Rounds:
+    """Probe rounds, until READINESS_PROBES succeed or time runs out."""
+
+    def __init__(self) -> None:
+        self.deadline = time.perf_counter() + settings.readiness_timeout
+        self.succeeded = 0
+        self.errors = []
+
+    def next_delay(self, failures: list) -> Optional[float]:
+        """Seconds to wait before the next round, or None when done."""
+        if not failures:
+            self.succeeded += 1
+            return None if self.succeeded >= settings.readiness_probes else 0.0
+        self.errors.extend(f"{type(exc).__name__}: {exc}" for exc in failures)
+        remaining = self.deadline - time.perf_counter()
+        if remaining <= 0:
+            logger.warning("Ready without a warm pool: %s", self.errors[-1])
+            return None
+        return min(1.0, remaining)
+
+
+def _calls(services: dict) -> list:
+    if not settings.readiness_probes:
+        return []
+    return [
+        (getattr(services[service], operation), parameters)
+        for service, operation, parameters in _probes()
+        for _ in range(settings.readiness_connections)
+    ]
+
+
+def warm_up() -> None:
+    """Warms this worker's boto3 clients and pools, then marks it ready."""
+    steps = {}
+    started = time.perf_counter()
+    services = {"s3": clients.s3(), "dynamodb": clients.dynamodb()}
+    writers.get_batch_writer()
+    writers.get_segment_writer()
+    writers.get_journal()
+    steps["clients"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    rounds = _Rounds()
+    calls = _calls(services)
+    if calls:
+        # One thread per call, so each call holds its own pooled connection.
+        with ThreadPoolExecutor(
+            max_workers=len(calls), thread_name_prefix="warm-up"
+        ) as executor:
+            delay = 0.0
+            while delay is not None:
+                time.sleep(delay)
+                futures = [executor.submit(call, **kwargs) for call, kwargs in calls]
+                failures = [f.exception() for f in futures if f.exception()]
+                delay = rounds.next_delay(failures)
+    steps["probes"] = time.perf_counter() - started
+    _mark_ready(steps, rounds.errors)
+
+
+async def warm_up_async() -> None:
+    """Warms the aiobotocore clients on this worker's event loop."""
+    from . import aio
+
+    steps = {}
+    started = time.perf_counter()
+    s3, dynamo_db = await aio.get_clients()
+    writers.get_batch_writer()
+    writers.get_segment_writer()
+    writers.get_journal()
+    steps["clients"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    rounds = _Rounds()
+    calls = _calls({"s3": s3, "dynamodb": dynamo_db})
+    delay = 0.0 if calls else None
+    while delay is not None:
+        await asyncio.sleep(delay)
+        results = await asyncio.gather(
+            *(call(**kwargs) for call, kwargs in calls), return_exceptions=True
+        )
+        delay = rounds.next_delay([r for r in results if isinstance(r, Exception)])
+    steps["probes"] = time.perf_counter() - started
+    _mark_ready(steps, rounds.errors)
+
+
+def start() -> None:
+    """Starts the warm-up in the background; liveness passes meanwhile."""
+    if _ready.is_set():
+        return
+    if not settings.readiness_warmup:
+        _mark_ready({}, [])
+    elif settings.io_mode == "async":
+        asyncio.get_running_loop().create_task(_guarded(warm_up_async))
+    else:
+        threading.Thread(target=_guarded_sync, name="warm-up", daemon=True).start()
+
+
+async def _guarded(warm) -> None:
+    try:
+        await warm()
+    except Exception as exc:
+        logger.exception("Warm-up failed")
+        _mark_ready({}, [f"{type(exc).__name__}: {exc}"])
+
+
+def _guarded_sync() -> None:
+    try:
+        warm_up()
+    except Exception as exc:
+        logger.exception("Warm-up failed")
+        _mark_ready({}, [f"{type(exc).__name__}: {exc}"])
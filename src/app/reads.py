@@ -0,0 +1,136 @@
+"""Reads records back for GET /{id}, through a per-process cache.
+
+Items come from DynamoDB with a consistent read and bodies from S3, with a
+ranged GET for records stored in a segment. Records written by this process
+are cached as they are written, so reading back an id right after creating
+it costs no AWS call when the read reaches the same worker; ids that do not
+exist are cached too, for READ_CACHE_NEGATIVE_TTL_MS.
+"""
+
+from typing import Optional, Tuple
+
+from . import clients, telemetry, writers
+from .cache import MISSING, LRUCache
+from .config import settings
+
+cache = (
+    LRUCache(
+        settings.read_cache_size,
+        settings.read_cache_ttl,
+        settings.read_cache_negative_ttl,
+    )
+    if settings.read_cache_size > 0
+    else None
+)
+
+
+def cache_written(guid: str, attributes: dict, payload: bytes) -> None:
+    if cache is not None:
+        cache.put(("item", guid), attributes)
+        cache.put(("body", guid), payload)
+
+
+def cache_stats() -> Optional[dict]:
+    return cache.snapshot() if cache is not None else None
+
+
+def _body_request(guid: str, item: dict) -> dict:
+    if "segment" not in item:
+        return {"Key": f"{guid}.txt"}
+    first = item["offset"]
+    last = item["offset"] + item["length"] - 1
+    return {"Key": item["segment"], "Range": f"bytes={first}-{last}"}
+
+
+def _response(guid: str, item, body) -> Optional[dict]:
+    if item is MISSING:
+        return None
+    response = {"id": guid, "item": item}
+    if body is not None:
+        response["body"] = None if body is MISSING else body.decode("utf-8", "replace")
+    return response
+
+
+def _load_item(table_name: str, guid: str):
+    response = clients.dynamodb().get_item(
+        TableName=table_name, Key={"id": {"S": guid}}, ConsistentRead=True
+    )
+    item = response.get("Item")
+    return MISSING if item is None else writers.from_attribute_values(item)
+
+
+def _load_body(bucket_name: str, guid: str, item: dict):
+    client = clients.s3()
+    try:
+        response = client.get_object(Bucket=bucket_name, **_body_request(guid, item))
+    except client.exceptions.NoSuchKey:
+        return MISSING
+    return response["Body"].read()
+
+
+def _cached(key, loader):
+    if cache is None:
+        return loader(), False
+    return cache.get_or_load(key, loader)
+
+
+def read_record(
+    bucket_name: str, table_name: str, guid: str, with_body: bool
+) -> Tuple[Optional[dict], bool]:
+    """The record as returned by GET /{id}, and whether the cache answered."""
+    with telemetry.segment("dynamodb"):
+        item, hit = _cached(("item", guid), lambda: _load_item(table_name, guid))
+    body = None
+    if with_body and item is not MISSING:
+        with telemetry.segment("s3"):
+            body, body_hit = _cached(
+                ("body", guid), lambda: _load_body(bucket_name, guid, item)
+            )
+        hit = hit and body_hit
+    return _response(guid, item, body), hit
+
+
+async def _load_item_async(table_name: str, guid: str):
+    from . import aio
+
+    _, dynamo_db = await aio.get_clients()
+    response = await dynamo_db.get_item(
+        TableName=table_name, Key={"id": {"S": guid}}, ConsistentRead=True
+    )
+    item = response.get("Item")
+    return MISSING if item is None else writers.from_attribute_values(item)
+
+
+async def _load_body_async(bucket_name: str, guid: str, item: dict):
+    from . import aio
+
+    s3, _ = await aio.get_clients()
+    try:
+        response = await s3.get_object(Bucket=bucket_name, **_body_request(guid, item))
+    except s3.exceptions.NoSuchKey:
+        return MISSING
+    async with response["Body"] as stream:
+        return await stream.read()
+
+
+async def _cached_async(key, loader):
+    if cache is None:
+        return await loader(), False
+    return await cache.get_or_load_async(key, loader)
+
+
+async def read_record_async(
+    bucket_name: str, table_name: str, guid: str, with_body: bool
+) -> Tuple[Optional[dict], bool]:
+    with telemetry.segment("dynamodb"):
+        item, hit = await _cached_async(
+            ("item", guid), lambda: _load_item_async(table_name, guid)
+        )
+    body = None
+    if with_body and item is not MISSING:
+        with telemetry.segment("s3"):
+            body, body_hit = await _cached_async(
+                ("body", guid), lambda: _load_body_async(bucket_name, guid, item)
+            )
+        hit = hit and body_hit
+    return _response(guid, item, body), hit
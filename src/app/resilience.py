@@ -0,0 +1,351 @@
+"""Tail-latency controls around the S3 and DynamoDB writes.
+
+Retries are botocore's own (AWS_RETRY_MODE). In adaptive mode a client-side
+token bucket slows sends down as soon as a service throttles, on top of the
+retry quota standard mode already keeps, so a ramp that hits throttling
+backs off instead of multiplying the load with retries. A request's writes
+share one deadline: every attempt and every retry checks the time left and
+gives up with `DeadlineExceeded` once it is spent.
+
+S3 PUTs of `{guid}.txt` are idempotent, so with S3_HEDGE a second identical
+PUT is sent when the first has not finished within the configured
+percentile of recent PUT latencies; whichever finishes first answers the
+request. Hedges are capped at S3_HEDGE_MAX_RATIO of PUTs so that a slow
+S3 cannot double the load on itself.
+"""
+
+import asyncio
+import collections
+import contextvars
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Optional
+
+from .config import settings
+from .errors import DeadlineExceeded
+
+THROTTLED_ERROR_CODES = frozenset(
+    (
+        "Throttling",
+        "ThrottlingException",
+        "ThrottledException",
+        "RequestThrottledException",
+        "TooManyRequestsException",
+        "ProvisionedThroughputExceededException",
+        "RequestLimitExceeded",
+        "RequestThrottled",
+        "SlowDown",
+    )
+)
+
+_deadline = contextvars.ContextVar("deadline", default=None)
+
+
+@contextmanager
+def deadline(budget: float):
+    """Gives the enclosed writes `budget` seconds; 0 means no deadline."""
+    if budget <= 0:
+        yield
+        return
+    token = _deadline.set(time.monotonic() + budget)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    expires = _deadline.get()
+    return None if expires is None else max(0.0, expires - time.monotonic())
+
+
+def deadline_exceeded() -> DeadlineExceeded:
+    return DeadlineExceeded(
+        f"request deadline of {settings.request_deadline * 1000:.0f} ms exceeded"
+    )
+
+
+def check_deadline() -> None:
+    expires = _deadline.get()
+    if expires is not None and time.monotonic() >= expires:
+        raise deadline_exceeded()
+
+
+class ServiceStats:
+    """Attempt counters for one AWS service across all of its clients."""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.attempts = 0
+        self.throttled = 0
+        self.errors = 0
+        self.deadline_exceeded = 0
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "calls": self.calls,
+                "retries": max(0, self.attempts - self.calls),
+                "throttled": self.throttled,
+                "errors": self.errors,
+                "deadline_exceeded": self.deadline_exceeded,
+            }
+
+
+_service_stats = {}
+_service_stats_lock = threading.Lock()
+
+
+def service_stats(service: str) -> ServiceStats:
+    stats = _service_stats.get(service)
+    if stats is None:
+        with _service_stats_lock:
+            stats = _service_stats.setdefault(service, ServiceStats())
+    return stats
+
+
+def _stats_for(event_name: str) -> ServiceStats:
+    return service_stats(event_name.split(".")[1])
+
+
+def _on_needs_retry(event_name, response=None, caught_exception=None, **kwargs):
+    stats = _stats_for(event_name)
+    if isinstance(caught_exception, DeadlineExceeded):
+        # Raised by _on_before_send; the attempt was never sent.
+        with stats.lock:
+            stats.deadline_exceeded += 1
+        raise caught_exception
+    throttled = False
+    if response is not None:
+        code = response[1].get("Error", {}).get("Code")
+        throttled = code in THROTTLED_ERROR_CODES
+    with stats.lock:
+        stats.attempts += 1
+        stats.throttled += throttled
+    # Runs before botocore's own handler decides on (and sleeps for) a retry.
+    try:
+        check_deadline()
+    except DeadlineExceeded:
+        with stats.lock:
+            stats.deadline_exceeded += 1
+        raise
+
+
+def _on_before_send(**kwargs):
+    check_deadline()
+
+
+def _on_after_call(event_name, **kwargs):
+    stats = _stats_for(event_name)
+    with stats.lock:
+        stats.calls += 1
+
+
+def _on_after_call_error(event_name, **kwargs):
+    stats = _stats_for(event_name)
+    with stats.lock:
+        stats.calls += 1
+        stats.errors += 1
+
+
+def register(client) -> None:
+    """Counts attempts and enforces the deadline on a botocore client."""
+    events = client.meta.events
+    events.register_first("needs-retry", _on_needs_retry)
+    events.register_first("before-send", _on_before_send)
+    events.register("after-call", _on_after_call)
+    events.register("after-call-error", _on_after_call_error)
+
+
+class Hedger:
+    """Sends a second copy of an idempotent call once the first is slow."""
+
+    def __init__(
+        self,
+        percentile: float,
+        min_delay: float,
+        max_ratio: float,
+        window: int = 1000,
+        min_samples: int = 50,
+    ) -> None:
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_ratio = max_ratio
+        self.min_samples = min_samples
+        self.lock = threading.Lock()
+        self.latencies = collections.deque(maxlen=window)
+        self.delay = None
+        self.recorded = 0
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self._executor = None
+
+    def record(self, latency: float) -> None:
+        with self.lock:
+            self.latencies.append(latency)
+            self.recorded += 1
+            samples = len(self.latencies)
+            # Recomputed every few samples; sorting on every call costs more
+            # than the delay it tunes.
+            if samples >= self.min_samples and (
+                self.delay is None or self.recorded % 20 == 0
+            ):
+                ordered = sorted(self.latencies)
+                index = min(samples - 1, int(samples * self.percentile / 100))
+                self.delay = max(self.min_delay, ordered[index])
+
+    def _take_hedge_delay(self) -> Optional[float]:
+        with self.lock:
+            self.requests += 1
+            if self.delay is None or self.hedged >= self.max_ratio * self.requests:
+                return None
+            return self.delay
+
+    def _hedge_sent(self) -> bool:
+        with self.lock:
+            if self.hedged >= self.max_ratio * self.requests:
+                return False
+            self.hedged += 1
+            return True
+
+    def _hedge_won(self) -> None:
+        with self.lock:
+            self.hedge_wins += 1
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins,
+                "delay_ms": self.delay * 1000 if self.delay is not None else None,
+            }
+
+    def _timed(self, call):
+        started = time.perf_counter()
+        result = call()
+        self.record(time.perf_counter() - started)
+        return result
+
+    def _submit(self, call):
+        if self._executor is None:
+            with self.lock:
+                if self._executor is None:
+                    # A request may have its first and its hedged call running.
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=2 * settings.thread_pool_size,
+                        thread_name_prefix="s3-hedge",
+                    )
+        context = contextvars.copy_context()
+        return self._executor.submit(context.run, self._timed, call)
+
+    def call(self, call):
+        delay = self._take_hedge_delay()
+        if delay is None:
+            return self._timed(call)
+        first = self._submit(call)
+        done, _ = wait([first], timeout=_bounded(delay))
+        if done or not self._hedge_sent():
+            return _result(first)
+        second = self._submit(call)
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = wait(
+                pending, timeout=remaining(), return_when=FIRST_COMPLETED
+            )
+            if not done:
+                raise deadline_exceeded()
+            for future in done:
+                if future.exception() is None:
+                    if future is second:
+                        self._hedge_won()
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+    async def call_async(self, make_call):
+        delay = self._take_hedge_delay()
+        if delay is None:
+            started = time.perf_counter()
+            result = await make_call()
+            self.record(time.perf_counter() - started)
+            return result
+        first = asyncio.ensure_future(self._timed_async(make_call))
+        done, _ = await asyncio.wait({first}, timeout=_bounded(delay))
+        if done or not self._hedge_sent():
+            return await first
+        second = asyncio.ensure_future(self._timed_async(make_call))
+        pending = {first, second}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self._hedge_won()
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _timed_async(self, make_call):
+        started = time.perf_counter()
+        result = await make_call()
+        self.record(time.perf_counter() - started)
+        return result
+
+
+def _bounded(delay: float) -> float:
+    left = remaining()
+    return delay if left is None else min(delay, left)
+
+
+def _result(future):
+    left = remaining()
+    if left is None:
+        return future.result()
+    done, _ = wait([future], timeout=left)
+    if not done:
+        raise deadline_exceeded()
+    return future.result()
+
+
+s3_hedger = (
+    Hedger(
+        settings.s3_hedge_percentile,
+        settings.s3_hedge_min_delay,
+        settings.s3_hedge_max_ratio,
+    )
+    if settings.s3_hedge
+    else None
+)
+
+
+def put_object(client, **kwargs):
+    """`client.put_object`, hedged when S3_HEDGE is on."""
+    if s3_hedger is None:
+        return client.put_object(**kwargs)
+    return s3_hedger.call(lambda: client.put_object(**kwargs))
+
+
+async def put_object_async(client, **kwargs):
+    if s3_hedger is None:
+        return await client.put_object(**kwargs)
+    return await s3_hedger.call_async(lambda: client.put_object(**kwargs))
+
+
+def stats() -> dict:
+    result = {service: s.snapshot() for service, s in _service_stats.items()}
+    if s3_hedger is not None:
+        result["s3_hedge"] = s3_hedger.snapshot()
+    return result
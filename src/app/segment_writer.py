@@ -0,0 +1,238 @@
+import json
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, NamedTuple, Optional
+
+from .errors import Overloaded
+
+logger = logging.getLogger(__name__)
+
+ENQUEUE_POLL = 0.005  # seconds between retries while the queue is full
+
+
+class Location(NamedTuple):
+    segment: str
+    offset: int
+    length: int
+
+    def as_item(self) -> dict:
+        """Attributes stored on the DynamoDB item next to the id."""
+        return {"segment": self.segment, "offset": self.offset, "length": self.length}
+
+
+class _Pending:
+    __slots__ = ("guid", "payload", "future")
+
+    def __init__(self, guid: str, payload: bytes) -> None:
+        self.guid = guid
+        self.payload = payload
+        self.future = Future()
+
+
+class SegmentWriter:
+    """Packs many small payloads into one S3 object per segment.
+
+    S3 objects cannot be appended to, so a segment is sealed and uploaded in
+    one PUT when it reaches `max_bytes` or when its first payload has waited
+    `max_age` seconds. `append` returns a future that resolves to the
+    payload's `Location` only after the segment (and its index object) are
+    stored, so a client is never acknowledged before its bytes are durable.
+
+    Segment keys embed the host, pid and a per-process sequence number, so
+    every gunicorn worker rolls its own segments without coordination.
+    """
+
+    def __init__(
+        self,
+        client,
+        bucket_name: str,
+        prefix: str = "segments/",
+        max_bytes: int = 4 * 1024 * 1024,
+        max_age: float = 0.05,
+        write_index: bool = True,
+        queue_size: int = 10000,
+        enqueue_timeout: float = 1.0,
+        workers: int = 2,
+    ) -> None:
+        self.client = client
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.write_index = write_index
+        self.enqueue_timeout = enqueue_timeout
+        self.pid = os.getpid()
+        self._writer_id = f"{socket.gethostname()}-{self.pid}-{time.time_ns()}"
+        self._sequence = 0
+        self._sequence_lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._closed = threading.Event()
+        self._lock = threading.Lock()
+        self._threads = [
+            threading.Thread(
+                target=self._run, name=f"s3-segment-writer-{i}", daemon=True
+            )
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def append(
+        self, guid: str, payload: bytes, timeout: Optional[float] = None
+    ) -> Future:
+        pending = _Pending(guid, payload)
+        timeout = self.enqueue_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        while True:
+            # close() takes the lock too, so nothing is queued once it has begun.
+            # The lock only covers the non-blocking put; waiting for space
+            # happens outside it so each caller's timeout bounds its own wait.
+            with self._lock:
+                if self._closed.is_set():
+                    raise RuntimeError("segment writer is closed")
+                try:
+                    self._queue.put_nowait(pending)
+                except queue.Full:
+                    pass
+                else:
+                    return pending.future
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise Overloaded("S3 segment writer queue is full")
+            time.sleep(min(ENQUEUE_POLL, remaining))
+
+    def close(self, timeout: float = 10.0) -> None:
+        """Stop accepting payloads and upload everything already queued."""
+        with self._lock:
+            self._closed.set()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        # Whatever the workers did not take before the timeout is never sent.
+        error = RuntimeError("segment writer closed before the payload was written")
+        while True:
+            try:
+                self._queue.get_nowait().future.set_exception(error)
+            except queue.Empty:
+                break
+
+    def _next_key(self) -> str:
+        with self._sequence_lock:
+            self._sequence += 1
+            sequence = self._sequence
+        hour = time.strftime("%Y/%m/%d/%H", time.gmtime())
+        return f"{self.prefix}{hour}/{self._writer_id}-{sequence:08d}.seg"
+
+    def _run(self) -> None:
+        while True:
+            segment = self._collect()
+            if segment:
+                self._upload(segment)
+            elif self._closed.is_set():
+                return
+
+    def _collect(self) -> List[_Pending]:
+        try:
+            first = self._queue.get(timeout=0.1)
+        except queue.Empty:
+            return []
+        segment = [first]
+        size = len(first.payload)
+        deadline = time.monotonic() + self.max_age
+        while size < self.max_bytes:
+            remaining = deadline - time.monotonic()
+            try:
+                pending = (
+                    self._queue.get(timeout=remaining)
+                    if remaining > 0
+                    else self._queue.get_nowait()
+                )
+            except queue.Empty:
+                break
+            segment.append(pending)
+            size += len(pending.payload)
+        return segment
+
+    def _upload(self, segment: List[_Pending]) -> None:
+        key = self._next_key()
+        locations = []
+        offset = 0
+        for pending in segment:
+            locations.append(Location(key, offset, len(pending.payload)))
+            offset += len(pending.payload)
+        try:
+            self.client.put_object(
+                Bucket=self.bucket_name,
+                Key=key,
+                Body=b"".join(pending.payload for pending in segment),
+            )
+            if self.write_index:
+                index = {
+                    pending.guid: [location.offset, location.length]
+                    for pending, location in zip(segment, locations)
+                }
+                self.client.put_object(
+                    Bucket=self.bucket_name,
+                    Key=f"{key}.idx.json",
+                    Body=json.dumps(index, separators=(",", ":")).encode("utf-8"),
+                    ContentType="application/json",
+                )
+        except Exception as exc:
+            logger.warning("Upload of segment %s failed: %s", key, exc)
+            for pending in segment:
+                pending.future.set_exception(exc)
+            return
+        for pending, location in zip(segment, locations):
+            pending.future.set_result(location)
+
+
+class SegmentReader:
+    """Resolves a guid to its stored bytes.
+
+    The DynamoDB item written for each record carries the segment key, offset
+    and length, so a record costs one GetItem and one ranged GetObject.
+    Records written in object mode fall back to `{guid}.txt`.
+    """
+
+    def __init__(
+        self, s3_client, dynamodb_client, bucket_name: str, table_name: str
+    ) -> None:
+        self.s3_client = s3_client
+        self.dynamodb_client = dynamodb_client
+        self.bucket_name = bucket_name
+        self.table_name = table_name
+
+    def locate(self, guid: str) -> Optional[Location]:
+        item = self.dynamodb_client.get_item(
+            TableName=self.table_name,
+            Key={"id": {"S": guid}},
+            ConsistentRead=True,
+        ).get("Item")
+        if item is None:
+            raise KeyError(guid)
+        if "segment" not in item:
+            return None
+        return Location(
+            item["segment"]["S"], int(item["offset"]["N"]), int(item["length"]["N"])
+        )
+
+    def read(self, guid: str) -> bytes:
+        location = self.locate(guid)
+        if location is None:
+            response = self.s3_client.get_object(
+                Bucket=self.bucket_name, Key=f"{guid}.txt"
+            )
+        else:
+            first = location.offset
+            last = location.offset + location.length - 1
+            response = self.s3_client.get_object(
+                Bucket=self.bucket_name,
+                Key=location.segment,
+                Range=f"bytes={first}-{last}",
+            )
+        return response["Body"].read()
@@ -0,0 +1,136 @@
+"""Production launcher shared by the ECS image and the EC2 instances.
+
+    python -m app.server [--daemon] [--print-config]
+
+Runs gunicorn with uvicorn workers sized from the CPUs this process may
+actually use (affinity mask and cgroup CPU quota), preloads the app and the
+botocore service models in the master, freezes the master's heap with
+`gc.freeze()` so the workers keep sharing it, and drains in-flight requests
+on SIGTERM.
+"""
+
+import argparse
+import gc
+import json
+import math
+import os
+
+from gunicorn.app.base import BaseApplication
+from uvicorn.workers import UvicornWorker
+
+from .config import settings
+
+
+class Worker(UvicornWorker):
+    # "auto" lets uvicorn pick uvloop and httptools when they are installed.
+    CONFIG_KWARGS = {"loop": settings.web_loop, "http": settings.web_http}
+
+    def init_process(self) -> None:
+        from . import readiness
+
+        readiness.join_host(self.ppid)
+        super().init_process()
+
+
+def cgroup_cpu_limit():
+    """CPU quota of the container in cores, or None when unlimited."""
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()[:2]
+        if quota != "max":
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        if quota > 0 and period > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def available_cpus() -> float:
+    try:
+        cpus = float(len(os.sched_getaffinity(0)))
+    except AttributeError:
+        cpus = float(os.cpu_count() or 1)
+    limit = cgroup_cpu_limit()
+    return min(cpus, limit) if limit else cpus
+
+
+def worker_count() -> int:
+    if settings.web_workers > 0:
+        return settings.web_workers
+    return max(1, math.ceil(available_cpus() * settings.web_workers_per_cpu))
+
+
+def gunicorn_options(daemon: bool = False) -> dict:
+    return {
+        "bind": settings.web_bind,
+        "workers": worker_count(),
+        "worker_class": "app.server.Worker",
+        "preload_app": True,
+        "keepalive": settings.web_keepalive,
+        "backlog": settings.web_backlog,
+        "graceful_timeout": settings.web_graceful_timeout,
+        # Heartbeat files on the container overlay filesystem can stall workers.
+        "worker_tmp_dir": "/dev/shm" if os.path.isdir("/dev/shm") else None,
+        "accesslog": None,
+        "errorlog": "-",
+        "daemon": daemon,
+    }
+
+
+class Server(BaseApplication):
+    def __init__(self, options: dict) -> None:
+        self.options = options
+        super().__init__()
+
+    def load_config(self) -> None:
+        for key, value in self.options.items():
+            if value is not None:
+                self.cfg.set(key, value)
+
+    def load(self):
+        from .main import app
+
+        if settings.web_preload_models:
+            from . import clients
+
+            clients.preload_models()
+            if settings.io_mode == "async":
+                from . import aio
+
+                aio.preload_models()
+        if settings.web_gc_freeze:
+            # The workers' collections skip frozen objects, so they do not
+            # write to, and copy, the pages they share with the master.
+            gc.freeze()
+            gc.enable()
+        return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the API under gunicorn.")
+    parser.add_argument("--daemon", action="store_true")
+    parser.add_argument("--print-config", action="store_true")
+    args = parser.parse_args()
+
+    options = gunicorn_options(daemon=args.daemon)
+    if args.print_config:
+        print(json.dumps({"available_cpus": available_cpus(), **options}, indent=2))
+        return
+    if settings.web_gc_freeze:
+        # No collections until the app is loaded and frozen, so the freed
+        # objects leave no holes in pages the workers will share.
+        gc.disable()
+    Server(options).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,550 @@
+"""Storage backends behind the S3 object writes and DynamoDB item writes.
+
+STORAGE_BACKEND=aws (the default) talks to S3 and DynamoDB. `memory`,
+`filesystem` and `sqlite` keep records on the worker itself, so the cost of
+handling a request can be measured without AWS in the way (`app.ceiling`).
+
+A backend provides the S3 and DynamoDB client operations the app calls
+(put_object, get_object and head_bucket; put_item, get_item,
+batch_write_item and describe_table) with the same parameters and
+responses, so the record writers, the batch and segment writers, bulk
+writes, reads and the readiness probes work unchanged on every backend,
+batched and concurrent alike. Items keep DynamoDB's attribute value form.
+
+- `memory` keeps everything in dicts, per worker process.
+- `filesystem` writes one file per object and per item under STORAGE_PATH,
+  each through a temporary file and a rename, so workers share them.
+- `sqlite` keeps both in STORAGE_PATH/storage.db in WAL mode, with one
+  connection per thread and one transaction per BatchWriteItem.
+- `simulated` keeps records in memory but makes every call wait, get
+  throttled and fail like S3 and DynamoDB would (`SimulatedStorage`).
+"""
+
+import abc
+import asyncio
+import functools
+import json
+import math
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+from . import resilience
+from .config import settings
+
+
+class NoSuchKey(Exception):
+    pass
+
+
+class _Exceptions:
+    NoSuchKey = NoSuchKey
+
+
+class _Body:
+    __slots__ = ("_data",)
+
+    def __init__(self, data: bytes) -> None:
+        self._data = data
+
+    def read(self) -> bytes:
+        return self._data
+
+
+class _AsyncBody(_Body):
+    async def read(self) -> bytes:
+        return self._data
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+def _ranged(body: bytes, byte_range: Optional[str]) -> bytes:
+    if not byte_range:
+        return body
+    first, last = byte_range[len("bytes=") :].split("-")
+    return body[int(first) : int(last) + 1]
+
+
+def _item_id(key: dict) -> str:
+    return key["id"]["S"]
+
+
+class LocalStorage(abc.ABC):
+    """The client operations, on top of the four primitives a backend defines."""
+
+    exceptions = _Exceptions
+    blocking = True  # whether the async clients run operations on a thread
+
+    def put_object(self, Bucket: str, Key: str, Body, **kwargs) -> dict:
+        self._put_object(Bucket, Key, bytes(Body))
+        return {}
+
+    def get_object(self, Bucket: str, Key: str, Range=None, **kwargs) -> dict:
+        body = self._get_object(Bucket, Key)
+        if body is None:
+            raise NoSuchKey(f"{Bucket}/{Key} does not exist")
+        return {"Body": _Body(_ranged(body, Range))}
+
+    def head_bucket(self, Bucket: str, **kwargs) -> dict:
+        return {}
+
+    def put_item(self, TableName: str, Item: dict, **kwargs) -> dict:
+        self._put_items(TableName, [Item])
+        return {}
+
+    def get_item(self, TableName: str, Key: dict, **kwargs) -> dict:
+        item = self._get_item(TableName, _item_id(Key))
+        return {} if item is None else {"Item": item}
+
+    def batch_write_item(self, RequestItems: Dict[str, list], **kwargs) -> dict:
+        for table_name, requests in RequestItems.items():
+            self._put_items(
+                table_name, [request["PutRequest"]["Item"] for request in requests]
+            )
+        return {"UnprocessedItems": {}}
+
+    def describe_table(self, TableName: str, **kwargs) -> dict:
+        return {"Table": {"TableName": TableName, "TableStatus": "ACTIVE"}}
+
+    @abc.abstractmethod
+    def _put_object(self, bucket: str, key: str, body: bytes) -> None: ...
+
+    @abc.abstractmethod
+    def _get_object(self, bucket: str, key: str) -> Optional[bytes]: ...
+
+    @abc.abstractmethod
+    def _put_items(self, table_name: str, items: List[dict]) -> None: ...
+
+    @abc.abstractmethod
+    def _get_item(self, table_name: str, item_id: str) -> Optional[dict]: ...
+
+
+class MemoryStorage(LocalStorage):
+    blocking = False
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._objects = {}
+        self._items = {}
+
+    def _put_object(self, bucket: str, key: str, body: bytes) -> None:
+        with self._lock:
+            self._objects[(bucket, key)] = body
+
+    def _get_object(self, bucket: str, key: str) -> Optional[bytes]:
+        return self._objects.get((bucket, key))
+
+    def _put_items(self, table_name: str, items: List[dict]) -> None:
+        with self._lock:
+            for item in items:
+                self._items[(table_name, _item_id(item))] = item
+
+    def _get_item(self, table_name: str, item_id: str) -> Optional[dict]:
+        return self._items.get((table_name, item_id))
+
+
+class FilesystemStorage(LocalStorage):
+    def __init__(self, root: str) -> None:
+        self.root = os.path.abspath(root)
+
+    def _path(self, *parts: str) -> str:
+        path = os.path.normpath(os.path.join(self.root, *parts))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"{os.path.join(*parts)} leaves {self.root}")
+        return path
+
+    def _write(self, path: str, data: bytes) -> None:
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # Readers only ever see complete files.
+        descriptor, temporary = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(descriptor, "wb") as output:
+                output.write(data)
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+    def _read(self, path: str) -> Optional[bytes]:
+        try:
+            with open(path, "rb") as source:
+                return source.read()
+        except FileNotFoundError:
+            return None
+
+    def _put_object(self, bucket: str, key: str, body: bytes) -> None:
+        self._write(self._path("objects", bucket, key), body)
+
+    def _get_object(self, bucket: str, key: str) -> Optional[bytes]:
+        return self._read(self._path("objects", bucket, key))
+
+    def _put_items(self, table_name: str, items: List[dict]) -> None:
+        for item in items:
+            path = self._path("items", table_name, f"{_item_id(item)}.json")
+            self._write(path, json.dumps(item).encode("utf-8"))
+
+    def _get_item(self, table_name: str, item_id: str) -> Optional[dict]:
+        data = self._read(self._path("items", table_name, f"{item_id}.json"))
+        return None if data is None else json.loads(data)
+
+
+class SqliteStorage(LocalStorage):
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS objects "
+        "(bucket TEXT, key TEXT, body BLOB, PRIMARY KEY (bucket, key))",
+        "CREATE TABLE IF NOT EXISTS items "
+        "(table_name TEXT, id TEXT, item TEXT, PRIMARY KEY (table_name, id))",
+    )
+
+    def __init__(self, root: str) -> None:
+        root = os.path.abspath(root)
+        os.makedirs(root, exist_ok=True)
+        self.path = os.path.join(root, "storage.db")
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        # Connections cannot cross threads, nor survive gunicorn's fork.
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            for statement in self.SCHEMA:
+                connection.execute(statement)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _put_object(self, bucket: str, key: str, body: bytes) -> None:
+        self._connection().execute(
+            "INSERT OR REPLACE INTO objects VALUES (?, ?, ?)", (bucket, key, body)
+        )
+
+    def _get_object(self, bucket: str, key: str) -> Optional[bytes]:
+        row = (
+            self._connection()
+            .execute(
+                "SELECT body FROM objects WHERE bucket = ? AND key = ?", (bucket, key)
+            )
+            .fetchone()
+        )
+        return None if row is None else bytes(row[0])
+
+    def _put_items(self, table_name: str, items: List[dict]) -> None:
+        connection = self._connection()
+        rows = [(table_name, _item_id(item), json.dumps(item)) for item in items]
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany(
+                "INSERT OR REPLACE INTO items VALUES (?, ?, ?)", rows
+            )
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def _get_item(self, table_name: str, item_id: str) -> Optional[dict]:
+        row = (
+            self._connection()
+            .execute(
+                "SELECT item FROM items WHERE table_name = ? AND id = ?",
+                (table_name, item_id),
+            )
+            .fetchone()
+        )
+        return None if row is None else json.loads(row[0])
+
+
+class Latency:
+    """A latency distribution given in milliseconds, e.g. `lognormal:25:0.4`.
+
+    `constant:MS`, `uniform:LOW:HIGH`, `exponential:MEAN` or
+    `lognormal:MEDIAN:SIGMA`, where SIGMA is that of the underlying normal.
+    """
+
+    ARGUMENTS = {"constant": 1, "uniform": 2, "exponential": 1, "lognormal": 2}
+
+    def __init__(self, spec: str) -> None:
+        kind, *values = spec.split(":")
+        if len(values) != self.ARGUMENTS.get(kind):
+            raise ValueError(
+                f"latency must be constant:MS, uniform:LOW:HIGH, exponential:MEAN "
+                f"or lognormal:MEDIAN:SIGMA, got {spec!r}"
+            )
+        self.spec = spec
+        self.kind = kind
+        self.values = [float(value) for value in values]
+
+    def sample(self, rng: random.Random) -> float:
+        """One latency in seconds."""
+        if self.kind == "constant":
+            milliseconds = self.values[0]
+        elif self.kind == "uniform":
+            milliseconds = rng.uniform(*self.values)
+        elif self.kind == "exponential":
+            milliseconds = rng.expovariate(1 / self.values[0])
+        else:
+            median, sigma = self.values
+            milliseconds = rng.lognormvariate(math.log(median), sigma)
+        return milliseconds / 1000
+
+
+_SERVICES = {
+    "put_object": "s3",
+    "get_object": "s3",
+    "head_bucket": "s3",
+    "put_item": "dynamodb",
+    "get_item": "dynamodb",
+    "batch_write_item": "dynamodb",
+    "describe_table": "dynamodb",
+}
+_THROTTLED = {"s3": ("SlowDown", 503), "dynamodb": ("ThrottlingException", 400)}
+_FAILED = {"s3": ("InternalError", 500), "dynamodb": ("InternalServerError", 500)}
+
+
+def _client_error(operation: str, code: str, status: int):
+    from botocore.exceptions import ClientError
+
+    response = {
+        "Error": {"Code": code, "Message": "injected by STORAGE_BACKEND=simulated"},
+        "ResponseMetadata": {"HTTPStatusCode": status},
+    }
+    return ClientError(response, "".join(map(str.title, operation.split("_"))))
+
+
+class SimulatedStorage:
+    """The memory backend behind injected latency, throttling and errors.
+
+    Every attempt waits for a latency drawn from its service's distribution
+    and is throttled or fails at the configured rates. Both are retried as
+    botocore's standard mode retries them: up to AWS_MAX_ATTEMPTS, after
+    `random() * 2 ** (attempt - 1)` seconds, within the request deadline,
+    and counted in `resilience.stats()`. BatchWriteItem is throttled item by
+    item instead and returns the items as UnprocessedItems, as DynamoDB does,
+    for the batch writer to retry. Waits sleep the calling thread, or yield
+    to the event loop in async mode, as a network call would.
+    """
+
+    def __init__(
+        self,
+        latencies: Dict[str, Latency],
+        throttle_rate: float,
+        error_rate: float,
+        backend: Optional[LocalStorage] = None,
+    ) -> None:
+        self.backend = backend or MemoryStorage()
+        self.exceptions = self.backend.exceptions
+        self.latencies = latencies
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.random = random.Random()
+        self.lock = threading.Lock()
+        self.calls = {service: 0 for service in latencies}
+        self.in_flight = {service: 0 for service in latencies}
+
+    def _plan(self, operation: str) -> list:
+        """(latency, error, backoff) per attempt, up to the first success."""
+        service = _SERVICES[operation]
+        throttle_rate = 0.0 if operation == "batch_write_item" else self.throttle_rate
+        attempts = []
+        for attempt in range(1, settings.aws_max_attempts + 1):
+            roll = self.random.random()
+            if roll < throttle_rate:
+                error = _client_error(operation, *_THROTTLED[service])
+            elif roll < throttle_rate + self.error_rate:
+                error = _client_error(operation, *_FAILED[service])
+            else:
+                error = None
+            latency = self.latencies[service].sample(self.random)
+            if error is None or attempt == settings.aws_max_attempts:
+                attempts.append((latency, error, None))
+                break
+            backoff = min(20, self.random.random() * 2 ** (attempt - 1))
+            attempts.append((latency, error, backoff))
+        return attempts
+
+    def _started(self, service: str) -> None:
+        with self.lock:
+            self.calls[service] += 1
+            self.in_flight[service] += 1
+
+    def _attempted(self, service: str, error) -> None:
+        code = error.response["Error"]["Code"] if error is not None else None
+        stats = resilience.service_stats(service)
+        with stats.lock:
+            stats.attempts += 1
+            stats.throttled += code in resilience.THROTTLED_ERROR_CODES
+
+    def _deadline_exceeded(self, service: str):
+        stats = resilience.service_stats(service)
+        with stats.lock:
+            stats.deadline_exceeded += 1
+        return resilience.deadline_exceeded()
+
+    def _finished(self, service: str, failed: bool) -> None:
+        with self.lock:
+            self.in_flight[service] -= 1
+        stats = resilience.service_stats(service)
+        with stats.lock:
+            stats.calls += 1
+            stats.errors += failed
+
+    def _respond(self, operation: str, kwargs: dict) -> dict:
+        if operation != "batch_write_item" or not self.throttle_rate:
+            return getattr(self.backend, operation)(**kwargs)
+        written, unprocessed = {}, {}
+        for table_name, requests in kwargs["RequestItems"].items():
+            for request in requests:
+                throttled = self.random.random() < self.throttle_rate
+                (unprocessed if throttled else written).setdefault(
+                    table_name, []
+                ).append(request)
+        if written:
+            self.backend.batch_write_item(RequestItems=written)
+        return {"UnprocessedItems": unprocessed}
+
+    def invoke(self, operation: str, kwargs: dict) -> dict:
+        service = _SERVICES[operation]
+        self._started(service)
+        failed = True
+        try:
+            for latency, error, backoff in self._plan(operation):
+                if resilience.remaining() == 0:
+                    raise self._deadline_exceeded(service)
+                time.sleep(latency)
+                self._attempted(service, error)
+                if error is None:
+                    response = self._respond(operation, kwargs)
+                    failed = False
+                    return response
+                if backoff is None:
+                    raise error
+                if resilience.remaining() == 0:
+                    raise self._deadline_exceeded(service)
+                time.sleep(backoff)
+        finally:
+            self._finished(service, failed)
+
+    async def invoke_async(self, operation: str, kwargs: dict) -> dict:
+        service = _SERVICES[operation]
+        self._started(service)
+        failed = True
+        try:
+            for latency, error, backoff in self._plan(operation):
+                if resilience.remaining() == 0:
+                    raise self._deadline_exceeded(service)
+                await asyncio.sleep(latency)
+                self._attempted(service, error)
+                if error is None:
+                    response = self._respond(operation, kwargs)
+                    failed = False
+                    return response
+                if backoff is None:
+                    raise error
+                if resilience.remaining() == 0:
+                    raise self._deadline_exceeded(service)
+                await asyncio.sleep(backoff)
+        finally:
+            self._finished(service, failed)
+
+    def __getattr__(self, operation: str):
+        if operation not in _SERVICES:
+            raise AttributeError(operation)
+        return lambda **kwargs: self.invoke(operation, kwargs)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                service: {
+                    "latency": latency.spec,
+                    "calls": self.calls[service],
+                    "in_flight": self.in_flight[service],
+                }
+                for service, latency in self.latencies.items()
+            }
+
+
+class AsyncStorage:
+    """Coroutine versions of a backend's operations, as aiobotocore has them."""
+
+    def __init__(self, backend) -> None:
+        self.backend = backend
+        self.exceptions = backend.exceptions
+
+    async def _call(self, operation: str, kwargs: dict) -> dict:
+        if isinstance(self.backend, SimulatedStorage):
+            return await self.backend.invoke_async(operation, kwargs)
+        call = functools.partial(getattr(self.backend, operation), **kwargs)
+        if self.backend.blocking:
+            return await asyncio.get_running_loop().run_in_executor(None, call)
+        return call()
+
+    def __getattr__(self, operation: str):
+        async def call(**kwargs):
+            response = await self._call(operation, kwargs)
+            if "Body" in response:
+                response["Body"] = _AsyncBody(response["Body"].read())
+            return response
+
+        return call
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+BACKENDS = {
+    "memory": MemoryStorage,
+    "filesystem": FilesystemStorage,
+    "sqlite": SqliteStorage,
+}
+
+_lock = threading.Lock()
+_backend = None
+
+
+def is_local() -> bool:
+    return settings.storage_backend != "aws"
+
+
+def backend():
+    """This process's local backend; only used when STORAGE_BACKEND is not aws."""
+    global _backend
+    if _backend is None:
+        with _lock:
+            if _backend is None:
+                _backend = _create()
+    return _backend
+
+
+def _create():
+    if settings.storage_backend == "simulated":
+        return SimulatedStorage(
+            {
+                "s3": Latency(settings.simulated_s3_latency),
+                "dynamodb": Latency(settings.simulated_dynamodb_latency),
+            },
+            settings.simulated_throttle_rate,
+            settings.simulated_error_rate,
+        )
+    backend_class = BACKENDS[settings.storage_backend]
+    if backend_class is MemoryStorage:
+        return backend_class()
+    return backend_class(settings.storage_path)
+
+
+def stats():
+    if not is_local():
+        return None
+    result = {"backend": settings.storage_backend}
+    if isinstance(_backend, SimulatedStorage):
+        result.update(_backend.stats())
+    return result
@@ -0,0 +1,331 @@
+"""Per-request timing segments, aggregated in-process and sent over StatsD.
+
+`TimingMiddleware` starts a timer for every request and the handlers mark
+their segments with `segment()`/`timed()`. Finished requests are folded into
+a bounded reservoir per metric; every flush interval the reservoir is sent as
+batched DogStatsD timer lines whose sample rate keeps the agent's counts and
+sums unbiased, so the cost per request stays constant at any request rate.
+On Lambda there is no background thread: `flush()` runs at the end of each
+invocation instead. With EMF_NAMESPACE set, typically on Lambda where no
+StatsD agent runs, the timings are printed as CloudWatch Embedded Metric
+Format log lines instead, under the same names and dimensions.
+"""
+
+import asyncio
+import contextvars
+import functools
+import json
+import os
+import random
+import re
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+from .config import settings
+
+MAX_PACKET_BYTES = 1432  # fits a single Ethernet frame
+ON_LAMBDA = "AWS_LAMBDA_FUNCTION_NAME" in os.environ
+
+_current = contextvars.ContextVar("request_timings", default=None)
+_unsafe_tag_chars = re.compile(r"[^A-Za-z0-9_.\-]")
+
+
+class RequestTimings:
+    __slots__ = (
+        "started",
+        "execution_id",
+        "status",
+        "handler_started",
+        "handler",
+        "segments",
+    )
+
+    def __init__(self, execution_id: str) -> None:
+        self.started = time.perf_counter()
+        self.execution_id = execution_id
+        self.status = 500
+        self.handler_started = None
+        self.handler = None
+        self.segments = {}
+
+
+def handler_started() -> None:
+    timings = _current.get()
+    if timings is not None:
+        timings.handler_started = time.perf_counter()
+
+
+def handler_finished() -> None:
+    timings = _current.get()
+    if timings is not None and timings.handler_started is not None:
+        timings.handler = time.perf_counter() - timings.handler_started
+
+
+def instrumented(handler):
+    """Marks where a route handler starts and ends, keeping it sync or async."""
+    if asyncio.iscoroutinefunction(handler):
+
+        @functools.wraps(handler)
+        async def wrapper(*args, **kwargs):
+            handler_started()
+            try:
+                return await handler(*args, **kwargs)
+            finally:
+                handler_finished()
+
+    else:
+
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            handler_started()
+            try:
+                return handler(*args, **kwargs)
+            finally:
+                handler_finished()
+
+    return wrapper
+
+
+@contextmanager
+def segment(name: str):
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.segments[name] = time.perf_counter() - started
+
+
+async def timed(name: str, awaitable):
+    with segment(name):
+        return await awaitable
+
+
+class _Reservoir:
+    __slots__ = ("seen", "samples", "max")
+
+    def __init__(self) -> None:
+        self.seen = 0
+        self.samples = []
+        self.max = 0.0
+
+    def add(self, value: float, capacity: int) -> None:
+        self.seen += 1
+        self.max = max(self.max, value)
+        if len(self.samples) < capacity:
+            self.samples.append(value)
+        else:
+            slot = random.randrange(self.seen)
+            if slot < capacity:
+                self.samples[slot] = value
+
+    def values(self):
+        samples = self.samples
+        if self.max not in samples:
+            # Keep the true maximum so the Maximum statistic is exact.
+            samples[random.randrange(len(samples))] = self.max
+        return samples
+
+    def lines(self, name: str, tags: str):
+        rate = len(self.samples) / self.seen
+        samples = self.values()
+        suffix = f"|ms|@{rate:.6g}{tags}" if rate < 1 else f"|ms{tags}"
+        return [f"{name}:{value * 1000:.3f}{suffix}" for value in samples]
+
+
+class Aggregator:
+    def __init__(self, host: str, port: int, prefix: str, capacity: int) -> None:
+        self.address = (host, port)
+        self.prefix = prefix
+        self.capacity = capacity
+        self.base_tags = f"platform:{settings.platform}"
+        self.dropped_packets = 0
+        self._lock = threading.Lock()
+        self._reservoirs = {}
+        self._socket = None
+        self._pid = None
+
+    def record(self, timings: RequestTimings, status: int) -> None:
+        total = time.perf_counter() - timings.started
+        values = dict(timings.segments)
+        values["total"] = total
+        if timings.handler is not None:
+            queue = timings.handler_started - timings.started
+            values["queue"] = queue
+            values["handler"] = timings.handler
+            values["framework"] = max(0.0, total - timings.handler - queue)
+        tags = f"{self.base_tags},execution_id:{timings.execution_id}"
+        if status >= 500:
+            tags += ",status:5xx"
+        with self._lock:
+            for name, value in values.items():
+                reservoir = self._reservoirs.get((name, tags))
+                if reservoir is None:
+                    reservoir = self._reservoirs[(name, tags)] = _Reservoir()
+                reservoir.add(value, self.capacity)
+        self._ensure_flusher()
+
+    def flush(self) -> None:
+        with self._lock:
+            reservoirs, self._reservoirs = self._reservoirs, {}
+        if not reservoirs:
+            return
+        packet = []
+        size = 0
+        for (name, tags), reservoir in reservoirs.items():
+            for line in reservoir.lines(f"{self.prefix}.request.{name}", f"|#{tags}"):
+                if size + len(line) + 1 > MAX_PACKET_BYTES and packet:
+                    self._send("\n".join(packet))
+                    packet, size = [], 0
+                packet.append(line)
+                size += len(line) + 1
+        if packet:
+            self._send("\n".join(packet))
+
+    def timing(self, name: str, seconds: float) -> None:
+        """Sends one timer value now, outside the per-request reservoirs."""
+        self._send(f"{self.prefix}.{name}:{seconds * 1000:.3f}|ms|#{self.base_tags}")
+
+    def _send(self, payload: str) -> None:
+        if self._socket is None:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._socket.setblocking(False)
+        try:
+            self._socket.sendto(payload.encode("utf-8"), self.address)
+        except OSError:
+            self.dropped_packets += 1
+
+    def _ensure_flusher(self) -> None:
+        # Started lazily in each worker process; gunicorn forks after preload.
+        if ON_LAMBDA or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._socket = None
+        threading.Thread(target=self._run, name="statsd-flusher", daemon=True).start()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(settings.statsd_flush_interval)
+            self.flush()
+
+
+class EmfAggregator(Aggregator):
+    """Prints the reservoirs as Embedded Metric Format lines, one per tag set."""
+
+    # EMF takes at most 100 values per metric and line.
+    MAX_VALUES = 100
+
+    def __init__(self, namespace: str, prefix: str, capacity: int) -> None:
+        super().__init__("", 0, prefix, min(capacity, self.MAX_VALUES))
+        self.namespace = namespace
+
+    def flush(self) -> None:
+        with self._lock:
+            reservoirs, self._reservoirs = self._reservoirs, {}
+        by_tags = {}
+        for (name, tags), reservoir in reservoirs.items():
+            by_tags.setdefault(tags, {})[f"{self.prefix}.request.{name}"] = [
+                round(value * 1000, 3) for value in reservoir.values()
+            ]
+        for tags, metrics in by_tags.items():
+            self._emit(tags, metrics)
+
+    def timing(self, name: str, seconds: float) -> None:
+        self._emit(self.base_tags, {f"{self.prefix}.{name}": seconds * 1000})
+
+    def _emit(self, tags: str, metrics: dict) -> None:
+        # The dimensions the CloudWatch agent derives from StatsD tags.
+        dimensions = dict(tag.split(":", 1) for tag in tags.split(","))
+        dimensions["metric_type"] = "timing"
+        document = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": self.namespace,
+                        "Dimensions": [list(dimensions)],
+                        "Metrics": [
+                            {"Name": name, "Unit": "Milliseconds"} for name in metrics
+                        ],
+                    }
+                ],
+            },
+            **dimensions,
+            **metrics,
+        }
+        print(json.dumps(document), flush=True)
+
+
+if settings.emf_namespace:
+    aggregator = EmfAggregator(
+        settings.emf_namespace, settings.statsd_prefix, settings.statsd_reservoir
+    )
+elif settings.statsd_host:
+    aggregator = Aggregator(
+        settings.statsd_host,
+        settings.statsd_port,
+        settings.statsd_prefix,
+        settings.statsd_reservoir,
+    )
+else:
+    aggregator = None
+
+
+def flush() -> None:
+    if aggregator is not None:
+        aggregator.flush()
+
+
+def execution_id(value) -> str:
+    """Tag-safe form of the X-Execution-Id header sent by k6."""
+    if not value:
+        return "none"
+    return _unsafe_tag_chars.sub("_", value)[:64]
+
+
+@contextmanager
+def request_timer(execution_id: str):
+    """Times one request; yields None when timing is off."""
+    if aggregator is None:
+        yield None
+        return
+    timings = RequestTimings(execution_id)
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+        aggregator.record(timings, timings.status)
+
+
+class TimingMiddleware:
+    """ASGI middleware that times each HTTP request end to end."""
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if aggregator is None or scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        header = None
+        for key, value in scope["headers"]:
+            if key == b"x-execution-id":
+                header = value.decode("latin-1")
+                break
+        with request_timer(execution_id(header)) as timings:
+
+            async def send_with_status(message):
+                if message["type"] == "http.response.start":
+                    timings.status = message["status"]
+                await send(message)
+
+            await self.app(scope, receive, send_with_status)
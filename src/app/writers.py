@@ -0,0 +1,209 @@
+import os
+import threading
+from decimal import Decimal
+from concurrent.futures import Future, TimeoutError
+
+from . import clients, resilience, telemetry
+from .config import settings
+from .errors import DeadlineExceeded, WriteError
+
+# Background writers are created on first use, after gunicorn has forked, so
+# that every worker owns its own threads.
+_lock = threading.Lock()
+_batch_writer = None
+_segment_writer = None
+_journal = None
+_serializer = None
+_deserializer = None
+
+
+def to_attribute_values(item: dict) -> dict:
+    global _serializer
+    if _serializer is None:
+        from boto3.dynamodb.types import TypeSerializer
+
+        _serializer = TypeSerializer()
+    return {key: _serializer.serialize(value) for key, value in item.items()}
+
+
+def from_attribute_values(item: dict) -> dict:
+    global _deserializer
+    if _deserializer is None:
+        from boto3.dynamodb.types import TypeDeserializer
+
+        _deserializer = TypeDeserializer()
+    values = {}
+    for key, value in item.items():
+        value = _deserializer.deserialize(value)
+        if isinstance(value, Decimal):
+            value = int(value) if value == value.to_integral_value() else float(value)
+        values[key] = value
+    return values
+
+
+def result(guid: str, target: str, future: Future):
+    try:
+        return future.result(resilience.remaining())
+    except TimeoutError:
+        raise resilience.deadline_exceeded()
+    except DeadlineExceeded:
+        raise
+    except Exception as exc:
+        raise WriteError(guid, {target: exc})
+
+
+def write_record(bucket_name: str, table_name: str, guid: str) -> dict:
+    """Stores one record; returns the attributes of its DynamoDB item."""
+    with resilience.deadline(settings.request_deadline):
+        journal = get_journal()
+        if journal is not None:
+            with telemetry.segment("journal"):
+                future = journal.append(guid, guid.encode("utf-8"))
+                result(guid, "journal", future)
+            return {"id": guid}
+        return _write_record(bucket_name, table_name, guid)
+
+
+def _write_record(bucket_name: str, table_name: str, guid: str) -> dict:
+    from botocore.exceptions import BotoCoreError, ClientError
+
+    encoded_string = guid.encode("utf-8")
+    item = {"id": guid}
+    batch_writer = get_batch_writer()
+    segment_writer = get_segment_writer()
+    item_written = None
+
+    if segment_writer is not None:
+        # The item records where the payload landed, so it is written after.
+        with telemetry.segment("s3"):
+            future = segment_writer.append(guid, encoded_string)
+            item.update(result(guid, "s3", future).as_item())
+    else:
+        if batch_writer is not None:
+            # Queue the item first so it is batched while the S3 PUT runs.
+            item_written = batch_writer.submit(to_attribute_values(item))
+        file_name = f"{guid}.txt"
+        with telemetry.segment("s3"):
+            try:
+                resilience.put_object(
+                    clients.s3(), Bucket=bucket_name, Key=file_name, Body=encoded_string
+                )
+            except (BotoCoreError, ClientError) as exc:
+                raise WriteError(guid, {"s3": exc})
+
+    with telemetry.segment("dynamodb"):
+        if batch_writer is not None:
+            if item_written is None:
+                item_written = batch_writer.submit(to_attribute_values(item))
+            result(guid, "dynamodb", item_written)
+        else:
+            try:
+                clients.dynamodb().put_item(
+                    TableName=table_name, Item=to_attribute_values(item)
+                )
+            except (BotoCoreError, ClientError) as exc:
+                raise WriteError(guid, {"dynamodb": exc})
+    return item
+
+
+def get_batch_writer():
+    global _batch_writer
+    if settings.dynamodb_write_mode != "batch":
+        return None
+    if _batch_writer is None:
+        with _lock:
+            if _batch_writer is None:
+                from .batch_writer import BatchWriter
+
+                _batch_writer = BatchWriter(
+                    clients.dynamodb(),
+                    os.environ["DYNAMODB_TABLE"],
+                    max_wait=settings.dynamodb_batch_max_wait,
+                    queue_size=settings.dynamodb_batch_queue_size,
+                    enqueue_timeout=settings.dynamodb_batch_enqueue_timeout,
+                    max_attempts=settings.dynamodb_batch_max_attempts,
+                    workers=settings.dynamodb_batch_workers,
+                )
+    return _batch_writer
+
+
+def get_segment_writer():
+    global _segment_writer
+    if settings.s3_write_mode != "segment":
+        return None
+    if _segment_writer is None:
+        with _lock:
+            if _segment_writer is None:
+                from .segment_writer import SegmentWriter
+
+                _segment_writer = SegmentWriter(
+                    clients.s3(),
+                    os.environ["S3_BUCKET_NAME"],
+                    prefix=settings.s3_segment_prefix,
+                    max_bytes=settings.s3_segment_max_bytes,
+                    max_age=settings.s3_segment_max_age,
+                    write_index=settings.s3_segment_index,
+                )
+    return _segment_writer
+
+
+def get_journal():
+    """This worker's journal with WRITE_ACK=journal, except on Lambda, where
+    nothing would be left to upload it once the invocation returns."""
+    global _journal
+    if settings.write_ack != "journal" or telemetry.ON_LAMBDA:
+        return None
+    if _journal is None:
+        with _lock:
+            if _journal is None:
+                from . import journal
+
+                os.makedirs(settings.journal_dir, exist_ok=True)
+                directory, lock = journal.claim(settings.journal_dir)
+                _journal = _open_journal(directory, lock)
+                threading.Thread(
+                    target=journal.follow_orphans,
+                    args=(settings.journal_dir, _open_journal, 60.0),
+                    name="journal-orphans",
+                    daemon=True,
+                ).start()
+    return _journal
+
+
+def _open_journal(directory: str, lock):
+    from .journal import Journal
+
+    return Journal(
+        directory,
+        lock,
+        _upload_entries,
+        max_bytes=settings.journal_max_bytes,
+        segment_bytes=settings.journal_segment_bytes,
+        commit_wait=settings.journal_commit_wait,
+        upload_batch=settings.journal_upload_batch,
+        upload_workers=settings.journal_upload_workers,
+    )
+
+
+def _upload_entries(entries: list) -> list:
+    """Stores journal entries as `write_record` would; returns the failures."""
+    from . import bulk
+
+    records = [bulk.Record(entry.payload, entry.guid) for entry in entries]
+    bulk.store(os.environ["S3_BUCKET_NAME"], os.environ["DYNAMODB_TABLE"], records)
+    return [entry for entry, record in zip(entries, records) if record.failures]
+
+
+def journal_stats():
+    return _journal.stats() if _journal is not None else None
+
+
+def close_writers() -> None:
+    """Flush buffered writes; the journal first, as it writes through the
+    others, then segments, as items may depend on them."""
+    if _journal is not None:
+        _journal.close(settings.web_graceful_timeout / 2)
+    if _segment_writer is not None:
+        _segment_writer.close()
+    if _batch_writer is not None:
+        _batch_writer.close()
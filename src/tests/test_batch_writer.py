@@ -0,0 +1,113 @@
+import threading
+import time
+
+import pytest
+
+from app.batch_writer import BatchWriter
+from app.errors import Overloaded
+
+
+class StubClient:
+    """Records BatchWriteItem calls; blocks them while `gate` is clear."""
+
+    def __init__(self, blocked: bool = False) -> None:
+        self.gate = threading.Event()
+        if not blocked:
+            self.gate.set()
+        self.entered = threading.Event()
+        self.written = []
+        self._lock = threading.Lock()
+
+    def batch_write_item(self, RequestItems: dict) -> dict:
+        self.entered.set()
+        self.gate.wait()
+        with self._lock:
+            for requests in RequestItems.values():
+                self.written.extend(
+                    request["PutRequest"]["Item"]["id"]["S"] for request in requests
+                )
+        return {}
+
+
+def item(number: int) -> dict:
+    return {"id": {"S": str(number)}}
+
+
+def test_closed_writer_rejects_items():
+    writer = BatchWriter(StubClient(), "table")
+    writer.close()
+    with pytest.raises(RuntimeError):
+        writer.submit(item(0))
+
+
+def test_close_fails_items_the_workers_never_took():
+    client = StubClient(blocked=True)
+    writer = BatchWriter(client, "table", max_wait=0, workers=1)
+    in_flight = writer.submit(item(0))
+    assert client.entered.wait(1)
+    queued = [writer.submit(item(number)) for number in range(1, 4)]
+
+    writer.close(timeout=0.05)
+
+    for future in queued:
+        with pytest.raises(RuntimeError):
+            future.result(0)
+    assert writer._queue.empty()
+    client.gate.set()
+    assert in_flight.result(1) is None
+
+
+def test_no_item_is_left_queued_when_closing_under_load():
+    client = StubClient()
+    writer = BatchWriter(client, "table", workers=2)
+    futures = []
+    lock = threading.Lock()
+
+    def submit(start: int) -> None:
+        for number in range(start, start + 200):
+            try:
+                future = writer.submit(item(number))
+            except RuntimeError:
+                return
+            with lock:
+                futures.append(future)
+
+    submitters = [
+        threading.Thread(target=submit, args=(start,)) for start in range(0, 800, 200)
+    ]
+    for thread in submitters:
+        thread.start()
+    time.sleep(0.01)
+    writer.close()
+    for thread in submitters:
+        thread.join()
+
+    assert writer._queue.empty()
+    assert all(future.done() for future in futures)
+    assert len(client.written) == len(futures)
+
+
+def test_each_caller_waits_at_most_its_own_timeout():
+    client = StubClient(blocked=True)
+    writer = BatchWriter(client, "table", max_wait=0, queue_size=1, workers=1)
+    writer.submit(item(0))
+    assert client.entered.wait(1)
+    writer.submit(item(1))
+    waits = []
+
+    def submit(number: int) -> None:
+        started = time.monotonic()
+        with pytest.raises(Overloaded):
+            writer.submit(item(number), timeout=0.1)
+        waits.append(time.monotonic() - started)
+
+    callers = [threading.Thread(target=submit, args=(n,)) for n in range(2, 10)]
+    for thread in callers:
+        thread.start()
+    for thread in callers:
+        thread.join()
+
+    assert len(waits) == 8
+    assert max(waits) < 0.3
+    client.gate.set()
+    writer.close()
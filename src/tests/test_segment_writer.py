@@ -0,0 +1,105 @@
+import threading
+import time
+
+import pytest
+
+from app.errors import Overloaded
+from app.segment_writer import Location, SegmentWriter
+
+
+class StubClient:
+    """Keeps PutObject bodies in memory; blocks uploads while `gate` is clear."""
+
+    def __init__(self, blocked: bool = False) -> None:
+        self.gate = threading.Event()
+        if not blocked:
+            self.gate.set()
+        self.entered = threading.Event()
+        self.objects = {}
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes, **kwargs) -> dict:
+        self.entered.set()
+        self.gate.wait()
+        self.objects[Key] = Body
+        return {}
+
+
+def test_closed_writer_rejects_payloads():
+    writer = SegmentWriter(StubClient(), "bucket")
+    writer.close()
+    with pytest.raises(RuntimeError):
+        writer.append("guid", b"payload")
+
+
+def test_close_fails_payloads_the_workers_never_took():
+    client = StubClient(blocked=True)
+    writer = SegmentWriter(client, "bucket", max_age=0, workers=1)
+    in_flight = writer.append("0", b"0")
+    assert client.entered.wait(1)
+    queued = [writer.append(str(n), str(n).encode()) for n in range(1, 4)]
+
+    writer.close(timeout=0.05)
+
+    for future in queued:
+        with pytest.raises(RuntimeError):
+            future.result(0)
+    assert writer._queue.empty()
+    client.gate.set()
+    assert isinstance(in_flight.result(1), Location)
+
+
+def test_no_payload_is_left_queued_when_closing_under_load():
+    client = StubClient()
+    writer = SegmentWriter(client, "bucket", write_index=False, workers=2)
+    futures = []
+    lock = threading.Lock()
+
+    def append(start: int) -> None:
+        for number in range(start, start + 200):
+            try:
+                future = writer.append(str(number), b"x")
+            except RuntimeError:
+                return
+            with lock:
+                futures.append(future)
+
+    appenders = [
+        threading.Thread(target=append, args=(start,)) for start in range(0, 800, 200)
+    ]
+    for thread in appenders:
+        thread.start()
+    time.sleep(0.01)
+    writer.close()
+    for thread in appenders:
+        thread.join()
+
+    assert writer._queue.empty()
+    assert all(future.done() for future in futures)
+    stored = sum(len(body) for body in client.objects.values())
+    assert stored == len(futures)
+
+
+def test_each_caller_waits_at_most_its_own_timeout():
+    client = StubClient(blocked=True)
+    writer = SegmentWriter(client, "bucket", max_age=0, queue_size=1, workers=1)
+    writer.append("0", b"0")
+    assert client.entered.wait(1)
+    writer.append("1", b"1")
+    waits = []
+
+    def append(number: int) -> None:
+        started = time.monotonic()
+        with pytest.raises(Overloaded):
+            writer.append(str(number), b"x", timeout=0.1)
+        waits.append(time.monotonic() - started)
+
+    callers = [threading.Thread(target=append, args=(n,)) for n in range(2, 10)]
+    for thread in callers:
+        thread.start()
+    for thread in callers:
+        thread.join()
+
+    assert len(waits) == 8
+    assert max(waits) < 0.3
+    client.gate.set()
+    writer.close()